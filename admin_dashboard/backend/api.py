@@ -0,0 +1,95 @@
+"""Admin dashboard API served from inside the bot process.
+
+The endpoints act on the running ``Application``, so the server runs on the
+bot's event loop next to it. Every request must carry
+``Authorization: Bearer <ADMIN_API_TOKEN>``.
+
+* ``GET /profile``: the running and the last profiling session.
+* ``POST /profile?seconds=30&mode=sampling``: profiles the bot (see
+  ``profiling``) and answers with the profile file once the session ends.
+* ``GET /costs``: Firestore documents used per origin and operation since
+  startup (see ``firestore_costs``).
+
+Enable with ``ADMIN_API_PORT`` and ``ADMIN_API_TOKEN``; it listens on
+localhost only, so reach it through a tunnel or a reverse proxy.
+"""
+import asyncio
+import hmac
+from contextlib import contextmanager
+
+import structlog
+import uvicorn
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse
+
+import firestore_costs
+import profiling
+
+logger = structlog.get_logger(__name__)
+
+
+def create_app(application, token) -> FastAPI:
+    """Builds the dashboard API for ``application``, guarded by ``token``."""
+    app = FastAPI()
+
+    def require_token(request: Request) -> None:
+        supplied = request.headers.get('Authorization', '')
+        if not token or not hmac.compare_digest(supplied, f"Bearer {token}"):
+            raise HTTPException(status_code=401)
+
+    @app.get('/profile', dependencies=[Depends(require_token)])
+    async def profile_status():
+        return profiling.get_profiler(application.bot_data).status()
+
+    @app.post('/profile', dependencies=[Depends(require_token)])
+    async def start_profile(seconds: float = profiling.PROFILE_DEFAULT_SECONDS, mode: str = profiling.SAMPLING):
+        if mode not in profiling.PROFILE_MODES:
+            raise HTTPException(status_code=400, detail=f"mode must be one of {profiling.PROFILE_MODES}")
+        try:
+            session = await profiling.get_profiler(application.bot_data).run(mode, seconds)
+        except profiling.ProfilerError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        return FileResponse(session.path, media_type='application/octet-stream')
+
+    @app.get('/costs', dependencies=[Depends(require_token)])
+    async def firestore_usage():
+        usages = firestore_costs.COSTS.totals()
+        return {
+            'origins': {origin: usage.as_dict() for origin, usage in firestore_costs.by_origin(usages).items()},
+            'operations': [
+                {'origin': origin, 'operation': operation, **usage.as_dict()}
+                for (origin, operation), usage in usages.items()
+            ],
+        }
+
+    return app
+
+
+class _EmbeddedServer(uvicorn.Server):
+    """uvicorn server that leaves signal handling to the bot it runs inside."""
+
+    @contextmanager
+    def capture_signals(self):
+        yield
+
+
+class AdminServer:
+    """Runs the dashboard API on the running event loop."""
+
+    def __init__(self, application, port, token, host='127.0.0.1'):
+        self.port = port
+        self.host = host
+        self._server = _EmbeddedServer(uvicorn.Config(
+            create_app(application, token), host=host, port=port, log_config=None, lifespan='off',
+        ))
+        self._task = None
+
+    async def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._server.serve())
+        logger.info("Admin API started", host=self.host, port=self.port)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._server.should_exit = True
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
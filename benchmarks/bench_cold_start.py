@@ -0,0 +1,62 @@
+"""Benchmark for the serverless cold start.
+
+Each run starts a fresh interpreter, imports ``serverless`` and builds the
+Application with a stand-in Firestore client, timing both phases. Network
+calls made on the first invocation (``getMe``, Firestore channel setup) are
+not included. Exits non-zero when the median exceeds
+``serverless.COLD_START_TARGET_SECONDS``.
+
+Usage: python benchmarks/bench_cold_start.py [--runs N]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PROBE = """
+import json, sys, time
+from unittest.mock import MagicMock
+started = time.perf_counter()
+import serverless
+imported = time.perf_counter()
+serverless.create_application('123:ABC', MagicMock())
+built = time.perf_counter()
+print(json.dumps({'import': imported - started, 'build': built - imported,
+                  'target': serverless.COLD_START_TARGET_SECONDS}))
+"""
+
+
+def measure_once():
+    output = subprocess.run(
+        [sys.executable, '-c', _PROBE], cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    samples = [measure_once() for _ in range(args.runs)]
+    imports = [sample['import'] for sample in samples]
+    builds = [sample['build'] for sample in samples]
+    totals = [i + b for i, b in zip(imports, builds)]
+    target = samples[0]['target']
+    median = statistics.median(totals)
+
+    print(f"runs={args.runs}")
+    print(f"import median={statistics.median(imports):.3f}s build median={statistics.median(builds):.3f}s")
+    print(f"cold start median={median:.3f}s max={max(totals):.3f}s target={target:.1f}s")
+    if median > target:
+        print("FAIL: cold start is over target")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
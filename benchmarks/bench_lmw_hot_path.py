@@ -0,0 +1,92 @@
+"""Benchmark for the 'Last Message Wins' message hot path.
+
+Simulates the final seconds of a game in a single chat: every player sends
+their one message and then keeps spamming, all routed through
+``bot_main.main_message_handler`` exactly as the Application would.
+
+Usage: python benchmarks/bench_lmw_hot_path.py [--players N] [--messages N]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot_main
+from game_logic.registry import LAST_MESSAGE_WINS, get_registry
+from handlers import last_message_wins_game
+
+CHAT_ID = -100
+
+# Messages are dated from now so the lag monitor sees them as current, as it would during a live game
+GAME_START = datetime.now(timezone.utc)
+
+
+async def _noop_reply(*args, **kwargs):
+    return None
+
+
+def _build_game(player_count):
+    players = {
+        user_id: {'username': f'player{user_id}', 'mention': f'player{user_id}'}
+        for user_id in range(1, player_count + 1)
+    }
+    return {
+        'status': 'in_progress',
+        'players': players,
+        'pending_players': set(players),
+        'message_id': 1,
+        'xp_pot': player_count * 2,
+        'job': None,
+        'start_message_id': 1,
+        'deadline': GAME_START + timedelta(seconds=last_message_wins_game.LMW_GAME_DURATION),
+        'last_message_info': {'user_id': None, 'username': None, 'message_id': None, 'timestamp': None},
+    }
+
+
+def _build_updates(player_count, message_count):
+    chat = SimpleNamespace(id=CHAT_ID)
+    updates = []
+    for i in range(message_count):
+        user_id = (i % player_count) + 1
+        user = SimpleNamespace(id=user_id, username=f'player{user_id}', first_name='Player')
+        message = SimpleNamespace(
+            message_id=i + 2,
+            date=GAME_START + timedelta(seconds=(i * last_message_wins_game.LMW_GAME_DURATION) // message_count),
+            edit_date=None,
+            reply_text=_noop_reply,
+        )
+        updates.append(SimpleNamespace(effective_chat=chat, effective_user=user, message=message, effective_message=message))
+    return updates
+
+
+async def run(player_count, message_count):
+    context = SimpleNamespace(chat_data={'lmw_game': _build_game(player_count)}, user_data={}, bot_data={})
+    get_registry(context.bot_data).register(CHAT_ID, LAST_MESSAGE_WINS, route_messages=True)
+    updates = _build_updates(player_count, message_count)
+
+    start = time.perf_counter()
+    for update in updates:
+        await bot_main.main_message_handler(update, context)
+    elapsed = time.perf_counter() - start
+
+    winner = context.chat_data['lmw_game']['last_message_info']
+    print(f"players={player_count} messages={message_count} elapsed={elapsed:.4f}s")
+    print(f"throughput={message_count / elapsed:,.0f} messages/sec per chat")
+    print(f"winner user_id={winner['user_id']} message_id={winner['message_id']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, default=500)
+    parser.add_argument('--messages', type=int, default=50_000)
+    args = parser.parse_args()
+    asyncio.run(run(args.players, args.messages))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+"""In-memory stand-in for the part of the Firestore client that ``database`` uses.
+
+Documents live in dicts keyed by their collection's path. Every RPC (a
+get, a query, a ``get_all``, a commit) can sleep for ``latency`` seconds to
+mimic a network round trip; like the real client, the sleep blocks the
+calling thread.
+Transactions run their function once and commit, as an uncontended
+Firestore transaction would.
+
+``install()`` swaps ``database.firestore`` for ``FakeFirestoreModule`` so the
+transactional decorator, ``Increment``, ``FieldFilter`` and ``Query``
+constants resolve without firebase_admin. Benchmarks only; never imported by
+the bot.
+"""
+import threading
+import time
+
+_OPERATORS = {
+    '==': lambda left, right: left == right,
+    '<=': lambda left, right: left is not None and left <= right,
+    '<': lambda left, right: left is not None and left < right,
+    '>=': lambda left, right: left is not None and left >= right,
+    '>': lambda left, right: left is not None and left > right,
+}
+
+
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
+
+class FieldFilter:
+    def __init__(self, field_path, op_string, value):
+        self.field_path = field_path
+        self.op_string = op_string
+        self.value = value
+
+
+class Query:
+    ASCENDING = 'ASCENDING'
+    DESCENDING = 'DESCENDING'
+
+    def __init__(self, client, path, filters=(), order=None, limit=None, start_after=None):
+        self._client = client
+        self._path = path
+        self._filters = tuple(filters)
+        self._order = order
+        self._limit = limit
+        self._start_after = start_after
+
+    def _copy(self, **changes):
+        values = dict(filters=self._filters, order=self._order, limit=self._limit, start_after=self._start_after)
+        values.update(changes)
+        return Query(self._client, self._path, **values)
+
+    def where(self, filter):
+        return self._copy(filters=self._filters + (filter,))
+
+    def order_by(self, field_path, direction=ASCENDING):
+        return self._copy(order=(field_path, direction))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, snapshot):
+        return self._copy(start_after=snapshot)
+
+    def stream(self):
+        self._client._round_trip()
+        snapshots = [
+            snapshot for snapshot in self._client._list(self._path)
+            if all(_OPERATORS[f.op_string](snapshot.to_dict().get(f.field_path), f.value) for f in self._filters)
+        ]
+        if self._order is not None:
+            field_path, direction = self._order
+            descending = direction == Query.DESCENDING
+
+            def sort_key(snapshot):
+                value = snapshot.to_dict().get(field_path, 0)
+                return (-value if descending else value, snapshot.id)
+
+            snapshots.sort(key=sort_key)
+            if self._start_after is not None:
+                cursor = sort_key(self._start_after)
+                snapshots = [snapshot for snapshot in snapshots if sort_key(snapshot) > cursor]
+        if self._limit is not None:
+            snapshots = snapshots[:self._limit]
+        return iter(snapshots)
+
+
+class CollectionReference(Query):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+        self.id = path[-1]
+
+    def document(self, document_id):
+        return DocumentReference(self._client, self._path + (str(document_id),))
+
+
+class DocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.id = path[-1]
+
+    def collection(self, name):
+        return CollectionReference(self._client, self.path + (name,))
+
+    def get(self, transaction=None):
+        self._client._round_trip()
+        return self._client._snapshot(self)
+
+    def set(self, data, merge=False):
+        self._client._round_trip()
+        self._client._write(self, data, merge=merge)
+
+    def update(self, data):
+        self._client._round_trip()
+        self._client._write(self, data, merge=True)
+
+    def delete(self):
+        self._client._round_trip()
+        self._client._delete(self)
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class WriteBatch:
+    """Writes applied together on ``commit``; also serves as the transaction object."""
+
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append((reference, data, merge, False))
+
+    def update(self, reference, data):
+        self._writes.append((reference, data, True, False))
+
+    def delete(self, reference):
+        self._writes.append((reference, None, False, True))
+
+    def commit(self):
+        self._client._round_trip()
+        with self._client._lock:
+            for reference, data, merge, delete in self._writes:
+                if delete:
+                    self._client._delete(reference)
+                else:
+                    self._client._write(reference, data, merge=merge)
+        self._writes = []
+
+
+Transaction = WriteBatch
+
+
+class FakeFirestore:
+    """The client: collections, batches, transactions and ``get_all``."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.round_trips = 0
+        self._collections = {}  # collection path tuple -> {document id: data}
+        self._lock = threading.RLock()
+
+    def collection(self, name):
+        return CollectionReference(self, (name,))
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def transaction(self):
+        return Transaction(self)
+
+    def get_all(self, references, transaction=None):
+        self._round_trip()
+        return [self._snapshot(reference) for reference in references]
+
+    def _round_trip(self):
+        self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _snapshot(self, reference):
+        with self._lock:
+            data = self._collections.get(reference.path[:-1], {}).get(reference.id)
+            return DocumentSnapshot(reference, dict(data) if data is not None else None)
+
+    def _list(self, path):
+        with self._lock:
+            documents = list(self._collections.get(path, {}).items())
+        return [
+            DocumentSnapshot(DocumentReference(self, path + (document_id,)), dict(data))
+            for document_id, data in documents
+        ]
+
+    def _write(self, reference, data, merge=False):
+        with self._lock:
+            collection = self._collections.setdefault(reference.path[:-1], {})
+            current = dict(collection.get(reference.id) or {}) if merge else {}
+            for key, value in data.items():
+                if isinstance(value, Increment):
+                    value = current.get(key, 0) + value.value
+                current[key] = value
+            collection[reference.id] = current
+
+    def _delete(self, reference):
+        with self._lock:
+            self._collections.get(reference.path[:-1], {}).pop(reference.id, None)
+
+
+class FakeFirestoreModule:
+    """Replaces ``database.firestore``."""
+
+    Increment = Increment
+    FieldFilter = FieldFilter
+    Query = Query
+
+    @staticmethod
+    def transactional(func):
+        def run(transaction, *args, **kwargs):
+            result = func(transaction, *args, **kwargs)
+            transaction.commit()
+            return result
+        return run
+
+
+def install():
+    """Points ``database`` at the fake Firestore module. Returns the module it replaced."""
+    import database
+
+    previous, database.firestore = database.firestore, FakeFirestoreModule
+    return previous
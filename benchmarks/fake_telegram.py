@@ -0,0 +1,66 @@
+"""Local stand-in for the Telegram Bot API.
+
+``LocalBotApi`` is the bot's ``metrics.InstrumentedRequest`` with the HTTP
+call replaced by a canned answer, so Bot API calls are still counted and
+timed per method. Each answer can wait ``latency`` seconds to mimic the
+round trip to Telegram. Replies are built from the request, so PTB parses
+them into real ``Message`` objects. Benchmarks only; never imported by the
+bot.
+"""
+import asyncio
+import itertools
+import json
+import time
+
+from telegram.request import HTTPXRequest
+
+import metrics
+
+BOT_USER = {'id': 4242, 'is_bot': True, 'first_name': 'Yunks', 'username': 'yunks_bench_bot'}
+
+
+def user_json(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+
+
+def chat_json(chat_id):
+    return {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup', 'title': f'Chat {chat_id}'}
+
+
+class _CannedAnswers(HTTPXRequest):
+    """Answers every Bot API call locally instead of over HTTP."""
+
+    def __init__(self, latency=0.0, admins_for=None, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.admins_for = admins_for or (lambda chat_id: ())
+        self._message_ids = itertools.count(1_000_000)
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        parameters = request_data.parameters if request_data is not None else {}
+        result = self._answer(url.rsplit('/', 1)[-1], parameters)
+        return 200, json.dumps({'ok': True, 'result': result}).encode('utf-8')
+
+    def _answer(self, api_method, parameters):
+        if api_method == 'getMe':
+            return BOT_USER
+        chat_id = int(parameters['chat_id']) if 'chat_id' in parameters else None
+        if api_method == 'getChatAdministrators':
+            return [{'status': 'creator', 'user': user_json(user_id), 'is_anonymous': False}
+                    for user_id in self.admins_for(chat_id)]
+        if api_method.startswith(('send', 'edit', 'copy', 'forward')) and chat_id is not None:
+            return {
+                'message_id': int(parameters.get('message_id') or next(self._message_ids)),
+                'date': int(time.time()),
+                'chat': chat_json(chat_id),
+                'from': BOT_USER,
+                'text': parameters.get('text') or '',
+            }
+        return True
+
+
+class LocalBotApi(metrics.InstrumentedRequest, _CannedAnswers):
+    """``InstrumentedRequest`` whose calls are answered by ``_CannedAnswers``."""
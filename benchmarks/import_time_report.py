@@ -0,0 +1,67 @@
+"""Import-time report for bot startup.
+
+Runs ``python -X importtime -c "import bot_main"`` in a fresh interpreter and
+reports the slowest modules. Fails (exit code 1) when importing ``bot_main``
+takes longer than ``--target`` seconds, or when a module that should load
+lazily (Firebase, the Firestore client) is imported at startup.
+
+Usage: python benchmarks/import_time_report.py [--target SECONDS] [--top N]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STARTUP_IMPORT_TARGET_SECONDS = 0.35
+# Modules that must only load on first use
+DEFERRED_MODULES = ('firebase_admin', 'google.cloud.firestore', 'fastapi', 'uvicorn')
+
+
+def collect(module='bot_main'):
+    """Returns ``[(name, self_us, cumulative_us, depth)]`` in import order."""
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' '))) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', type=float, default=STARTUP_IMPORT_TARGET_SECONDS)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    rows = collect()
+    total = next(cumulative for name, _, cumulative, _ in reversed(rows) if name == 'bot_main') / 1e6
+
+    print(f"{'cumulative':>12} {'self':>10}  module")
+    for name, self_us, cumulative_us, depth in sorted(rows, key=lambda row: row[2], reverse=True)[:args.top]:
+        print(f"{cumulative_us / 1000:10.1f}ms {self_us / 1000:8.1f}ms  {'  ' * depth}{name}")
+    print(f"\nimport bot_main: {total:.3f}s (target {args.target:.2f}s)")
+
+    failed = False
+    eager = sorted({name for name, *_ in rows for deferred in DEFERRED_MODULES
+                    if name == deferred or name.startswith(deferred + '.')})
+    if eager:
+        print(f"FAIL: imported at startup but should load lazily: {', '.join(eager[:5])}")
+        failed = True
+    if total > args.target:
+        print("FAIL: startup imports are over target")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+"""End-to-end load generator for the bot.
+
+Builds the real Application with ``bot_main.build_application`` and runs it
+like production: initialized, started and ``post_init`` run. It then feeds
+synthetic updates for N chats x M users through the update processor, the
+same way the ASGI webhook front-end does. Bot API calls are answered by
+``fake_telegram.LocalBotApi`` and Firestore is kept in memory by
+``fake_firestore``; both can add a per-call latency.
+
+The mix of update kinds is configurable:
+
+* ``chatter``: plain group messages that earn passive XP
+* ``command``: /profile, /leaderboard, /help and /start
+* ``callback``: main menu button presses
+* ``game``: 'Guess the Number', i.e. /start_game followed by guesses
+
+The report gives throughput, end-to-end latency per kind (from submission
+to finished handling, including the wait for a processing slot), handler
+latency per handler (from update traces), Bot API calls by method and
+Firestore documents by origin.
+
+Usage: python benchmarks/load_generator.py [--chats N] [--users M] [--updates N] [--rate R]
+       [--mix chatter=80,command=10,callback=5,game=5] [--api-latency S] [--db-latency S]
+       [--concurrency N] [--no-ledger] [--json]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_telegram import BOT_USER, chat_json, user_json  # noqa: E402
+
+DEFAULT_MIX = 'chatter=80,command=10,callback=5,game=5'
+COMMANDS = ('/profile', '/leaderboard', '/help', '/start')
+MENU_BUTTONS = ('menu:profile', 'menu:leaderboard', 'menu:help')
+GUESSES_PER_GAME = 7  # Matches the tries a 'Guess the Number' game allows
+
+
+def parse_mix(spec):
+    """Parses ``"kind=weight,..."`` into ``{kind: weight}``."""
+    mix = {}
+    for entry in spec.split(','):
+        kind, _, weight = entry.partition('=')
+        if kind.strip() not in ('chatter', 'command', 'callback', 'game'):
+            raise argparse.ArgumentTypeError(f"unknown update kind {kind!r}")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Workload:
+    """Synthetic updates as Telegram would send them, for ``chats`` groups of ``users`` members."""
+
+    def __init__(self, chats, users, mix, seed=0):
+        self.chat_ids = [-1_000_000_000_000 - index for index in range(chats)]
+        self.users = users
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self._random = random.Random(seed)
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._guesses_left = {}  # (chat_id, user_id) -> guesses before the game is over
+
+    def members(self, chat_id):
+        index = -1_000_000_000_000 - chat_id
+        return range(index * self.users + 1, (index + 1) * self.users + 1)
+
+    def next_update(self):
+        """Returns ``(kind, update JSON)``."""
+        kind = self._random.choices(self.kinds, self.weights)[0]
+        chat_id = self._random.choice(self.chat_ids)
+        user_id = self._random.choice(self.members(chat_id))
+        if kind == 'chatter':
+            return kind, self._message(chat_id, user_id, f"message {self._random.random():.6f} from the load generator")
+        if kind == 'command':
+            return kind, self._message(chat_id, user_id, self._random.choice(COMMANDS))
+        if kind == 'callback':
+            return kind, self._callback(chat_id, user_id, self._random.choice(MENU_BUTTONS))
+        # One game per user and chat: start it, then guess until it must be over
+        key = (chat_id, user_id)
+        left = self._guesses_left.get(key, 0)
+        if left == 0:
+            self._guesses_left[key] = GUESSES_PER_GAME
+            return kind, self._message(chat_id, user_id, '/start_game')
+        self._guesses_left[key] = left - 1
+        return kind, self._message(chat_id, user_id, str(self._random.randint(1, 100)))
+
+    def _message(self, chat_id, user_id, text):
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': chat_json(chat_id),
+            'from': user_json(user_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': next(self._update_ids), 'message': message}
+
+    def _callback(self, chat_id, user_id, data):
+        return {
+            'update_id': next(self._update_ids),
+            'callback_query': {
+                'id': str(next(self._message_ids)),
+                'from': user_json(user_id),
+                'chat_instance': str(chat_id),
+                'data': data,
+                'message': {
+                    'message_id': next(self._message_ids),
+                    'date': int(time.time()),
+                    'chat': chat_json(chat_id),
+                    'from': BOT_USER,
+                    'text': 'Main menu',
+                },
+            },
+        }
+
+
+class _HandlerTimes:
+    """Trace exporter that keeps each update's duration by the handler that ran it."""
+
+    def __init__(self):
+        self.durations = {}
+
+    def export(self, trace, duration) -> None:
+        self.durations.setdefault(trace.attributes.get('handler', 'unhandled'), []).append(duration)
+
+
+async def run(args):
+    import bot_main
+    import database
+    import fake_firestore
+    import firestore_costs
+    import metrics
+    import tracing
+    import xp_ledger
+    from fake_telegram import LocalBotApi
+    from telegram import Update
+
+    fake_firestore.install()
+    db_client = fake_firestore.FakeFirestore(latency=args.db_latency)
+    workload = Workload(args.chats, args.users, args.mix, seed=args.seed)
+    handler_times = _HandlerTimes()
+    tracing.set_tracer(tracing.Tracer(handler_times, sample_rate=1.0))
+    if not args.no_ledger:
+        # As in production, minus the journal file and the jobs; flushed and compacted at the end
+        database.set_xp_ledger(xp_ledger.XpLedger())
+
+    application = bot_main.build_application(
+        '123456:LOADTEST', db_client, updater=False, background_jobs=False,
+        request=LocalBotApi(latency=args.api_latency, admins_for=workload.members),
+    )
+    await application.initialize()
+    await application.start()
+    await application.post_init(application)
+
+    latencies = {}
+    tasks = []
+
+    async def handle(kind, update):
+        submitted = time.perf_counter()
+        await application.update_processor.process_update(update, application.process_update(update))
+        latencies.setdefault(kind, []).append(time.perf_counter() - submitted)
+
+    started = time.perf_counter()
+    for index in range(args.updates):
+        if args.rate:
+            delay = started + index / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        kind, data = workload.next_update()
+        tasks.append(asyncio.create_task(handle(kind, Update.de_json(data, application.bot))))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    await application.stop()
+    ledger = database.get_xp_ledger()
+    if ledger is not None:
+        with firestore_costs.attributed_to('job:compact_xp_ledger'):
+            await ledger.compact(db_client)
+    await application.post_shutdown(application)
+    await application.shutdown()
+    tracing.set_tracer(None)
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        'updates': args.updates,
+        'chats': args.chats,
+        'users_per_chat': args.users,
+        'elapsed_seconds': elapsed,
+        'updates_per_second': args.updates / elapsed,
+        'latency': _summary(all_latencies),
+        'latency_by_kind': {kind: _summary(values) for kind, values in sorted(latencies.items())},
+        'handler_latency': {name: _summary(values) for name, values in sorted(handler_times.durations.items())},
+        'bot_api_calls': _bot_api_calls(metrics),
+        'firestore': {origin: usage.as_dict() for origin, usage in
+                      firestore_costs.by_origin(firestore_costs.COSTS.totals()).items()},
+        'firestore_round_trips': db_client.round_trips,
+    }
+
+
+def _summary(values):
+    return {
+        'count': len(values),
+        'p50_ms': percentile(values, 0.50) * 1000,
+        'p99_ms': percentile(values, 0.99) * 1000,
+        'mean_ms': statistics.fmean(values) * 1000 if values else 0.0,
+    }
+
+
+def _bot_api_calls(metrics):
+    calls = {}
+    for line in metrics.TELEGRAM_REQUESTS.render():
+        if line.startswith(metrics.TELEGRAM_REQUESTS.name):
+            labels, value = line.rsplit(' ', 1)
+            method = labels.split('method="', 1)[1].split('"', 1)[0]
+            calls[method] = calls.get(method, 0) + int(value)
+    return calls
+
+
+def print_report(result):
+    print(f"chats={result['chats']} users/chat={result['users_per_chat']} updates={result['updates']}")
+    print(f"elapsed={result['elapsed_seconds']:.3f}s throughput={result['updates_per_second']:,.0f} updates/sec")
+    print(f"latency p50={result['latency']['p50_ms']:.2f}ms p99={result['latency']['p99_ms']:.2f}ms")
+    print("end-to-end latency by kind:")
+    for kind, summary in result['latency_by_kind'].items():
+        print(f"  {kind:<10} n={summary['count']:<7} p50={summary['p50_ms']:8.2f}ms p99={summary['p99_ms']:8.2f}ms")
+    print("handler latency:")
+    for name, summary in result['handler_latency'].items():
+        print(f"  {name:<36} n={summary['count']:<7} p50={summary['p50_ms']:8.2f}ms p99={summary['p99_ms']:8.2f}ms")
+    print("Bot API calls: " + ', '.join(f"{method}={count}" for method, count in sorted(result['bot_api_calls'].items())))
+    print(f"Firestore round trips={result['firestore_round_trips']}")
+    for origin, usage in sorted(result['firestore'].items(), key=lambda item: -item[1]['cost_usd']):
+        print(f"  {origin:<36} reads={usage['reads']:<7} writes={usage['writes']:<7} deletes={usage['deletes']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chats', type=int, default=20)
+    parser.add_argument('--users', type=int, default=50, help="members per chat")
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--rate', type=float, default=0, help="updates per second to submit; 0 submits all at once")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument('--api-latency', type=float, default=0.0, help="seconds per Bot API call")
+    parser.add_argument('--db-latency', type=float, default=0.0, help="seconds per Firestore round trip")
+    parser.add_argument('--concurrency', type=int, default=None, help="UPDATE_CONCURRENCY for the update processor")
+    parser.add_argument('--no-ledger', action='store_true', help="write passive XP in place instead of the XP ledger")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="print the result as JSON")
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    # Read when bot_main is imported
+    os.environ['LOG_LEVEL'] = args.log_level
+    if args.concurrency is not None:
+        os.environ['UPDATE_CONCURRENCY'] = str(args.concurrency)
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+
+if __name__ == '__main__':
+    main()
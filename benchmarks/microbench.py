@@ -0,0 +1,519 @@
+"""Micro-benchmarks for the bot's hot paths, with saved baselines.
+
+Each benchmark times one operation in isolation against lightweight fakes
+(the Bot API is a no-op, Firestore is ``fake_firestore`` with no latency):
+
+* ``handle_message.*``: passive XP through the XP ledger and as a transaction
+* ``main_message_handler.*``: routing a chat message to passive XP or a running game
+* ``lastman.*`` / ``lmw.*``: joining a lobby and one 'Last Person Standing' elimination
+* ``leaderboard.*``: rendering a page of entries and the cached /leaderboard command
+* ``database.*``: every ``database`` operation against a seeded store
+
+An operation runs in rounds long enough to time reliably (like ``timeit``'s
+autorange); the report gives the median and fastest time per operation.
+Save a baseline on the reference build and compare a candidate against it on
+the same machine; the comparison exits with status 1 when any benchmark's
+fastest round is slower by more than ``--threshold``. The fastest round is
+compared because noise from the rest of the machine only ever adds time.
+Baselines are machine-specific, so compare only against one saved on the
+same host.
+
+Usage: python benchmarks/microbench.py [--filter SUBSTRING] [--rounds N] [--min-time S]
+       [--save baseline.json] [--compare baseline.json [--threshold 0.10]] [--json]
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CHAT_ID = -100
+SEEDED_USERS = 200  # users in the store; the fake scans them all for every query
+LOBBY_PLAYERS = 20  # players already in a lobby when another one joins
+ELIMINATION_PLAYERS = 50  # players left in a 'Last Person Standing' game
+BATCH_SIZE = 50  # documents per batched database call
+
+# Messages dated in the future leave the lag monitor at zero lag, so load shedding never kicks in
+FUTURE = datetime.now(timezone.utc) + timedelta(days=1)
+
+BENCHMARKS = {}  # name -> async context manager factory yielding an Operation
+
+
+class Operation:
+    """What a benchmark times: ``call()`` and, when each call consumes its state, an untimed ``reset()``."""
+
+    def __init__(self, call, reset=None):
+        self.call = call
+        self.reset = reset
+
+
+def benchmark(name):
+    """Registers an async generator that sets up state, yields an ``Operation`` and cleans up."""
+    def register(setup):
+        BENCHMARKS[name] = asynccontextmanager(setup)
+        return setup
+    return register
+
+
+async def _noop(*args, **kwargs):
+    return SimpleNamespace(message_id=1, date=FUTURE)
+
+
+class _Bot:
+    """Bot API stand-in whose calls return a message without doing anything."""
+
+    send_message = edit_message_text = staticmethod(_noop)
+
+
+def _context(db_client=None, chat_data=None, args=()):
+    return SimpleNamespace(
+        bot=_Bot(), bot_data={'db': db_client}, chat_data={} if chat_data is None else chat_data, user_data={},
+        args=list(args), job_queue=SimpleNamespace(run_once=lambda *args, **kwargs: None),
+    )
+
+
+def _user(user_id):
+    from telegram import User
+
+    return User(id=user_id, first_name=f'User{user_id}', is_bot=False, username=f'user{user_id}')
+
+
+def _message_update(user_id, text='hello there', chat_id=CHAT_ID):
+    message = SimpleNamespace(message_id=10, date=FUTURE, edit_date=None, text=text, reply_text=_noop,
+                              reply_html=_noop)
+    return SimpleNamespace(
+        effective_user=_user(user_id), effective_chat=SimpleNamespace(id=chat_id, type='supergroup'),
+        effective_message=message, message=message, callback_query=None,
+    )
+
+
+def _callback_update(user_id, data):
+    query = SimpleNamespace(
+        data=data, from_user=_user(user_id), answer=_noop, edit_message_text=_noop,
+        message=SimpleNamespace(chat_id=CHAT_ID, message_id=1, reply_markup=None),
+    )
+    return SimpleNamespace(
+        effective_user=query.from_user, effective_chat=SimpleNamespace(id=CHAT_ID, type='supergroup'),
+        callback_query=query, message=None,
+    )
+
+
+def _store(users=SEEDED_USERS, chat_id=CHAT_ID):
+    """A fake Firestore with ``users`` users, each also a member of ``chat_id``."""
+    import fake_firestore
+
+    store = fake_firestore.FakeFirestore()
+    batch = store.batch()
+    for user_id in range(1, users + 1):
+        data = {'username': f'user{user_id}', 'xp': 10_000 + user_id}
+        batch.set(store.collection('users').document(str(user_id)), data)
+        batch.set(store.collection('chats').document(str(chat_id)).collection('members').document(str(user_id)), data)
+    batch.commit()
+    return store
+
+
+@asynccontextmanager
+async def _ledger():
+    import database
+    import xp_ledger
+
+    database.set_xp_ledger(xp_ledger.XpLedger())
+    try:
+        yield
+    finally:
+        database.set_xp_ledger(None)
+
+
+# --- Message handling -------------------------------------------------------
+
+@benchmark('handle_message.ledger')
+async def _handle_message_ledger():
+    from handlers import messages
+
+    update, context = _message_update(7), _context(_store(users=10))
+    async with _ledger():
+        yield Operation(lambda: messages.handle_message(update, context))
+
+
+@benchmark('handle_message.transaction')
+async def _handle_message_transaction():
+    from handlers import messages
+
+    update, context = _message_update(7), _context(_store(users=10))
+    yield Operation(lambda: messages.handle_message(update, context))
+
+
+@benchmark('main_message_handler.passive_xp')
+async def _route_passive_xp():
+    import bot_main
+
+    update, context = _message_update(7), _context(_store(users=10))
+    async with _ledger():
+        yield Operation(lambda: bot_main.main_message_handler(update, context))
+
+
+@benchmark('main_message_handler.lmw_game')
+async def _route_lmw_game():
+    import bot_main
+    from game_logic.registry import LAST_MESSAGE_WINS, get_registry
+
+    # A player who already sent their one message keeps typing, the common case late in a game
+    players = {user_id: {'username': f'user{user_id}', 'mention': f'user{user_id}'} for user_id in range(1, 101)}
+    game = {
+        'status': 'in_progress', 'players': players, 'pending_players': set(players) - {7},
+        'message_id': 1, 'xp_pot': 0, 'job': None, 'start_message_id': 1, 'deadline': FUTURE,
+        'last_message_info': {'user_id': None, 'username': None, 'message_id': None, 'timestamp': None},
+    }
+    update, context = _message_update(7), _context(chat_data={'lmw_game': game})
+    get_registry(context.bot_data).register(CHAT_ID, LAST_MESSAGE_WINS, route_messages=True)
+    yield Operation(lambda: bot_main.main_message_handler(update, context))
+
+
+# --- Games --------------------------------------------------------------------
+
+def _lobby(players):
+    return {
+        user_id: {'username': f'user{user_id}', 'mention': _user(user_id).mention_html()}
+        for user_id in range(1, players + 1)
+    }
+
+
+@benchmark('lastman.join')
+async def _lastman_join():
+    from handlers import lastman_game
+
+    game = {'status': 'lobby', 'players': _lobby(LOBBY_PLAYERS), 'message_id': 1, 'job': None}
+    joiner = LOBBY_PLAYERS + 1
+    update = _callback_update(joiner, lastman_game.LASTMAN_JOIN_DATA)
+    context = _context(chat_data={'lastman_game': game})
+    yield Operation(
+        lambda: lastman_game.lastman_callback_handler(update, context),
+        reset=lambda: game['players'].pop(joiner, None),
+    )
+
+
+@benchmark('lmw.join')
+async def _lmw_join():
+    from handlers import last_message_wins_game
+
+    game = {
+        'status': 'lobby', 'players': _lobby(LOBBY_PLAYERS), 'message_id': 1, 'xp_pot': 0, 'job': None,
+        'last_message_info': {'user_id': None, 'username': None, 'message_id': None, 'timestamp': None},
+    }
+    joiner = LOBBY_PLAYERS + 1
+    update = _callback_update(joiner, last_message_wins_game.LMW_JOIN_DATA)
+    context = _context(_store(users=LOBBY_PLAYERS + 1), chat_data={'lmw_game': game})
+    yield Operation(
+        lambda: last_message_wins_game.lmw_callback_handler(update, context),
+        reset=lambda: game['players'].pop(joiner, None),
+    )
+
+
+@benchmark('lastman.perform_elimination')
+async def _perform_elimination():
+    from handlers import lastman_game
+
+    players = _lobby(ELIMINATION_PLAYERS)
+    game = {'status': 'in_progress', 'players': players, 'players_remaining': [], 'eliminated_players': [],
+            'round': 0, 'message_id': 1, 'job': None}
+    context = _context(chat_data={'lastman_game': game})
+    context.job = SimpleNamespace(data={'chat_id': CHAT_ID})
+
+    def reset():
+        game['players_remaining'] = list(players)
+        game['eliminated_players'] = []
+
+    yield Operation(lambda: lastman_game.perform_elimination(context), reset=reset)
+
+
+# --- Leaderboard --------------------------------------------------------------
+
+@benchmark('leaderboard.render_entries')
+async def _render_entries():
+    import leaderboards
+    from handlers import core
+
+    entries = [(f'user{rank}', 100_000 - rank) for rank in range(1, leaderboards.LEADERBOARD_PAGE_SIZE + 1)]
+
+    async def render():
+        core._render_leaderboard_entries(entries, start_rank=1)
+
+    yield Operation(render)
+
+
+@benchmark('leaderboard.command')
+async def _leaderboard_command():
+    from handlers import core
+
+    # The first call reads the snapshot; timed calls are served from the pager's cache, as most are
+    update, context = _message_update(7, '/leaderboard'), _context(_store())
+    await core.leaderboard(update, context)
+    yield Operation(lambda: core.leaderboard(update, context))
+
+
+# --- Database -----------------------------------------------------------------
+
+def _database(name, call, prepare=None, reset=None, users=SEEDED_USERS):
+    """Registers ``database.<name>`` timing ``call(store)``.
+
+    ``prepare(store)`` runs once before timing; ``reset(store)`` before each timed call.
+    """
+    @benchmark(f'database.{name}')
+    async def setup():
+        store = _store(users)
+        if prepare is not None:
+            prepare(store)
+
+        async def timed():
+            result = call(store)
+            if asyncio.iscoroutine(result):
+                await result
+
+        yield Operation(timed, reset=(lambda: reset(store)) if reset is not None else None)
+
+
+def _events(count, user_ids=range(1, BATCH_SIZE + 1)):
+    import database
+
+    return [database.new_xp_event(user_ids[index % len(user_ids)], f'user{index}', 1, 'message', chat_id=CHAT_ID)
+            for index in range(count)]
+
+
+def _register_database_benchmarks():
+    import database
+
+    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    deltas = [((today, user_id), (3, f'user{user_id}')) for user_id in range(1, BATCH_SIZE + 1)]
+    events = _events(BATCH_SIZE)
+    event_ids = [event['id'] for event in events]
+    timers = {f'timer{index}': {'due_at': 0, 'callback': 'noop'} for index in range(BATCH_SIZE)}
+
+    def mark_unapplied(store):
+        batch = store.batch()
+        for event_id in event_ids:
+            batch.update(store.collection(database.XP_EVENTS_COLLECTION).document(event_id), {'applied': False})
+        batch.commit()
+
+    def rearm_timers(store):
+        batch = store.batch()
+        for timer_name, timer in timers.items():
+            batch.set(store.collection(database.SERVERLESS_TIMERS_COLLECTION).document(timer_name), timer)
+        batch.commit()
+
+    _database('ping', database.ping)
+    _database('get_user_data', lambda store: database.get_user_data(store, 7))
+    _database('prefetch_users', lambda store: database.prefetch_users(store, list(range(1, BATCH_SIZE + 1))))
+    _database('add_xp', lambda store: database.add_xp(store, 7, 'user7', 1))
+    _database('add_xp.chat', lambda store: database.add_xp(store, 7, 'user7', 1, chat_id=CHAT_ID, reason='message'))
+    _database('transfer_xp', lambda store: database.transfer_xp(store, 7, 8, 1))
+    _database('get_leaderboard', lambda store: database.get_leaderboard(store, limit=10))
+    _database('get_leaderboard_page', lambda store: database.get_leaderboard_page(store, 10))
+    _database('get_chat_leaderboard', lambda store: database.get_chat_leaderboard(store, CHAT_ID, limit=10))
+    _database('flush_daily_xp', lambda store: database.flush_daily_xp(store, deltas))
+    _database('get_daily_xp', lambda store: database.get_daily_xp(store, today),
+              prepare=lambda store: database.flush_daily_xp(store, deltas))
+    _database('write_xp_events', lambda store: database.write_xp_events(store, events))
+    _database('get_existing_xp_event_ids', lambda store: database.get_existing_xp_event_ids(store, event_ids),
+              prepare=lambda store: database.write_xp_events(store, events))
+    _database('get_unapplied_xp_event_ids', lambda store: database.get_unapplied_xp_event_ids(store, BATCH_SIZE),
+              prepare=lambda store: database.write_xp_events(store, events))
+    _database('apply_xp_events', lambda store: database.apply_xp_events(store, event_ids),
+              prepare=lambda store: database.write_xp_events(store, events), reset=mark_unapplied)
+    _database('get_xp_events', lambda store: database.get_xp_events(store, 7),
+              prepare=lambda store: database.write_xp_events(store, events))
+    _database('get_recent_activity', database.get_recent_activity,
+              prepare=lambda store: database.save_recent_activity(store, list(range(1, 201))))
+    _database('save_recent_activity',
+              lambda store: database.save_recent_activity(store, list(range(1, 201))))
+    _database('get_states', lambda store: database.get_states(store, ['chat:-100', 'user:7', 'missing']),
+              prepare=lambda store: database.set_states(store, {'chat:-100': {'games': []}, 'user:7': {'game': None}}))
+    _database('set_states', lambda store: database.set_states(store, {'chat:-100': {'games': []}, 'user:7': {}}))
+    _database('acquire_lease', lambda store: database.acquire_lease(store, 'chat:-100', 'bench', 30))
+    _database('release_lease', lambda store: database.release_lease(store, 'chat:-100', 'bench'),
+              reset=lambda store: database.acquire_lease(store, 'chat:-100', 'bench', 30))
+    _database('save_timers', lambda store: database.save_timers(store, timers, removed=['gone']))
+    _database('claim_due_timers', lambda store: database.claim_due_timers(store, time.time(), BATCH_SIZE, 'bench', 60),
+              reset=rearm_timers)
+
+    @benchmark('database.append_xp')
+    async def _append_xp():
+        async with _ledger():
+            async def append():
+                database.append_xp(7, 'user7', 1, 'message', chat_id=CHAT_ID)
+            yield Operation(append)
+
+
+# --- Measuring ----------------------------------------------------------------
+
+async def _time(operation, iterations):
+    """Seconds taken by ``iterations`` calls, excluding resets."""
+    call, reset = operation.call, operation.reset
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        if reset is None:
+            started = time.perf_counter()
+            for _ in range(iterations):
+                await call()
+            return time.perf_counter() - started
+        elapsed = 0.0
+        for _ in range(iterations):
+            reset()
+            started = time.perf_counter()
+            await call()
+            elapsed += time.perf_counter() - started
+        return elapsed
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+async def measure(operation, rounds, min_time):
+    """Returns timings per call in nanoseconds over ``rounds`` rounds of at least ``min_time`` seconds."""
+    # Calibrating doubles as the warmup: caches are filled and code paths are hot before the first round
+    iterations = 1
+    while True:
+        elapsed = await _time(operation, iterations)
+        if elapsed >= min_time:
+            break
+        iterations = max(iterations * 2, int(iterations * min_time / elapsed * 1.2) if elapsed else 0)
+    per_call = [await _time(operation, iterations) / iterations * 1e9 for _ in range(rounds)]
+    return {
+        'median_ns': statistics.median(per_call),
+        'min_ns': min(per_call),
+        'stdev_ns': statistics.stdev(per_call) if len(per_call) > 1 else 0.0,
+        'iterations': iterations,
+        'rounds': rounds,
+    }
+
+
+async def run(names, rounds, min_time, progress=None):
+    import fake_firestore
+
+    previous = fake_firestore.install()
+    results = {}
+    try:
+        for name in names:
+            async with BENCHMARKS[name]() as operation:
+                results[name] = await measure(operation, rounds, min_time)
+            if progress is not None:
+                progress(name, results[name])
+    finally:
+        import database
+        database.firestore = previous
+    return results
+
+
+def machine():
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+# --- Reporting ----------------------------------------------------------------
+
+def _format_ns(value):
+    if value >= 1e6:
+        return f"{value / 1e6:.2f}ms"
+    if value >= 1e3:
+        return f"{value / 1e3:.2f}us"
+    return f"{value:.0f}ns"
+
+
+def print_result(name, result):
+    spread = result['stdev_ns'] / result['median_ns'] if result['median_ns'] else 0.0
+    print(f"{name:<44} median={_format_ns(result['median_ns']):>9} min={_format_ns(result['min_ns']):>9} "
+          f"+-{spread:5.1%}  ({result['iterations']} x {result['rounds']})", flush=True)
+
+
+def compare(baseline, results, threshold):
+    """Prints each benchmark against the baseline. Returns the names that got slower than ``threshold``."""
+    if baseline.get('machine') != machine():
+        print("warning: the baseline was saved on a different machine or Python; timings may not be comparable")
+    before = baseline['benchmarks']
+    regressions = []
+    print(f"{'benchmark':<44} {'baseline':>9} {'current':>9} {'change':>8}")
+    for name, result in results.items():
+        if name not in before:
+            print(f"{name:<44} {'-':>9} {_format_ns(result['min_ns']):>9} {'new':>8}")
+            continue
+        change = result['min_ns'] / before[name]['min_ns'] - 1
+        verdict = ''
+        if change > threshold:
+            verdict = 'SLOWER'
+            regressions.append(name)
+        elif change < -threshold:
+            verdict = 'faster'
+        print(f"{name:<44} {_format_ns(before[name]['min_ns']):>9} {_format_ns(result['min_ns']):>9} "
+              f"{change:>+8.1%} {verdict}")
+    missing = sorted(set(before) - set(results))
+    if missing:
+        print("not run: " + ', '.join(missing))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--filter', action='append', default=[],
+                        help="run only benchmarks whose name contains this; may be repeated")
+    parser.add_argument('--list', action='store_true', help="list the benchmarks and exit")
+    parser.add_argument('--rounds', type=int, default=9)
+    parser.add_argument('--min-time', type=float, default=0.05, help="minimum seconds per round")
+    parser.add_argument('--save', metavar='PATH', help="write the results as a baseline")
+    parser.add_argument('--compare', metavar='PATH', help="compare against a saved baseline")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="slowdown of the fastest round, as a fraction, that fails --compare")
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    # Read when bot_main is imported
+    os.environ['LOG_LEVEL'] = args.log_level
+    import bot_main  # noqa: F401  Configures logging and imports every handler
+
+    _register_database_benchmarks()
+    names = [name for name in BENCHMARKS if not args.filter or any(part in name for part in args.filter)]
+    if args.list:
+        print('\n'.join(names))
+        return 0
+    if not names:
+        parser.error("no benchmark matches --filter")
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    progress = None if args.json or baseline else print_result
+    results = asyncio.run(run(names, args.rounds, args.min_time, progress))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'saved_at': time.time(), 'machine': machine(), 'benchmarks': results}, f, indent=2)
+            f.write('\n')
+    if args.json:
+        print(json.dumps(results, indent=2))
+    if baseline is not None:
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) slower than the baseline by more than {args.threshold:.0%}: "
+                  + ', '.join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
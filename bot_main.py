@@ -1,6 +1,5 @@
 import os
 import sys
-from dotenv import load_dotenv
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler, CallbackContext
 import structlog
@@ -11,7 +10,17 @@ import asyncio
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 import database
-from handlers import core, messages, actions, callbacks, game_guess_number, lastman_game, last_message_wins_game
+import firestore_costs
+import leaderboards
+import load_shedding
+import metrics
+import priority_updates
+import tracing
+import xp_ledger
+import xp_journal
+import warmup
+from handlers import core, messages, actions, callbacks, diagnostics, game_guess_number, lastman_game, last_message_wins_game
+from game_logic.registry import ActiveGameRegistry, GUESS_NUMBER, LAST_MESSAGE_WINS, get_registry
 from logging_config import setup_logging
 
 # Set up logging
@@ -31,26 +40,103 @@ async def error_handler(update: object, context: CallbackContext) -> None:
     
     logger.error("Exception while handling an update:", exc_info=context.error)
 
+# Command name -> handler
+COMMANDS = {
+    "start": core.start,
+    "leaderboard": core.leaderboard,
+    "profile": core.user_profile,
+    "menu": core.user_profile,
+    "give": actions.give_xp,
+    "steal": actions.steal_xp,
+    "start_game": game_guess_number.start_new_game,
+    "help": core.help_command,
+    "awardxp": actions.award_xp,
+    "endgame": actions.end_game,
+    "lastman": lastman_game.start_lastman_lobby,
+    "lmw": last_message_wins_game.start_lmw_lobby,
+    "profilebot": diagnostics.profile_bot,
+    "dbcosts": diagnostics.firestore_costs_report,
+}
+
+# Games that capture chat messages while they are running
+MESSAGE_ROUTES = {
+    GUESS_NUMBER: game_guess_number.handle_guess,
+    LAST_MESSAGE_WINS: last_message_wins_game.lmw_message_handler,
+}
+
 async def main_message_handler(update: Update, context: CallbackContext) -> None:
-    """Route messages to the correct handler (game or standard)."""
-    if 'game' in context.user_data:
-        await game_guess_number.handle_guess(update, context)
-    elif 'lmw_game' in context.chat_data and context.chat_data['lmw_game']['status'] == 'in_progress':
-        await last_message_wins_game.lmw_message_handler(update, context)
-    else:
-        await messages.handle_message(update, context)
+    """Route messages to the correct handler (game or standard), noting how far behind they are."""
+    # Edits carry the original send time, so only new messages say how far behind we are
+    if update.message and update.message.date and not update.message.edit_date:
+        load_shedding.get_lag_monitor(context.bot_data).record_update(update.message.date)
+    route = get_registry(context.bot_data).route(update.effective_chat.id, update.effective_user.id)
+    handler = MESSAGE_ROUTES.get(route, messages.handle_message)
+    with metrics.track_handler(f"message:{handler.__name__}"):
+        await handler(update, context)
+
+async def post_init(application: Application) -> None:
+    """Replays XP events journaled by a previous run, then starts monitoring and the background warmup."""
+    ledger = database.get_xp_ledger()
+    if ledger is not None:
+        with firestore_costs.attributed_to('startup'):
+            await ledger.recover(application.bot_data['db'])
+
+    metrics.track_games(application)
+    metrics.track_firestore_costs()
+    lag_monitor = load_shedding.get_lag_monitor(application.bot_data)
+    lag_monitor.start()
+    metrics.track_lag(lag_monitor)
+    metrics_port = os.getenv('METRICS_PORT')
+    if metrics_port:
+        server = application.bot_data['metrics_server'] = metrics.MetricsServer(int(metrics_port))
+        await server.start()
+    admin_api_port = os.getenv('ADMIN_API_PORT')
+    if admin_api_port:
+        if os.getenv('ADMIN_API_TOKEN'):
+            from admin_dashboard.backend.api import AdminServer
+            server = application.bot_data['admin_server'] = AdminServer(
+                application, int(admin_api_port), os.getenv('ADMIN_API_TOKEN')
+            )
+            await server.start()
+        else:
+            logger.error("ADMIN_API_PORT is set without ADMIN_API_TOKEN; the admin API is not started")
+
+    # Firestore is connected while updates already flow in
+    with firestore_costs.attributed_to('startup'):
+        application.create_task(warmup.warm_up(application), name="warmup")
+
+async def post_shutdown(application: Application) -> None:
+    """Writes buffered and coalesced XP data and the recent activity before the process exits."""
+    await load_shedding.get_lag_monitor(application.bot_data).stop()
+    await load_shedding.get_xp_coalescer(application.bot_data).flush(application.bot_data)
+    metrics_server = application.bot_data.get('metrics_server')
+    if metrics_server is not None:
+        await metrics_server.stop()
+    admin_server = application.bot_data.get('admin_server')
+    if admin_server is not None:
+        await admin_server.stop()
+    user_cache = database.get_user_cache()
+    if user_cache is not None:
+        user_cache.stop()
+    ledger = database.get_xp_ledger()
+    if ledger is not None:
+        await ledger.flush(application.bot_data['db'])
+        if ledger.journal is not None:
+            ledger.journal.close()
+    await leaderboards.get_windowed_leaderboard(application.bot_data).flush(application.bot_data['db'])
+    await warmup.get_recent_activity(application.bot_data).save(application.bot_data['db'])
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def load_config():
+    """Loads .env and returns ``(token, firebase_credentials_data, is_json_string)``, or None if incomplete."""
+    from dotenv import load_dotenv
 
-def main() -> None:
-    """Start the bot."""
-    logger.info("Starting bot...")
     # Load environment variables from .env
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    dotenv_path = os.path.join(script_dir, '.env')
+    dotenv_path = os.path.join(SCRIPT_DIR, '.env')
     load_dotenv(dotenv_path=dotenv_path, override=True)
     
     token = os.getenv('TELEGRAM_TOKEN')
-    webhook_url = os.getenv('WEBHOOK_URL')
-    port = int(os.getenv('PORT', '8443'))
     # Determine Firebase credentials source
     firebase_credentials_data = None
     is_json_string = False
@@ -68,49 +154,123 @@ def main() -> None:
         
     if not token:
         logger.error("TELEGRAM_TOKEN not found! Please add it to your .env file or environment.")
-        return
+        return None
     if not firebase_credentials_data:
         logger.error("Firebase credentials not found! Please set either 'FIREBASE_CREDENTIALS' (JSON content) or 'FIREBASE_CREDENTIALS_PATH' (file file) in your .env file or environment.")
-        return
+        return None
+    return token, firebase_credentials_data, is_json_string
 
-    # Initialize Firebase
-    db_client = database.init_firebase(firebase_credentials_data, is_json_string=is_json_string)
-    if not db_client:
-        logger.error("Failed to initialize Firebase. Exiting.")
-        return
+def build_application(token, db_client, journal_path=None, updater=True, job_queue=None,
+                      background_jobs=True, request=None) -> Application:
+    """Creates the Application with every handler and background job registered.
 
-    # Create the Application and pass it your bot's token.
-    application = Application.builder().token(token).build()
+    Worker processes pass ``updater=False``: they are fed updates by a front-end
+    instead of fetching them, and each uses its own ``journal_path``. The
+    serverless entry point passes its own ``job_queue`` and no
+    ``background_jobs``, since nothing runs between invocations. ``request``
+    replaces the Bot API client, e.g. with the local fake used by benchmarks.
+    """
+    builder = Application.builder().token(token).post_init(post_init).post_shutdown(post_shutdown)
+    # Every update is handled inside a trace when tracing is configured
+    builder = builder.application_class(tracing.TracingApplication)
+    # Callbacks, commands and game messages are handled ahead of passive XP messages
+    update_processor = priority_updates.PriorityUpdateProcessor(
+        concurrency=int(os.getenv('UPDATE_CONCURRENCY', priority_updates.UPDATE_CONCURRENCY))
+    )
+    builder = builder.concurrent_updates(update_processor)
+    # Bot API calls are counted and timed by method
+    builder = builder.request(request or metrics.InstrumentedRequest())
+    if updater:
+        builder = builder.get_updates_request(metrics.InstrumentedRequest(connection_pool_size=1))
+    else:
+        builder = builder.updater(None)
+    if job_queue is not None:
+        builder = builder.job_queue(job_queue)
+    application = builder.build()
     application.bot_data['db'] = db_client
+    application.bot_data['games'] = update_processor.registry = ActiveGameRegistry()
+    metrics.track_update_processor(update_processor)
+    if background_jobs:
+        _schedule_background_jobs(application, journal_path)
 
     # Register the error handler
     application.add_error_handler(error_handler)
 
     # Register command handlers
-    application.add_handler(CommandHandler("start", core.start))
-    application.add_handler(CommandHandler("leaderboard", core.leaderboard))
-    application.add_handler(CommandHandler("profile", core.user_profile))
-    application.add_handler(CommandHandler("menu", core.user_profile))
-    application.add_handler(CommandHandler("give", actions.give_xp))
-    application.add_handler(CommandHandler("steal", actions.steal_xp))
-    application.add_handler(CommandHandler("start_game", game_guess_number.start_new_game))
-    application.add_handler(CommandHandler("help", core.help_command))
-    application.add_handler(CommandHandler("awardxp", actions.award_xp))
-    application.add_handler(CommandHandler("endgame", actions.end_game))
-    application.add_handler(CommandHandler("lastman", lastman_game.start_lastman_lobby))
-    application.add_handler(CommandHandler("lmw", last_message_wins_game.start_lmw_lobby))
-
-
-    # Register callback query handler
-    application.add_handler(CallbackQueryHandler(callbacks.button_handler, pattern='^(leaderboard|start_menu|profile|game_menu|start_number_game|help_menu|start_lastman_game|start_lmw_game)$'))
-    application.add_handler(CallbackQueryHandler(lastman_game.lastman_callback_handler, pattern='^(lastman_join|lastman_start)$'))
-    application.add_handler(CallbackQueryHandler(last_message_wins_game.lmw_callback_handler, pattern='^(lmw_join|lmw_start)$'))
+    for command, handler in COMMANDS.items():
+        application.add_handler(CommandHandler(command, metrics.timed_handler(f"command:{command}", handler)))
+
+    # Register callback query handler; callbacks.router dispatches on the encoded callback data
+    application.add_handler(CallbackQueryHandler(callbacks.button_handler))
 
     # Register message handler for XP and game guesses
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, main_message_handler))
+    return application
+
+def _run_repeating(application, callback, interval, name) -> None:
+    """Schedules a job whose Firestore usage is charged to ``job:<name>``."""
+    application.job_queue.run_repeating(firestore_costs.attributed_job(name, callback), interval=interval, name=name)
+
+def _schedule_background_jobs(application, journal_path=None) -> None:
+    """Sets up buffered XP writes and the jobs that flush them."""
+    # Every XP change lands in the daily buckets, which are written in batches
+    database.add_xp_listener(leaderboards.get_windowed_leaderboard(application.bot_data).record)
+    _run_repeating(application, leaderboards.flush_daily_xp_job, leaderboards.DAILY_XP_FLUSH_INTERVAL, "flush_daily_xp")
+    # Passive XP summed while the bot was behind is written in one go per user and chat
+    _run_repeating(application, load_shedding.flush_coalesced_xp_job, load_shedding.XP_COALESCE_FLUSH_INTERVAL, "flush_coalesced_xp")
+    # The next startup preloads caches for whoever was active before it
+    _run_repeating(application, warmup.save_recent_activity_job, warmup.RECENT_ACTIVITY_SAVE_INTERVAL, "save_recent_activity")
+    # Firestore usage per handler and job is logged once per interval
+    _run_repeating(application, firestore_costs.log_costs_job, firestore_costs.COST_SUMMARY_INTERVAL, "log_firestore_costs")
+
+    # Passive XP is appended to the ledger and folded into balances by a compaction job
+    if os.getenv('XP_LEDGER_ENABLED', '1') != '0':
+        # Buffered events are journaled locally and replayed by post_init after a crash
+        journal_path = journal_path or os.getenv('XP_JOURNAL_PATH', os.path.join(SCRIPT_DIR, 'xp_ledger.journal'))
+        journal = xp_journal.XpJournal(journal_path)
+        journal.open()
+        database.set_xp_ledger(xp_ledger.XpLedger(journal=journal))
+        _run_repeating(application, xp_ledger.flush_xp_ledger_job, xp_ledger.XP_LEDGER_FLUSH_INTERVAL, "flush_xp_ledger")
+        _run_repeating(application, xp_ledger.compact_xp_ledger_job, xp_ledger.XP_LEDGER_COMPACTION_INTERVAL, "compact_xp_ledger")
+        _run_repeating(application, xp_ledger.sync_xp_journal_job, xp_journal.XP_JOURNAL_SYNC_INTERVAL, "sync_xp_journal")
+
+def main() -> None:
+    """Start the bot."""
+    logger.info("Starting bot...")
+    config = load_config()
+    if config is None:
+        return
+    token, firebase_credentials_data, is_json_string = config
+    tracing.configure_from_env()
+    webhook_url = os.getenv('WEBHOOK_URL')
+    port = int(os.getenv('PORT', '8443'))
+
+    # With BOT_WORKERS > 1 a front-end process shards updates across worker processes by chat;
+    # with a webhook that front-end is always the ASGI server
+    worker_count = int(os.getenv('BOT_WORKERS', '1'))
+    if worker_count > 1:
+        import workers
+        workers.run_sharded(
+            token, firebase_credentials_data, is_json_string, worker_count,
+            webhook_url=webhook_url, port=port, secret_token=os.getenv('WEBHOOK_SECRET'),
+        )
+        return
+
+    # Firebase is initialized by the background warmup (or the first update, if that comes sooner)
+    db_client = database.DeferredClient(
+        lambda: database.init_firebase(firebase_credentials_data, is_json_string=is_json_string)
+    )
+
+    use_asgi_webhook = bool(webhook_url) and os.getenv('WEBHOOK_SERVER') == 'asgi'
+    # Create the Application and pass it your bot's token.
+    application = build_application(token, db_client, updater=not use_asgi_webhook)
 
     # Run the bot
-    if webhook_url:
+    if use_asgi_webhook:
+        import webhook_server
+        logger.info("Bot is starting with the ASGI webhook server...", port=port)
+        webhook_server.run(application, webhook_url, port, secret_token=os.getenv('WEBHOOK_SECRET'))
+    elif webhook_url:
         logger.info("Bot is starting with webhook...", port=port)
         application.run_webhook(
             listen="0.0.0.0",
@@ -1,12 +1,148 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
+import functools
+import importlib
 import os
 import structlog
 import json
 import asyncio
+import threading
+import time
+import uuid
+
+import firestore_costs
+import metrics
+import tracing
 
 logger = structlog.get_logger(__name__)
 
+
+class _LazyModule:
+    """Imports a module on first attribute access.
+
+    firebase_admin and the Firestore client library take about as long to import
+    as the rest of the bot together, so they load when Firestore is first used.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+firebase_admin = _LazyModule('firebase_admin')
+credentials = _LazyModule('firebase_admin.credentials')
+firestore = _LazyModule('firebase_admin.firestore')
+
+def _transactional(func):
+    """``firestore.transactional`` applied on first call, so decorating does not import Firestore.
+
+    As with the real decorator, the undecorated function is available as ``to_wrap``.
+    Attempts beyond the first, when Firestore retries on contention, are counted
+    in ``metrics.DB_RETRIES`` and noted on the transaction's trace span.
+    """
+
+    @functools.wraps(func)
+    def call(*args, **kwargs):
+        attempts = 0
+
+        def attempt(*attempt_args, **attempt_kwargs):
+            nonlocal attempts
+            attempts += 1
+            return func(*attempt_args, **attempt_kwargs)
+
+        with tracing.span(f"db.{func.__name__}") as span:
+            try:
+                return firestore.transactional(attempt)(*args, **kwargs)
+            finally:
+                if span is not None:
+                    span.attributes['attempts'] = attempts
+                if attempts > 1:
+                    metrics.DB_RETRIES.inc(func.__name__, amount=attempts - 1)
+
+    call.to_wrap = func
+    return call
+
+def _instrumented(func):
+    """Records the operation's latency, and whether it raised, in ``metrics`` and as a trace span.
+
+    The documents it counts are charged to the current origin in ``firestore_costs``.
+    """
+    operation = func.__name__
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def timed(*args, **kwargs):
+            with metrics.DB_LATENCY.time(operation), tracing.span(f"db.{operation}"), \
+                    firestore_costs.operation(operation):
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    metrics.DB_ERRORS.inc(operation)
+                    raise
+    else:
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            with metrics.DB_LATENCY.time(operation), tracing.span(f"db.{operation}"), \
+                    firestore_costs.operation(operation):
+                try:
+                    return func(*args, **kwargs)
+                except Exception:
+                    metrics.DB_ERRORS.inc(operation)
+                    raise
+    return timed
+
+FIRESTORE_BATCH_LIMIT = 500  # Maximum writes in one Firestore batch
+XP_EVENTS_COLLECTION = 'xp_events'
+
+# Append-only XP ledger (see xp_ledger.py); when set, passive XP is appended instead of written in place
+_xp_ledger = None
+
+def set_xp_ledger(ledger):
+    """Routes ``append_xp`` through ``ledger``; pass None to write XP in place again."""
+    global _xp_ledger
+    _xp_ledger = ledger
+
+def get_xp_ledger():
+    return _xp_ledger
+
+# In-memory copy of the users collection kept current by a snapshot listener (see user_cache.py)
+_user_cache = None
+
+def set_user_cache(cache):
+    """Serves user reads from ``cache`` once it is ready; pass None to read Firestore again."""
+    global _user_cache
+    _user_cache = cache
+
+def get_user_cache():
+    return _user_cache
+
+# Users read ahead of time by the startup warmup: user_id -> (read_at, data).
+# Each entry serves one read, so it never stands in for a balance for long.
+_prefetched_users = {}
+PREFETCHED_USER_TTL = 60  # seconds a prefetched user may be served
+
+def _forget_prefetched_user(user_id):
+    _prefetched_users.pop(user_id, None)
+
+# Callables notified with (user_id, username, delta) after every successful XP change
+_xp_listeners = []
+
+def add_xp_listener(listener):
+    """Registers a callable to be told about every XP change that was written."""
+    _xp_listeners.append(listener)
+
+def remove_xp_listener(listener):
+    if listener in _xp_listeners:
+        _xp_listeners.remove(listener)
+
+def _notify_xp_change(user_id, username, delta):
+    for listener in _xp_listeners:
+        try:
+            listener(user_id, username, delta)
+        except Exception as e:
+            logger.error("XP listener failed", user_id=user_id, error=e)
+
 def init_firebase(credentials_path, is_json_string=False):
     """
     Initializes Firebase Admin SDK from a file path or a JSON string,
@@ -30,19 +166,60 @@ def init_firebase(credentials_path, is_json_string=False):
         return None
 
 
+class DeferredClient:
+    """Firestore client built on first use instead of at startup.
+
+    Attribute access is forwarded to the real client, so it can be passed
+    anywhere a client is expected. ``get`` builds it ahead of time, e.g. from
+    a background warmup task. ``factory`` returns the client or None on failure.
+    It is called at most once: after a failure the deferred client stays falsy,
+    so the ``if not db`` guards report Firestore as not initialized without
+    retrying the (blocking) initialization on every check.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._built = False  # True once the factory has run, whether or not it succeeded
+        self._lock = threading.Lock()  # Database calls run on executor threads
+
+    def get(self):
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self._client = self._factory()
+                    self._built = True
+        return self._client
+
+    def __bool__(self):
+        return self.get() is not None
+
+    def __getattr__(self, name):
+        client = self.get()
+        if client is None:
+            raise RuntimeError("Firestore not initialized.")
+        return getattr(client, name)
+
+@_instrumented
+def ping(db):
+    """Reads one user document to open the connection to Firestore."""
+    firestore_costs.count_query(len(list(db.collection('users').limit(1).stream())))
+
+
+@_instrumented
 async def get_user_data(db, user_id):
     """Retrieves a user's data from Firestore asynchronously."""
+    if _user_cache is not None and _user_cache.ready:
+        return _with_pending_xp(user_id, _user_cache.get(user_id))
+    prefetched = _prefetched_users.pop(user_id, None)
+    if prefetched is not None and time.monotonic() - prefetched[0] < PREFETCHED_USER_TTL:
+        return _with_pending_xp(user_id, prefetched[1])
     if not db:
         logger.error("Firestore not initialized.")
         return None
     try:
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            None,  # Use the default thread pool executor
-            _get_user_data_sync,
-            db,
-            user_id
-        )
+        # to_thread carries the trace and cost origin into the worker thread
+        return await asyncio.to_thread(_get_user_data_sync, db, user_id)
     except Exception as e:
         logger.error("Error getting user data", user_id=user_id, error=e)
         return None
@@ -51,40 +228,143 @@ def _get_user_data_sync(db, user_id):
     """Synchronous function to retrieve a user's data from Firestore."""
     user_ref = db.collection('users').document(str(user_id))
     doc = user_ref.get()
-    if doc.exists:
-        return doc.to_dict()
-    return None
+    firestore_costs.count(reads=1)
+    return _with_pending_xp(user_id, doc.to_dict() if doc.exists else None)
+
+@_instrumented
+def prefetch_users(db, user_ids):
+    """Reads several users in one round trip so their next ``get_user_data`` is served from memory.
+
+    Returns how many of them have a document.
+    """
+    if not db or not user_ids:
+        return 0
+    refs = [db.collection('users').document(str(user_id)) for user_id in user_ids]
+    found = 0
+    read_at = time.monotonic()
+    for snapshot in db.get_all(refs):
+        data = snapshot.to_dict() if snapshot.exists else None
+        _prefetched_users[int(snapshot.id)] = (read_at, data)
+        found += data is not None
+    firestore_costs.count(reads=len(refs))
+    return found
+
+def _with_pending_xp(user_id, data):
+    """Adds ledger events that are not compacted yet to a user's stored balance."""
+    pending = _xp_ledger.pending_xp(user_id) if _xp_ledger is not None else 0
+    if pending:
+        data = dict(data or {'xp': 0})
+        data['xp'] = data.get('xp', 0) + pending
+    return data
+
+def _chat_member_ref(db, chat_id, user_id):
+    return db.collection('chats').document(str(chat_id)).collection('members').document(str(user_id))
+
+def new_xp_event(user_id, username, delta, reason, chat_id=None, applied=False):
+    """Builds an XP ledger event. ``applied`` events are already reflected in balances."""
+    return {
+        'id': uuid.uuid4().hex,
+        'user_id': user_id,
+        'username': username,
+        'delta': delta,
+        'reason': reason,
+        'chat_id': chat_id,
+        'created_at': time.time(),
+        'applied': applied,
+    }
+
+def _xp_event_ref(db, event_id):
+    return db.collection(XP_EVENTS_COLLECTION).document(event_id)
+
+def _record_applied_xp_event(transaction, db, user_id, username, delta, reason, chat_id=None):
+    """Writes the audit event for a change made in place within ``transaction``."""
+    event = new_xp_event(user_id, username, delta, reason, chat_id=chat_id, applied=True)
+    transaction.set(_xp_event_ref(db, event.pop('id')), event)
 
-@firestore.transactional
-def _add_xp_sync_transaction(transaction, db, user_id, username, xp_to_add):
+@_transactional
+def _add_xp_sync_transaction(transaction, db, user_id, username, xp_to_add, chat_id=None, reason='adjustment'):
     user_ref = db.collection('users').document(str(user_id))
+    # Firestore transactions need every read before the first write
     snapshot = user_ref.get(transaction=transaction)
+    member_ref = member_snapshot = None
+    if chat_id is not None:
+        member_ref = _chat_member_ref(db, chat_id, user_id)
+        member_snapshot = member_ref.get(transaction=transaction)
+    firestore_costs.count(reads=1 if member_ref is None else 2)
 
     if snapshot.exists:
         current_xp = snapshot.to_dict().get('xp', 0)
         new_xp = current_xp + xp_to_add
         transaction.update(user_ref, {'xp': new_xp})
-        logger.info("Updated XP for user", username=username, user_id=user_ref.id, new_xp=new_xp)
+        logger.debug("Updated XP for user", username=username, user_id=user_ref.id, new_xp=new_xp)
     else:
+        new_xp = xp_to_add
         transaction.set(user_ref, {
             'username': username,
             'xp': xp_to_add
         })
         logger.info("Created new user", username=username, user_id=user_ref.id, xp=xp_to_add)
 
-async def add_xp(db, user_id, username, xp_to_add=1):
-    """Adds XP to a user. Creates the user document if they don't exist."""
+    new_chat_xp = None
+    if member_ref is not None:
+        current_chat_xp = member_snapshot.to_dict().get('xp', 0) if member_snapshot.exists else 0
+        new_chat_xp = current_chat_xp + xp_to_add
+        transaction.set(member_ref, {'username': username, 'xp': new_chat_xp})
+
+    _record_applied_xp_event(transaction, db, user_id, username, xp_to_add, reason, chat_id=chat_id)
+    firestore_costs.count(writes=2 if member_ref is None else 3)
+    return {'xp': new_xp, 'chat_xp': new_chat_xp}
+
+@_instrumented
+async def add_xp(db, user_id, username, xp_to_add=1, chat_id=None, reason='adjustment'):
+    """Adds XP to a user. Creates the user document if they don't exist.
+
+    With ``chat_id`` the user's XP counter for that chat is updated in the same
+    transaction. The change is recorded in the XP ledger under ``reason``.
+    Returns the new totals as ``{'xp': ..., 'chat_xp': ...}``, or None if the
+    write failed.
+    """
     if not db:
         logger.error("Firestore not initialized.")
-        return
+        return None
 
     try:
-        # The transactional function is automatically run in a transaction.
-        _add_xp_sync_transaction(db.transaction(), db, user_id, username, xp_to_add)
+        # The transactional function is automatically run in a transaction, in a worker
+        # thread so callers can overlap it with other awaits
+        result = await asyncio.to_thread(
+            _add_xp_sync_transaction, db.transaction(), db, user_id, username, xp_to_add, chat_id=chat_id, reason=reason
+        )
     except Exception as e:
         logger.error("Error adding XP for user", user_id=user_id, error=e)
+        return None
+    _forget_prefetched_user(user_id)
+    _notify_xp_change(user_id, username, xp_to_add)
+    return result
+
+def append_xp(user_id, username, xp_to_add, reason, chat_id=None):
+    """Appends an XP change to the ledger without touching balances.
+
+    The change is folded into the user's balance (and chat counter) by the next
+    compaction. Returns False when no ledger is configured, in which case the
+    caller should fall back to ``add_xp``.
+    """
+    if _xp_ledger is None:
+        return False
+    _xp_ledger.append(user_id, username, xp_to_add, reason, chat_id=chat_id)
+    _notify_xp_change(user_id, username, xp_to_add)
+    return True
+
+
+def watch_users(db, callback):
+    """Starts a snapshot listener on the users collection and returns its watch handle.
+
+    ``callback(docs, changes, read_time)`` runs on a Firestore background thread,
+    first with every user and then with each batch of changes.
+    """
+    return db.collection('users').on_snapshot(callback)
 
 
+@_instrumented
 def get_leaderboard(db, limit=10):
     """Retrieves the top users from Firestore."""
     if not db:
@@ -98,19 +378,73 @@ def get_leaderboard(db, limit=10):
         for doc in results:
             data = doc.to_dict()
             leaderboard_data.append((data.get('username', 'Unknown'), data.get('xp', 0)))
+        firestore_costs.count_query(len(leaderboard_data))
         return leaderboard_data
     except Exception as e:
         logger.error("Error getting leaderboard", error=e)
         return []
 
+@_instrumented
+def get_leaderboard_page(db, limit, start_after=None):
+    """Retrieves up to ``limit`` users ranked after the ``start_after`` document snapshot.
+
+    Returns ``(entries, cursors)`` where ``entries`` are ``(username, xp)`` tuples and
+    ``cursors[i]`` is the snapshot for ``entries[i]``, usable as a later ``start_after``.
+    """
+    if not db:
+        logger.error("Firestore not initialized.")
+        return [], []
+    try:
+        query = db.collection('users').order_by('xp', direction=firestore.Query.DESCENDING)
+        if start_after is not None:
+            query = query.start_after(start_after)
+        entries = []
+        cursors = []
+        for doc in query.limit(limit).stream():
+            data = doc.to_dict()
+            entries.append((data.get('username', 'Unknown'), data.get('xp', 0)))
+            cursors.append(doc)
+        firestore_costs.count_query(len(entries))
+        return entries, cursors
+    except Exception as e:
+        logger.error("Error getting leaderboard page", error=e)
+        return [], []
+
+@_instrumented
+def get_chat_leaderboard(db, chat_id, limit=10):
+    """Retrieves the top members of a chat by the XP they earned in it.
+
+    Returns ``(user_id, username, xp)`` tuples, or None if the query failed.
+    """
+    if not db:
+        logger.error("Firestore not initialized.")
+        return None
+    try:
+        members_ref = db.collection('chats').document(str(chat_id)).collection('members')
+        query = members_ref.order_by('xp', direction=firestore.Query.DESCENDING).limit(limit)
+        results = []
+        for doc in query.stream():
+            data = doc.to_dict()
+            user_id = int(doc.id)
+            xp = data.get('xp', 0)
+            if _xp_ledger is not None:
+                xp += _xp_ledger.pending_chat_xp(chat_id, user_id)
+            results.append((user_id, data.get('username', 'Unknown'), xp))
+        firestore_costs.count_query(len(results))
+        return results
+    except Exception as e:
+        logger.error("Error getting chat leaderboard", chat_id=chat_id, error=e)
+        return None
+
 
-@firestore.transactional
-def _transfer_xp_sync_transaction(transaction, db, from_user_id, to_user_id, amount):
+@_transactional
+def _transfer_xp_sync_transaction(transaction, db, from_user_id, to_user_id, amount, reason='transfer'):
     from_user_ref = db.collection('users').document(str(from_user_id))
     to_user_ref = db.collection('users').document(str(to_user_id))
 
     from_doc = from_user_ref.get(transaction=transaction)
     to_doc = to_user_ref.get(transaction=transaction)
+    firestore_costs.count(reads=2)
 
     if not from_doc.exists or not to_doc.exists:
         logger.warning("One or both users in transaction do not exist.", from_user_id=from_user_id, to_user_id=to_user_id)
@@ -119,23 +453,357 @@ def _transfer_xp_sync_transaction(transaction, db, from_user_id, to_user_id, amo
     from_xp = from_doc.to_dict().get('xp', 0)
     to_xp = to_doc.to_dict().get('xp', 0)
 
-    if from_xp < amount:
+    # Ledger XP not compacted yet counts towards the balance, as it does in get_user_data
+    pending_xp = _xp_ledger.pending_xp(from_user_id) if _xp_ledger is not None else 0
+    if from_xp + pending_xp < amount:
         return False # Not enough XP
 
     # Perform the transfer
     transaction.update(from_user_ref, {'xp': from_xp - amount})
     transaction.update(to_user_ref, {'xp': to_xp + amount})
+    _record_applied_xp_event(transaction, db, from_user_id, None, -amount, reason)
+    _record_applied_xp_event(transaction, db, to_user_id, None, amount, reason)
+    firestore_costs.count(writes=4)
     
     return True
 
-async def transfer_xp(db, from_user_id, to_user_id, amount):
-    """Public function to initiate an XP transfer."""
+@_instrumented
+async def transfer_xp(db, from_user_id, to_user_id, amount, reason='transfer'):
+    """Public function to initiate an XP transfer. Both sides are recorded in the XP ledger."""
     if not db:
         logger.error("Firestore not initialized.")
         return False
     try:
-        return _transfer_xp_sync_transaction(db.transaction(), db, from_user_id, to_user_id, amount)
+        success = _transfer_xp_sync_transaction(db.transaction(), db, from_user_id, to_user_id, amount, reason=reason)
     except Exception as e:
         logger.error("Error transferring XP", from_user_id=from_user_id, to_user_id=to_user_id, error=e)
         return False
+    if success:
+        _forget_prefetched_user(from_user_id)
+        _forget_prefetched_user(to_user_id)
+        _notify_xp_change(from_user_id, None, -amount)
+        _notify_xp_change(to_user_id, None, amount)
+    return success
+
+
+def _daily_xp_ref(db, day, user_id):
+    return db.collection('xp_daily').document(day).collection('users').document(str(user_id))
+
+@_instrumented
+def flush_daily_xp(db, deltas):
+    """Adds buffered XP deltas to the per-user daily buckets.
+
+    ``deltas`` is a list of ``((day, user_id), (delta, username))`` items with
+    ``day`` as ``YYYY-MM-DD``. Writes are server-side increments committed in
+    batches, in order. Returns how many items were committed, so a caller can
+    re-queue the rest after a failure.
+    """
+    if not db:
+        logger.error("Firestore not initialized.")
+        return 0
+    committed = 0
+    try:
+        for start in range(0, len(deltas), FIRESTORE_BATCH_LIMIT):
+            chunk = deltas[start:start + FIRESTORE_BATCH_LIMIT]
+            batch = db.batch()
+            for (day, user_id), (delta, username) in chunk:
+                data = {'xp': firestore.Increment(delta), 'day': day}
+                if username:
+                    data['username'] = username
+                batch.set(_daily_xp_ref(db, day, user_id), data, merge=True)
+            batch.commit()
+            firestore_costs.count(writes=len(chunk))
+            committed += len(chunk)
+    except Exception as e:
+        logger.error("Error flushing daily XP", committed=committed, pending=len(deltas) - committed, error=e)
+    return committed
+
+@_instrumented
+def get_daily_xp(db, day):
+    """Retrieves every user's XP for one daily bucket as ``(user_id, username, xp)`` tuples, or None on failure."""
+    if not db:
+        logger.error("Firestore not initialized.")
+        return None
+    try:
+        results = []
+        for doc in db.collection('xp_daily').document(day).collection('users').stream():
+            data = doc.to_dict()
+            results.append((int(doc.id), data.get('username', 'Unknown'), data.get('xp', 0)))
+        firestore_costs.count_query(len(results))
+        return results
+    except Exception as e:
+        logger.error("Error getting daily XP", day=day, error=e)
+        return None
+
+
+
+@_instrumented
+def write_xp_events(db, events):
+    """Appends ledger events to the ``xp_events`` collection in batches.
+
+    Events are written in order under their own ids. Returns how many were
+    committed, so a caller can re-queue the rest after a failure.
+    """
+    if not db:
+        logger.error("Firestore not initialized.")
+        return 0
+    committed = 0
+    try:
+        for start in range(0, len(events), FIRESTORE_BATCH_LIMIT):
+            chunk = events[start:start + FIRESTORE_BATCH_LIMIT]
+            batch = db.batch()
+            for event in chunk:
+                data = {key: value for key, value in event.items() if key != 'id'}
+                batch.set(_xp_event_ref(db, event['id']), data)
+            batch.commit()
+            firestore_costs.count(writes=len(chunk))
+            committed += len(chunk)
+    except Exception as e:
+        logger.error("Error writing XP events", committed=committed, pending=len(events) - committed, error=e)
+    return committed
+
+@_instrumented
+def get_existing_xp_event_ids(db, event_ids):
+    """Returns which of ``event_ids`` are already in the ledger, or None if the read failed."""
+    if not db:
+        logger.error("Firestore not initialized.")
+        return None
+    try:
+        snapshots = db.get_all([_xp_event_ref(db, event_id) for event_id in event_ids])
+        existing = {snapshot.id for snapshot in snapshots if snapshot.exists}
+        firestore_costs.count(reads=len(event_ids))
+        return existing
+    except Exception as e:
+        logger.error("Error checking XP events", events=len(event_ids), error=e)
+        return None
+
+@_instrumented
+def get_unapplied_xp_event_ids(db, limit):
+    """Returns the ids of up to ``limit`` ledger events not yet folded into balances, or None if the query failed."""
+    if not db:
+        logger.error("Firestore not initialized.")
+        return None
+    try:
+        unapplied = firestore.FieldFilter('applied', '==', False)
+        query = db.collection(XP_EVENTS_COLLECTION).where(filter=unapplied).limit(limit)
+        event_ids = [doc.id for doc in query.stream()]
+        firestore_costs.count_query(len(event_ids))
+        return event_ids
+    except Exception as e:
+        logger.error("Error listing unapplied XP events", error=e)
+        return None
+
+@_transactional
+def _apply_xp_events_transaction(transaction, db, event_ids):
+    # Re-read the events inside the transaction so concurrent compactions never fold one twice
+    snapshots = db.get_all([_xp_event_ref(db, event_id) for event_id in event_ids], transaction=transaction)
+    firestore_costs.count(reads=len(event_ids))
+    user_totals = {}  # user_id -> [delta, username]
+    member_totals = {}  # (chat_id, user_id) -> [delta, username]
+    applied = []
+    for snapshot in snapshots:
+        if not snapshot.exists:
+            continue
+        event = snapshot.to_dict()
+        if event.get('applied'):
+            continue
+        user_id, username, delta = event['user_id'], event.get('username'), event['delta']
+        total = user_totals.setdefault(user_id, [0, None])
+        total[0] += delta
+        total[1] = username or total[1]
+        if event.get('chat_id') is not None:
+            total = member_totals.setdefault((event['chat_id'], user_id), [0, None])
+            total[0] += delta
+            total[1] = username or total[1]
+        transaction.update(snapshot.reference, {'applied': True})
+        applied.append(dict(event, id=snapshot.id))
+
+    for user_id, (delta, username) in user_totals.items():
+        data = {'xp': firestore.Increment(delta)}
+        if username:
+            data['username'] = username
+        transaction.set(db.collection('users').document(str(user_id)), data, merge=True)
+        _forget_prefetched_user(user_id)
+    for (chat_id, user_id), (delta, username) in member_totals.items():
+        data = {'xp': firestore.Increment(delta)}
+        if username:
+            data['username'] = username
+        transaction.set(_chat_member_ref(db, chat_id, user_id), data, merge=True)
+    firestore_costs.count(writes=len(applied) + len(user_totals) + len(member_totals))
+    return applied
+
+@_instrumented
+def apply_xp_events(db, event_ids):
+    """Folds the given ledger events into user balances and chat counters.
+
+    Runs in one transaction; events another compaction already applied are
+    skipped. Returns the events that were applied by this call.
+    """
+    if not db:
+        logger.error("Firestore not initialized.")
+        return []
+    try:
+        return _apply_xp_events_transaction(db.transaction(), db, event_ids)
+    except Exception as e:
+        logger.error("Error applying XP events", events=len(event_ids), error=e)
+        return []
+
+@_instrumented
+def get_xp_events(db, user_id):
+    """Retrieves every ledger event for a user, oldest first, for auditing a balance."""
+    if not db:
+        logger.error("Firestore not initialized.")
+        return []
+    try:
+        query = db.collection(XP_EVENTS_COLLECTION).where(filter=firestore.FieldFilter('user_id', '==', user_id))
+        events = [dict(doc.to_dict(), id=doc.id) for doc in query.stream()]
+        firestore_costs.count_query(len(events))
+        return sorted(events, key=lambda event: event.get('created_at', 0))
+    except Exception as e:
+        logger.error("Error getting XP events", user_id=user_id, error=e)
+        return []
+
+
+BOT_STATE_COLLECTION = 'bot_state'
+RECENT_ACTIVITY_DOCUMENT = 'recent_activity'
+
+@_instrumented
+def get_recent_activity(db):
+    """Returns the user ids saved by ``save_recent_activity``, most recent first."""
+    if not db:
+        logger.error("Firestore not initialized.")
+        return []
+    try:
+        snapshot = db.collection(BOT_STATE_COLLECTION).document(RECENT_ACTIVITY_DOCUMENT).get()
+        firestore_costs.count(reads=1)
+        data = snapshot.to_dict() if snapshot.exists else {}
+        return data.get('user_ids', [])
+    except Exception as e:
+        logger.error("Error getting recent activity", error=e)
+        return []
+
+@_instrumented
+def save_recent_activity(db, user_ids):
+    """Stores the recently active users for the next startup's warmup."""
+    if not db:
+        logger.error("Firestore not initialized.")
+        return
+    try:
+        db.collection(BOT_STATE_COLLECTION).document(RECENT_ACTIVITY_DOCUMENT).set({
+            'user_ids': list(user_ids),
+            'updated_at': time.time(),
+        })
+        firestore_costs.count(writes=1)
+    except Exception as e:
+        logger.error("Error saving recent activity", error=e)
+
+
+SERVERLESS_STATE_COLLECTION = 'serverless_state'
+SERVERLESS_LEASES_COLLECTION = 'serverless_leases'
+SERVERLESS_TIMERS_COLLECTION = 'serverless_timers'
+
+@_instrumented
+def get_states(db, keys):
+    """Reads stored handler state documents. Returns ``{key: data}`` for the keys that exist."""
+    refs = [db.collection(SERVERLESS_STATE_COLLECTION).document(key) for key in keys]
+    states = {snapshot.id: snapshot.to_dict() for snapshot in db.get_all(refs) if snapshot.exists}
+    firestore_costs.count(reads=len(refs))
+    return states
+
+@_instrumented
+def set_states(db, states):
+    """Writes handler state documents from ``{key: data}`` in one batch."""
+    batch = db.batch()
+    for key, data in states.items():
+        batch.set(db.collection(SERVERLESS_STATE_COLLECTION).document(key), data)
+    batch.commit()
+    firestore_costs.count(writes=len(states))
+
+@_transactional
+def _acquire_lease_transaction(transaction, db, key, holder, ttl):
+    lease_ref = db.collection(SERVERLESS_LEASES_COLLECTION).document(key)
+    lease = lease_ref.get(transaction=transaction)
+    firestore_costs.count(reads=1)
+    lease = lease.to_dict() if lease.exists else {}
+    now = time.time()
+    if lease.get('holder') not in (None, holder) and lease.get('expires_at', 0) > now:
+        return False
+    transaction.set(lease_ref, {'holder': holder, 'expires_at': now + ttl})
+    firestore_costs.count(writes=1)
+    return True
+
+@_instrumented
+def acquire_lease(db, key, holder, ttl):
+    """Takes the lease on ``key`` for ``ttl`` seconds unless someone else holds it. Returns True on success."""
+    return _acquire_lease_transaction(db.transaction(), db, key, holder, ttl)
+
+@_transactional
+def _release_lease_transaction(transaction, db, key, holder):
+    lease_ref = db.collection(SERVERLESS_LEASES_COLLECTION).document(key)
+    snapshot = lease_ref.get(transaction=transaction)
+    firestore_costs.count(reads=1)
+    # An expired lease may already belong to someone else
+    if snapshot.exists and snapshot.to_dict().get('holder') == holder:
+        transaction.delete(lease_ref)
+        firestore_costs.count(deletes=1)
+
+@_instrumented
+def release_lease(db, key, holder):
+    _release_lease_transaction(db.transaction(), db, key, holder)
+
+@_instrumented
+def save_timers(db, timers, removed=()):
+    """Stores timers from ``{name: timer}`` and deletes the ``removed`` names, in one batch."""
+    batch = db.batch()
+    deleted = [name for name in removed if name not in timers]
+    for name in deleted:
+        batch.delete(db.collection(SERVERLESS_TIMERS_COLLECTION).document(name))
+    for name, timer in timers.items():
+        batch.set(db.collection(SERVERLESS_TIMERS_COLLECTION).document(name), timer)
+    batch.commit()
+    firestore_costs.count(writes=len(timers), deletes=len(deleted))
+
+@_transactional
+def _claim_timer_transaction(transaction, db, name, holder, claimed_until):
+    timer_ref = db.collection(SERVERLESS_TIMERS_COLLECTION).document(name)
+    snapshot = timer_ref.get(transaction=transaction)
+    firestore_costs.count(reads=1)
+    if not snapshot.exists:
+        return None
+    # Hidden from other callers until ``claimed_until``; it runs again then unless finished
+    transaction.update(timer_ref, {'due_at': claimed_until, 'claimed_by': holder})
+    firestore_costs.count(writes=1)
+    return snapshot.to_dict()
+
+@_instrumented
+def claim_due_timers(db, now, limit, holder, claim_ttl):
+    """Claims and returns up to ``limit`` timers due by ``now``.
+
+    Each timer is claimed in its own transaction, so concurrent callers never
+    receive the same one. A claimed timer stays stored until ``finish_timer``
+    deletes it; if that never happens it is due again after ``claim_ttl`` seconds.
+    """
+    due = firestore.FieldFilter('due_at', '<=', now)
+    names = [doc.id for doc in db.collection(SERVERLESS_TIMERS_COLLECTION).where(filter=due).limit(limit).stream()]
+    firestore_costs.count_query(len(names))
+    claimed = []
+    for name in names:
+        timer = _claim_timer_transaction(db.transaction(), db, name, holder, now + claim_ttl)
+        if timer is not None:
+            claimed.append(dict(timer, name=name))
+    return claimed
+
+@_transactional
+def _finish_timer_transaction(transaction, db, name, holder):
+    timer_ref = db.collection(SERVERLESS_TIMERS_COLLECTION).document(name)
+    snapshot = timer_ref.get(transaction=transaction)
+    firestore_costs.count(reads=1)
+    # A timer re-armed or rescheduled under the same name was rewritten without our claim
+    if snapshot.exists and snapshot.to_dict().get('claimed_by') == holder:
+        transaction.delete(timer_ref)
+        firestore_costs.count(deletes=1)
 
+@_instrumented
+def finish_timer(db, name, holder):
+    """Deletes a timer claimed by ``holder`` once it has run, unless it was stored again meanwhile."""
+    _finish_timer_transaction(db.transaction(), db, name, holder)
@@ -0,0 +1,214 @@
+"""Firestore document reads, writes and deletes, attributed to what caused them.
+
+Firestore bills per document, so each ``database`` operation counts the
+documents it reads, writes and deletes (see ``count``), and the counts are
+charged to the current origin: the handler being run (set by
+``metrics.track_handler``, e.g. ``command:leaderboard`` or
+``message:handle_message``), the background job (``job:<name>``), or
+``background`` for anything else. Tasks started by a handler inherit its
+origin. Job queue callbacks do not: a scheduled job runs in the context of
+whichever call last re-armed the scheduler, an unrelated update as often as
+not, so every job callback is wrapped with ``attributed_job`` where it is
+scheduled, game timers included (``job:lmw_end_game``,
+``job:lastman_elimination``).
+
+Billing rules followed: a document get costs one read even when the
+document is missing, a query costs one read per result and at least one,
+and every set, update or increment costs one write. Reads and writes of
+transaction attempts that Firestore retried are counted too.
+
+``COSTS`` keeps running totals per ``(origin, operation)``; ``report``
+renders them ranked by estimated spend, ``log_costs_job`` logs a summary
+of each interval, and ``metrics.track_firestore_costs`` exports them.
+"""
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+BACKGROUND = 'background'
+COST_SUMMARY_INTERVAL = 3600  # seconds between logged usage summaries
+# USD per document: list prices per 100,000 in a regional location; multi-region costs about double
+DOCUMENT_PRICES = {'reads': 0.03 / 100_000, 'writes': 0.09 / 100_000, 'deletes': 0.01 / 100_000}
+
+_origin = ContextVar('firestore_cost_origin', default=BACKGROUND)
+_usage = ContextVar('firestore_operation_usage', default=None)
+
+
+class Usage:
+    """Documents read, written and deleted."""
+
+    __slots__ = ('calls', 'reads', 'writes', 'deletes')
+
+    def __init__(self, calls=0, reads=0, writes=0, deletes=0):
+        self.calls = calls
+        self.reads = reads
+        self.writes = writes
+        self.deletes = deletes
+
+    def add(self, other) -> None:
+        self.calls += other.calls
+        self.reads += other.reads
+        self.writes += other.writes
+        self.deletes += other.deletes
+
+    def cost(self) -> float:
+        """Estimated spend in USD."""
+        return sum(getattr(self, kind) * price for kind, price in DOCUMENT_PRICES.items())
+
+    def as_dict(self):
+        return {'calls': self.calls, 'reads': self.reads, 'writes': self.writes, 'deletes': self.deletes,
+                'cost_usd': round(self.cost(), 6)}
+
+
+class CostTracker:
+    """Document usage per ``(origin, operation)``, in total and since the last summary."""
+
+    def __init__(self):
+        self._lock = threading.Lock()  # Operations record from executor threads
+        self._totals = {}
+        self._interval = {}
+        self.observer = None  # Called with (origin, kind, documents) for every count, e.g. by metrics
+
+    def record(self, origin, operation, usage) -> None:
+        key = (origin, operation)
+        with self._lock:
+            for table in (self._totals, self._interval):
+                entry = table.get(key)
+                if entry is None:
+                    entry = table[key] = Usage()
+                entry.add(usage)
+        if self.observer is not None:
+            for kind in DOCUMENT_PRICES:
+                if getattr(usage, kind):
+                    self.observer(origin, kind, getattr(usage, kind))
+
+    def totals(self):
+        """Returns a copy of the running totals as ``{(origin, operation): Usage}``."""
+        with self._lock:
+            return {key: _copy(usage) for key, usage in self._totals.items()}
+
+    def take_interval(self):
+        """Returns the usage since the previous call and starts a new interval."""
+        with self._lock:
+            interval, self._interval = self._interval, {}
+        return interval
+
+    def reset(self) -> None:
+        with self._lock:
+            self._totals = {}
+            self._interval = {}
+
+
+def _copy(usage):
+    return Usage(usage.calls, usage.reads, usage.writes, usage.deletes)
+
+
+COSTS = CostTracker()
+
+
+@contextmanager
+def attributed_to(origin):
+    """Charges Firestore usage within the ``with`` block, and tasks started in it, to ``origin``."""
+    token = _origin.set(origin)
+    try:
+        yield
+    finally:
+        _origin.reset(token)
+
+
+def attributed_job(name, callback):
+    """Wraps a job queue callback so its Firestore usage is charged to ``job:<name>``.
+
+    The wrapper keeps the callback's module and qualified name, so a job queue
+    that stores callbacks by name (``serverless.HandoffJobQueue``) still finds
+    it; ``cost_origin`` tells such a queue what to charge when it runs.
+    """
+    @functools.wraps(callback)
+    async def wrapped(context):
+        with attributed_to(f"job:{name}"):
+            return await callback(context)
+    wrapped.cost_origin = f"job:{name}"
+    return wrapped
+
+
+@contextmanager
+def operation(name):
+    """Collects the documents counted within one database operation and records them as one call."""
+    usage = Usage(calls=1)
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+        COSTS.record(_origin.get(), name, usage)
+
+
+def record(operation_name, reads=0, writes=0, deletes=0) -> None:
+    """Records documents used outside a database operation, e.g. by a snapshot listener."""
+    COSTS.record(_origin.get(), operation_name, Usage(1, reads, writes, deletes))
+
+
+def count(reads=0, writes=0, deletes=0) -> None:
+    """Counts documents for the current database operation."""
+    usage = _usage.get()
+    if usage is None:
+        COSTS.record(_origin.get(), 'unknown', Usage(0, reads, writes, deletes))
+        return
+    usage.reads += reads
+    usage.writes += writes
+    usage.deletes += deletes
+
+
+def count_query(results) -> None:
+    """Counts the reads of a query that returned ``results`` documents."""
+    count(reads=max(results, 1))
+
+
+def by_origin(usages):
+    """Sums ``{(origin, operation): Usage}`` per origin."""
+    totals = {}
+    for (origin, _), usage in usages.items():
+        totals.setdefault(origin, Usage()).add(usage)
+    return totals
+
+
+def report(usages=None, limit=15) -> str:
+    """Renders usage per origin, and its costliest operations, ranked by estimated spend."""
+    usages = COSTS.totals() if usages is None else usages
+    if not usages:
+        return "No Firestore usage recorded yet."
+    origins = sorted(by_origin(usages).items(), key=lambda item: item[1].cost(), reverse=True)
+    total = Usage()
+    for _, usage in origins:
+        total.add(usage)
+    lines = [f"Firestore usage: {total.reads} reads, {total.writes} writes, {total.deletes} deletes "
+             f"(~${total.cost():.4f})"]
+    for origin, usage in origins[:limit]:
+        share = usage.cost() / total.cost() if total.cost() else 0
+        lines.append(f"{origin}: {usage.reads}r/{usage.writes}w/{usage.deletes}d "
+                     f"(~${usage.cost():.4f}, {share:.0%})")
+        operations = sorted(
+            ((op, op_usage) for (op_origin, op), op_usage in usages.items() if op_origin == origin),
+            key=lambda item: item[1].cost(), reverse=True,
+        )
+        for op, op_usage in operations[:3]:
+            lines.append(f"  {op} x{op_usage.calls}: {op_usage.reads}r/{op_usage.writes}w/{op_usage.deletes}d")
+    return '\n'.join(lines)
+
+
+async def log_costs_job(context) -> None:
+    """Job queue callback that logs the Firestore usage of the past interval per origin."""
+    interval = COSTS.take_interval()
+    if not interval:
+        return
+    origins = sorted(by_origin(interval).items(), key=lambda item: item[1].cost(), reverse=True)
+    logger.info(
+        "Firestore usage summary",
+        interval_seconds=COST_SUMMARY_INTERVAL,
+        origins={origin: usage.as_dict() for origin, usage in origins},
+    )
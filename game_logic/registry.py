@@ -0,0 +1,98 @@
+"""Registry of active games, indexed by chat and user.
+
+Game state itself stays where each game keeps it (``chat_data`` for lobby games,
+``user_data`` for 'Guess the Number'); the registry only records which games are
+running where, so message routing and /endgame can find them without probing
+every state dict.
+"""
+from typing import Dict, List, Optional, Tuple
+
+GUESS_NUMBER = 'guess_number'
+LAST_MAN_STANDING = 'lastman'
+LAST_MESSAGE_WINS = 'lmw'
+
+# Key used in a chat's routes for games that capture messages from everyone in the chat
+ALL_USERS = None
+
+
+class ActiveGameRegistry:
+    """Tracks active games per chat and which of them capture chat messages."""
+
+    def __init__(self):
+        # chat_id -> {(kind, user_id): True}
+        self._games: Dict[int, Dict[Tuple[str, Optional[int]], bool]] = {}
+        # chat_id -> {user_id or ALL_USERS: kind}, only for games that capture messages
+        self._routes: Dict[int, Dict[Optional[int], str]] = {}
+
+    def register(self, chat_id: int, kind: str, user_id: Optional[int] = None, route_messages: bool = False) -> None:
+        """Records a game in a chat. Registering an existing game again updates its routing.
+
+        ``user_id`` scopes the game to one player; chat-wide games leave it as None.
+        """
+        self._games.setdefault(chat_id, {})[(kind, user_id)] = True
+        if route_messages:
+            self._routes.setdefault(chat_id, {})[user_id] = kind
+
+    def unregister(self, chat_id: int, kind: str, user_id: Optional[int] = None) -> None:
+        """Forgets a game. Unknown games are ignored."""
+        games = self._games.get(chat_id)
+        if games is not None:
+            games.pop((kind, user_id), None)
+            if not games:
+                del self._games[chat_id]
+
+        routes = self._routes.get(chat_id)
+        if routes is not None and routes.get(user_id) == kind:
+            del routes[user_id]
+            if not routes:
+                del self._routes[chat_id]
+
+    def route(self, chat_id: int, user_id: int) -> Optional[str]:
+        """Returns the kind of game that should receive this user's message, if any.
+
+        A player's own game takes precedence over a chat-wide one. Chats without
+        message-capturing games cost a single dict lookup.
+        """
+        routes = self._routes.get(chat_id)
+        if routes is None:
+            return None
+        return routes.get(user_id) or routes.get(ALL_USERS)
+
+    def games_in_chat(self, chat_id: int) -> List[Tuple[str, Optional[int]]]:
+        """Lists (kind, user_id) for every game active in the chat."""
+        return list(self._games.get(chat_id, {}))
+
+    def has_game(self, chat_id: int, kind: str, user_id: Optional[int] = None) -> bool:
+        return (kind, user_id) in self._games.get(chat_id, {})
+
+    def export_chat(self, chat_id: int) -> List[Tuple[str, Optional[int], bool]]:
+        """Returns ``(kind, user_id, routes_messages)`` for each game in the chat, for storing elsewhere."""
+        routes = self._routes.get(chat_id, {})
+        return [(kind, user_id, routes.get(user_id) == kind) for kind, user_id in self._games.get(chat_id, {})]
+
+    def import_chat(self, chat_id: int, entries) -> None:
+        """Replaces the chat's games with entries from ``export_chat``."""
+        self._games.pop(chat_id, None)
+        self._routes.pop(chat_id, None)
+        for kind, user_id, route_messages in entries:
+            self.register(chat_id, kind, user_id=user_id, route_messages=route_messages)
+
+    def games(self) -> List[Tuple[int, str, Optional[int]]]:
+        """Lists (chat_id, kind, user_id) for every active game."""
+        return [(chat_id, kind, user_id) for chat_id, games in self._games.items() for kind, user_id in games]
+
+    def count_by_kind(self) -> Dict[str, int]:
+        """Counts active games of each kind across all chats."""
+        counts: Dict[str, int] = {}
+        for games in self._games.values():
+            for kind, _ in games:
+                counts[kind] = counts.get(kind, 0) + 1
+        return counts
+
+
+def get_registry(bot_data) -> ActiveGameRegistry:
+    """Returns the application's registry, creating it on first use."""
+    registry = bot_data.get('games')
+    if registry is None:
+        registry = bot_data['games'] = ActiveGameRegistry()
+    return registry
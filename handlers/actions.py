@@ -4,6 +4,8 @@ from telegram import Update
 from telegram.ext import CallbackContext
 import structlog
 import database as db
+from game_logic import registry
+from . import game_guess_number, lastman_game, last_message_wins_game
 from .decorators import is_admin
 
 logger = structlog.get_logger(__name__)
@@ -14,6 +16,13 @@ STEAL_PENALTY = 5
 MIN_STEAL_AMOUNT = 5
 MAX_STEAL_AMOUNT = 15
 
+# How /endgame stops each kind of game
+GAME_CANCELLERS = {
+    registry.GUESS_NUMBER: game_guess_number.cancel_game,
+    registry.LAST_MAN_STANDING: lastman_game.cancel_game,
+    registry.LAST_MESSAGE_WINS: last_message_wins_game.cancel_game,
+}
+
 @is_admin
 async def give_xp(update: Update, context: CallbackContext) -> None:
     """Gives a specified amount of XP from the command user to another user."""
@@ -48,7 +57,7 @@ async def give_xp(update: Update, context: CallbackContext) -> None:
         await update.message.reply_text(f"You don't have enough XP to give {amount} away!")
         return
         
-    success = await db.transfer_xp(db_client, from_user_id=giver.id, to_user_id=recipient.id, amount=amount)
+    success = await db.transfer_xp(db_client, from_user_id=giver.id, to_user_id=recipient.id, amount=amount, reason='give')
 
     if success:
         message = f"🎁 {giver.mention_html()} generously gave {amount} XP to {recipient.mention_html()}!"
@@ -90,7 +99,7 @@ async def steal_xp(update: Update, context: CallbackContext) -> None:
     if random.random() < STEAL_SUCCESS_RATE:
         stolen_amount = random.randint(MIN_STEAL_AMOUNT, MAX_STEAL_AMOUNT)
         
-        success = await db.transfer_xp(db_client, from_user_id=victim.id, to_user_id=thief.id, amount=stolen_amount)
+        success = await db.transfer_xp(db_client, from_user_id=victim.id, to_user_id=thief.id, amount=stolen_amount, reason='steal')
 
         if success:
             message = f"🎉 {thief.mention_html()} masterfully swiped {stolen_amount} XP from {victim.mention_html()}!"
@@ -101,7 +110,7 @@ async def steal_xp(update: Update, context: CallbackContext) -> None:
 
         await update.message.reply_html(message)
     else:
-        await db.add_xp(db_client, thief.id, thief.username, xp_to_add=-STEAL_PENALTY)
+        await db.add_xp(db_client, thief.id, thief.username, xp_to_add=-STEAL_PENALTY, reason='steal_penalty')
         message = (
             f"🚓 Oh no! {thief.mention_html()} fumbled the attempt to rob {victim.mention_html()} "
             f"and lost {STEAL_PENALTY} XP in the process!"
@@ -133,7 +142,7 @@ async def award_xp(update: Update, context: CallbackContext) -> None:
         await update.message.reply_text("Bots don't need XP.")
         return
 
-    await db.add_xp(db_client, recipient.id, recipient.username, xp_to_add=amount)
+    await db.add_xp(db_client, recipient.id, recipient.username, xp_to_add=amount, reason='award')
     
     message = f"🌟 Admin {admin_user.mention_html()} awarded {amount} XP to {recipient.mention_html()}!"
     logger.info("XP awarded by admin", admin_id=admin_user.id, recipient_id=recipient.id, amount=amount)
@@ -143,21 +152,17 @@ async def award_xp(update: Update, context: CallbackContext) -> None:
 async def end_game(update: Update, context: CallbackContext) -> None:
     """Admin-only command to end any active game in the current chat."""
     chat_id = update.effective_chat.id
+    active_games = registry.get_registry(context.bot_data).games_in_chat(chat_id)
 
-    # For 'Guess the Number', the game state is stored in user_data,
-    # and we need to check all user_data within the chat for active games.
-    # This is a simplification; a more robust solution would involve
-    # storing active games in chat_data or a dedicated game state.
-    # For now, we'll iterate through known users who might have an active game.
-    
-    # In a real scenario, you'd have a way to track active games per chat.
-    # For this example, we'll just check if the current user has an active game.
-    # This will only end the game for the user who started it if they are the admin.
-    # A more complete solution for multi-user games would require chat_data.
+    if not active_games:
+        await update.message.reply_text("No active game found in this chat.")
+        return
+
+    for kind, user_id in active_games:
+        await GAME_CANCELLERS[kind](context, chat_id, user_id)
 
-    if 'game' in context.user_data:
-        del context.user_data['game']
+    if len(active_games) == 1:
         await update.message.reply_text("The active game has been ended.")
-        logger.info("Game ended by admin", chat_id=chat_id, admin_id=update.effective_user.id)
     else:
-        await update.message.reply_text("No active game found in this chat for you to end.")
+        await update.message.reply_text(f"{len(active_games)} active games have been ended.")
+    logger.info("Games ended by admin", chat_id=chat_id, admin_id=update.effective_user.id, games=active_games)
@@ -4,40 +4,37 @@ from telegram.ext import CallbackContext
 import structlog
 import database as db # Assuming database is needed for profile/leaderboard
 from . import core, game_guess_number, lastman_game, last_message_wins_game # Import core handlers for start, leaderboard
+from .router import CallbackRouter, encode_callback
 
 logger = structlog.get_logger(__name__)
 
+async def game_menu(update: Update, context: CallbackContext) -> None:
+    """Shows the list of games to choose from."""
+    keyboard = [
+        [InlineKeyboardButton("🔢 Guess the Number", callback_data=encode_callback('guess', 'start'))],
+        [InlineKeyboardButton("🏆 Last Person Standing", callback_data=encode_callback('lastman', 'lobby'))],
+        [InlineKeyboardButton("✉️ Last Message Wins", callback_data=encode_callback('lmw', 'lobby'))],
+        [InlineKeyboardButton("« Back to Main Menu", callback_data=encode_callback('menu', 'start'))],
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await update.callback_query.message.edit_text("Please choose a game to play:", reply_markup=reply_markup)
+
+# Dispatch table for every inline button. New games register their buttons here.
+router = CallbackRouter()
+router.register('menu', 'start', core.start)
+router.register('menu', 'profile', core.user_profile)
+router.register('menu', 'leaderboard', core.leaderboard)
+router.register('menu', 'games', game_menu)
+router.register('menu', 'help', core.help_command)
+router.register('lb', 'page', core.leaderboard_page)
+router.register('guess', 'start', game_guess_number.start_new_game)
+router.register('lastman', 'lobby', lastman_game.start_lastman_lobby)
+router.register('lastman', 'join', lastman_game.lastman_callback_handler, answer=False)
+router.register('lastman', 'start', lastman_game.lastman_callback_handler, answer=False)
+router.register('lmw', 'lobby', last_message_wins_game.start_lmw_lobby)
+router.register('lmw', 'join', last_message_wins_game.lmw_callback_handler, answer=False)
+router.register('lmw', 'start', last_message_wins_game.lmw_callback_handler, answer=False)
+
 async def button_handler(update: Update, context: CallbackContext) -> None:
     """Parses the CallbackQuery and calls the appropriate handler."""
-    query = update.callback_query
-    await query.answer()
-
-    if query.data == 'leaderboard':
-        # Pass the update and context to the core.leaderboard handler
-        # The leaderboard handler is designed to handle both commands and callbacks
-        await core.leaderboard(update, context)
-    elif query.data == 'start_menu':
-        # Pass the update and context to the core.start handler
-        await core.start(update, context)
-    # Add other button handlers here as features are implemented
-    elif query.data == 'profile':
-        await core.user_profile(update, context)
-    elif query.data == 'game_menu':
-        keyboard = [
-            [InlineKeyboardButton("🔢 Guess the Number", callback_data='start_number_game')],
-            [InlineKeyboardButton("🏆 Last Person Standing", callback_data='start_lastman_game')],
-            [InlineKeyboardButton("✉️ Last Message Wins", callback_data='start_lmw_game')],
-            [InlineKeyboardButton("« Back to Main Menu", callback_data='start_menu')],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.message.edit_text("Please choose a game to play:", reply_markup=reply_markup)
-    elif query.data == 'help_menu':
-        await core.help_command(update, context)
-    elif query.data == 'start_number_game':
-        await game_guess_number.start_new_game(update, context)
-    elif query.data == 'start_lastman_game':
-        await lastman_game.start_lastman_lobby(update, context)
-    elif query.data == 'start_lmw_game':
-        await last_message_wins_game.start_lmw_lobby(update, context)
-    else:
-        await query.message.edit_text("Unknown action.")
\ No newline at end of file
+    await router.dispatch(update, context)
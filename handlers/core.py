@@ -3,7 +3,9 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import CallbackContext
 import structlog
 import database as db
+import leaderboards
 from .decorators import is_admin
+from .router import encode_callback
 
 logger = structlog.get_logger(__name__)
 
@@ -13,10 +15,10 @@ async def start(update: Update, context: CallbackContext) -> None:
     logger.info("start_command", user_id=user.id, from_callback=update.callback_query is not None)
     
     keyboard = [
-        [InlineKeyboardButton("My Profile", callback_data='profile')],
-        [InlineKeyboardButton("Leaderboard", callback_data='leaderboard')],
-        [InlineKeyboardButton("Play a Game", callback_data='game_menu')],
-        [InlineKeyboardButton("How to Play", callback_data='help_menu')],
+        [InlineKeyboardButton("My Profile", callback_data=encode_callback('menu', 'profile'))],
+        [InlineKeyboardButton("Leaderboard", callback_data=encode_callback('menu', 'leaderboard'))],
+        [InlineKeyboardButton("Play a Game", callback_data=encode_callback('menu', 'games'))],
+        [InlineKeyboardButton("How to Play", callback_data=encode_callback('menu', 'help'))],
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -55,7 +57,7 @@ async def user_profile(update: Update, context: CallbackContext) -> None:
         profile_text = "You don't have a profile yet. Send some messages to start!"
 
     keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("« Back to Main Menu", callback_data='start_menu')]
+        [InlineKeyboardButton("« Back to Main Menu", callback_data=encode_callback('menu', 'start'))]
     ])
 
     if update.callback_query:
@@ -68,24 +70,35 @@ async def user_profile(update: Update, context: CallbackContext) -> None:
         await update.message.reply_html(profile_text, reply_markup=keyboard)
 
 async def leaderboard(update: Update, context: CallbackContext) -> None:
-    """Displays the leaderboard, with an optional limit."""
+    """Displays the leaderboard, with an optional limit.
+
+    Without a limit the first page of the paginated leaderboard is shown.
+    """
     logger.info("leaderboard_command", user_id=update.effective_user.id)
     db_client = context.bot_data['db']
-    limit = 10
-
-    if context.args:
-        try:
-            requested_limit = int(context.args[0])
-            if 1 <= requested_limit <= 100:
-                limit = requested_limit
-            else:
-                if update.message:
-                    await update.message.reply_text("Please provide a number between 1 and 100.")
-                return
-        except (IndexError, ValueError):
+
+    if not context.args:
+        await _show_leaderboard_page(update, context, page=0)
+        return
+
+    if context.args[0].lower() == 'here':
+        await _show_chat_leaderboard(update, context)
+        return
+
+    if context.args[0].lower() in leaderboards.LEADERBOARD_WINDOWS:
+        await _show_windowed_leaderboard(update, context, context.args[0].lower())
+        return
+
+    try:
+        limit = int(context.args[0])
+        if not 1 <= limit <= 100:
             if update.message:
-                await update.message.reply_text("Usage: /leaderboard [number]. Please provide a valid number.")
+                await update.message.reply_text("Please provide a number between 1 and 100.")
             return
+    except (IndexError, ValueError):
+        if update.message:
+            await update.message.reply_text("Usage: /leaderboard [number]. Please provide a valid number.")
+        return
 
     leaderboard_data = db.get_leaderboard(db_client, limit=limit)
     
@@ -97,16 +110,12 @@ async def leaderboard(update: Update, context: CallbackContext) -> None:
             await update.message.reply_text(text=message_text)
         return
 
-    leaderboard_text = f"🏆 <b>Top {limit} Players</b>\n\n"
-    medals = ["🥇", "🥈", "🥉"]
-    for i, (username, xp) in enumerate(leaderboard_data):
-        place = f"{medals[i]}" if i < 3 else f"  {i+1}. "
-        leaderboard_text += f"{place} @{html.escape(str(username))} - {xp} XP\n"
+    leaderboard_text = f"🏆 <b>Top {limit} Players</b>\n\n" + _render_leaderboard_entries(leaderboard_data, start_rank=1)
 
     keyboard = None
     if update.callback_query:
         keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("« Back to Main Menu", callback_data='start_menu')]
+            [InlineKeyboardButton("« Back to Main Menu", callback_data=encode_callback('menu', 'start'))]
         ])
     
     if update.callback_query:
@@ -118,6 +127,102 @@ async def leaderboard(update: Update, context: CallbackContext) -> None:
     else:
         await update.message.reply_html(leaderboard_text, reply_markup=keyboard)
 
+async def leaderboard_page(update: Update, context: CallbackContext) -> None:
+    """Shows a page of the leaderboard from the Next/Prev buttons (``lb:page:<page>:<version>``)."""
+    try:
+        page = max(0, int(context.args[0]))
+        version = int(context.args[1]) if len(context.args) > 1 else None
+    except (IndexError, ValueError):
+        page, version = 0, None
+    await _show_leaderboard_page(update, context, page, version)
+
+async def _show_leaderboard_page(update: Update, context: CallbackContext, page: int, version: int = None) -> None:
+    """Renders one page from the cached leaderboard with navigation buttons."""
+    pager = leaderboards.get_pager(context.bot_data)
+    result = await pager.get_page(context.bot_data['db'], page, version)
+    page = result.page  # The pager caps how deep a (possibly forged) page number can go
+
+    if not result.entries and page == 0:
+        message_text = "The leaderboard is currently empty."
+        if update.callback_query:
+            await update.callback_query.message.edit_text(text=message_text)
+        else:
+            await update.message.reply_text(text=message_text)
+        return
+
+    if page == 0:
+        title = f"🏆 <b>Top {pager.page_size} Players</b>"
+    else:
+        title = f"🏆 <b>Players {result.start_rank}-{result.start_rank + pager.page_size - 1}</b>"
+    if result.entries:
+        leaderboard_text = f"{title}\n\n" + _render_leaderboard_entries(result.entries, result.start_rank)
+    else:
+        leaderboard_text = f"{title}\n\nNo more players on the leaderboard."
+
+    navigation = []
+    if result.has_prev:
+        navigation.append(InlineKeyboardButton("« Prev", callback_data=encode_callback('lb', 'page', page - 1, result.version)))
+    if result.has_next:
+        navigation.append(InlineKeyboardButton("Next »", callback_data=encode_callback('lb', 'page', page + 1, result.version)))
+    rows = [navigation] if navigation else []
+    if update.callback_query:
+        rows.append([InlineKeyboardButton("« Back to Main Menu", callback_data=encode_callback('menu', 'start'))])
+    keyboard = InlineKeyboardMarkup(rows) if rows else None
+
+    if update.callback_query:
+        await update.callback_query.message.edit_text(
+            text=leaderboard_text,
+            reply_markup=keyboard,
+            parse_mode='HTML'
+        )
+    else:
+        await update.message.reply_html(leaderboard_text, reply_markup=keyboard)
+
+async def _show_chat_leaderboard(update: Update, context: CallbackContext) -> None:
+    """Shows the top players by XP earned in the current chat."""
+    chat = update.effective_chat
+    if chat.type == 'private':
+        await update.message.reply_text("Use /leaderboard here in a group to see its top players.")
+        return
+
+    chat_leaderboards = leaderboards.get_chat_leaderboards(context.bot_data)
+    entries = await chat_leaderboards.top(context.bot_data['db'], chat.id, leaderboards.LEADERBOARD_PAGE_SIZE)
+    if entries is None:
+        await update.message.reply_text("Couldn't load this chat's leaderboard right now. Please try again later.")
+        return
+    if not entries:
+        await update.message.reply_text("Nobody has earned XP in this chat yet.")
+        return
+
+    leaderboard_text = f"🏆 <b>Top {len(entries)} in this chat</b>\n\n" + _render_leaderboard_entries(entries, start_rank=1)
+    await update.message.reply_html(leaderboard_text)
+
+async def _show_windowed_leaderboard(update: Update, context: CallbackContext, window: str) -> None:
+    """Shows the top players by XP earned over a rolling window such as 'today' or 'week'."""
+    windowed = leaderboards.get_windowed_leaderboard(context.bot_data)
+    entries = await windowed.top(
+        context.bot_data['db'], leaderboards.LEADERBOARD_PAGE_SIZE, leaderboards.LEADERBOARD_WINDOWS[window]
+    )
+    if entries is None:
+        await update.message.reply_text("Couldn't load this leaderboard right now. Please try again later.")
+        return
+    if not entries:
+        await update.message.reply_text("Nobody has earned XP in this period yet.")
+        return
+
+    title = "today" if window == 'today' else f"the last {leaderboards.LEADERBOARD_WINDOWS[window]} days"
+    leaderboard_text = f"🏆 <b>Top {len(entries)} Players of {title}</b>\n\n" + _render_leaderboard_entries(entries, start_rank=1)
+    await update.message.reply_html(leaderboard_text)
+
+def _render_leaderboard_entries(entries, start_rank: int) -> str:
+    """Formats ``(username, xp)`` entries as ranked lines, with medals for the top three."""
+    medals = ["🥇", "🥈", "🥉"]
+    lines = ""
+    for rank, (username, xp) in enumerate(entries, start=start_rank):
+        place = f"{medals[rank - 1]}" if rank <= 3 else f"  {rank}. "
+        lines += f"{place} @{html.escape(str(username))} - {xp} XP\n"
+    return lines
+
 async def help_command(update: Update, context: CallbackContext) -> None:
     """Sends a detailed help message."""
     help_text = (
@@ -126,7 +231,9 @@ async def help_command(update: Update, context: CallbackContext) -> None:
         "<b>Core Commands:</b>\n"
         "  - /start: Shows the main menu.\n"
         "  - /profile or /menu: Displays your XP and stats.\n"
-        "  - /leaderboard [N]: Shows the top players (default is 10).\n\n"
+        "  - /leaderboard [N]: Shows the top N players, or the full leaderboard page by page.\n"
+        "  - /leaderboard here: Shows the top players in this chat.\n"
+        "  - /leaderboard today or /leaderboard week: Shows who earned the most XP recently.\n\n"
         "<b>Action Commands:</b>\n"
         "  - /give &lt;amount&gt; (reply to user): Give some of your XP to another player.\n"
         "  - /steal (reply to user): Attempt to steal XP from someone else. Be careful, it can backfire!\n\n"
@@ -137,7 +244,7 @@ async def help_command(update: Update, context: CallbackContext) -> None:
     )
     if update.callback_query:
         keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("« Back to Main Menu", callback_data='start_menu')]
+            [InlineKeyboardButton("« Back to Main Menu", callback_data=encode_callback('menu', 'start'))]
         ])
         await update.callback_query.message.edit_text(
             text=help_text,
@@ -1,20 +1,41 @@
+import os
+import time
 from functools import wraps
 from telegram import Update
 from telegram.ext import CallbackContext
 
+ADMIN_CACHE_TTL = 30  # seconds a chat's admin list is trusted; short, since admin commands move XP and a demoted admin must lose them quickly
+ADMIN_RECHECK_AFTER = 10  # seconds before a refused user triggers a fresh lookup, so new admins are not kept out
+
+def _admin_cache(bot_data):
+    return bot_data.setdefault('chat_admins', {})  # chat_id -> (fetched_at, admin user ids)
+
+async def get_chat_admin_ids(bot, bot_data, chat_id, max_age=ADMIN_CACHE_TTL):
+    """Returns the ids of a chat's admins, looking them up when the cached list is older than ``max_age``."""
+    cache = _admin_cache(bot_data)
+    cached = cache.get(chat_id)
+    if cached is not None and time.monotonic() - cached[0] < max_age:
+        return cached[1]
+    chat_admins = await bot.get_chat_administrators(chat_id)
+    admin_ids = frozenset(admin.user.id for admin in chat_admins)
+    cache[chat_id] = (time.monotonic(), admin_ids)
+    return admin_ids
+
 def is_admin(func):
     @wraps(func)
     async def wrapped(update: Update, context: CallbackContext, *args, **kwargs):
         chat = update.effective_chat
         user_id = update.effective_user.id
-        
+
         if chat.type == 'private':
             # In private chats, all users are "admins" of their own chat
             return await func(update, context, *args, **kwargs)
 
-        chat_admins = await context.bot.get_chat_administrators(chat.id)
-        is_user_admin = any(admin.user.id == user_id for admin in chat_admins)
-        
+        admin_ids = await get_chat_admin_ids(context.bot, context.bot_data, chat.id)
+        if user_id not in admin_ids:
+            admin_ids = await get_chat_admin_ids(context.bot, context.bot_data, chat.id, max_age=ADMIN_RECHECK_AFTER)
+        is_user_admin = user_id in admin_ids
+
         if is_user_admin:
             return await func(update, context, *args, **kwargs)
         else:
@@ -23,3 +44,17 @@ def is_admin(func):
             elif update.callback_query:
                 await update.callback_query.answer("This command can only be used by group admins.", show_alert=True)
     return wrapped
+
+def bot_operator_ids():
+    """Returns the user ids in ``BOT_ADMIN_IDS`` (comma separated), who may run bot-wide diagnostics."""
+    return frozenset(int(part) for part in os.getenv('BOT_ADMIN_IDS', '').split(',') if part.strip().lstrip('-').isdigit())
+
+def is_bot_operator(func):
+    """Restricts a command to the bot's operators; chat admins are not enough, since it affects every chat."""
+    @wraps(func)
+    async def wrapped(update: Update, context: CallbackContext, *args, **kwargs):
+        if update.effective_user.id in bot_operator_ids():
+            return await func(update, context, *args, **kwargs)
+        if update.message:
+            await update.message.reply_text("This command can only be used by the bot's operators.")
+    return wrapped
@@ -0,0 +1,50 @@
+from telegram import Update
+from telegram.ext import CallbackContext
+import structlog
+import firestore_costs
+import profiling
+from .decorators import is_bot_operator
+
+logger = structlog.get_logger(__name__)
+
+PROFILE_USAGE = "Usage: /profilebot [seconds] [cprofile|sampling]"
+
+@is_bot_operator
+async def profile_bot(update: Update, context: CallbackContext) -> None:
+    """Operator-only command that profiles the running bot and sends back the profile file."""
+    args = context.args or []
+    try:
+        seconds = profiling.clamp_seconds(args[0]) if args else profiling.PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        await update.message.reply_text(PROFILE_USAGE)
+        return
+    mode = args[1].lower() if len(args) > 1 else profiling.SAMPLING
+    if mode not in profiling.PROFILE_MODES:
+        await update.message.reply_text(PROFILE_USAGE)
+        return
+
+    profiler = profiling.get_profiler(context.bot_data)
+    if profiler.active is not None:
+        await update.message.reply_text(f"A {profiler.active.mode} profile is already running.")
+        return
+
+    await update.message.reply_text(f"Profiling the bot ({mode}) for {seconds:g} seconds...")
+    # The session outlives this update, so other updates are profiled while it runs
+    context.application.create_task(
+        _profile_and_report(profiler, mode, seconds, update.effective_chat.id, context),
+        name="profile_bot",
+    )
+
+async def _profile_and_report(profiler, mode, seconds, chat_id, context) -> None:
+    try:
+        session = await profiler.run(mode, seconds)
+    except profiling.ProfilerError as e:
+        await context.bot.send_message(chat_id, str(e))
+        return
+    with open(session.path, 'rb') as f:
+        await context.bot.send_document(chat_id, document=f, caption=f"{mode} profile, {seconds:g} seconds")
+
+@is_bot_operator
+async def firestore_costs_report(update: Update, context: CallbackContext) -> None:
+    """Operator-only command that reports Firestore reads, writes and deletes per command and handler."""
+    await update.message.reply_text(firestore_costs.report())
@@ -3,6 +3,7 @@ import structlog
 from telegram import Update
 from telegram.ext import CallbackContext
 import database as db
+from game_logic.registry import GUESS_NUMBER, get_registry
 from .decorators import is_admin
 
 logger = structlog.get_logger(__name__)
@@ -12,13 +13,22 @@ async def start_new_game(update: Update, context: CallbackContext):
     """Starts a new 'Guess the Number' game."""
     user = update.effective_user
     user_id = user.id
+    chat_id = update.effective_chat.id
     secret_number = random.randint(1, 100)
     max_tries = 7
-    
+    registry = get_registry(context.bot_data)
+
+    # A player has one game at a time; a game left running in another chat stops capturing their messages there
+    previous_game = context.user_data.get('game')
+    if previous_game is not None and previous_game.get('chat_id') != chat_id:
+        registry.unregister(previous_game['chat_id'], GUESS_NUMBER, user_id=user_id)
+
     context.user_data['game'] = {
         'secret_number': secret_number,
-        'tries_left': max_tries
+        'tries_left': max_tries,
+        'chat_id': chat_id
     }
+    registry.register(chat_id, GUESS_NUMBER, user_id=user_id, route_messages=True)
     
     logger.info("New game started", user_id=user_id, secret_number=secret_number, max_tries=max_tries)
     
@@ -59,14 +69,14 @@ async def handle_guess(update: Update, context: CallbackContext):
         bonus_xp = tries_left 
         xp_award = min(base_xp + bonus_xp, 3) 
         db_client = context.bot_data['db']
-        await db.add_xp(db_client, user.id, user.username, xp_to_add=xp_award)
+        await db.add_xp(db_client, user.id, user.username, xp_to_add=xp_award, reason='guess_number_win')
         message = (
             f"🎉 Congratulations! You guessed the number {secret_number} in {7 - tries_left} tries! "
             f"You've earned {xp_award} XP!\n\n"
             "Use /start_game to play again."
         )
         await update.message.reply_text(message)
-        del context.user_data['game']
+        _finish_game(context, user.id)
         logger.info("Game won", user_id=user.id, xp_awarded=xp_award)
     elif tries_left <= 0:
         message = (
@@ -74,9 +84,22 @@ async def handle_guess(update: Update, context: CallbackContext):
             "Use /start_game to play again."
         )
         await update.message.reply_text(message)
-        del context.user_data['game']
+        _finish_game(context, user.id)
         logger.info("Game lost", user_id=user.id, secret_number=secret_number)
     elif user_guess < secret_number:
         await update.message.reply_text(f"Too low! You have {tries_left} tries left.")
     else: # user_guess > secret_number
         await update.message.reply_text(f"Too high! You have {tries_left} tries left.")
+
+
+def _finish_game(context: CallbackContext, user_id: int) -> None:
+    """Removes the player's game state and its registry entry."""
+    game_state = context.user_data.pop('game')
+    chat_id = game_state.get('chat_id')
+    if chat_id is not None:
+        get_registry(context.bot_data).unregister(chat_id, GUESS_NUMBER, user_id=user_id)
+
+async def cancel_game(context: CallbackContext, chat_id: int, user_id: int) -> None:
+    """Ends a player's game on behalf of an admin."""
+    context.application.user_data[user_id].pop('game', None)
+    get_registry(context.bot_data).unregister(chat_id, GUESS_NUMBER, user_id=user_id)
@@ -1,17 +1,24 @@
 import asyncio
-import time
+from datetime import datetime, timedelta, timezone
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import CallbackContext
 import structlog
 
 import database as db
+import firestore_costs
+from game_logic.registry import LAST_MESSAGE_WINS, get_registry
+from .router import callback_data, encode_callback
 
 logger = structlog.get_logger(__name__)
 
 LMW_GAME_DURATION = 30  # seconds for the countdown
+LMW_GRACE_PERIOD = 5  # extra seconds to wait for updates sent before the deadline but still in flight
 LMW_ENTRY_COST = 5
 LMW_XP_POT_MULTIPLIER = 0.5  # Each player adds 50% of their entry cost to the pot
 
+LMW_JOIN_DATA = encode_callback('lmw', 'join')
+LMW_START_DATA = encode_callback('lmw', 'start')
+
 async def start_lmw_lobby(update: Update, context: CallbackContext) -> None:
     """Starts a lobby for the 'Last Message Wins' game."""
     chat_id = update.effective_chat.id
@@ -52,22 +59,22 @@ async def start_lmw_lobby(update: Update, context: CallbackContext) -> None:
             'job': None,
             'last_message_info': {'user_id': None, 'username': None, 'message_id': None, 'timestamp': None}
         }
+        get_registry(context.bot_data).register(chat_id, LAST_MESSAGE_WINS)
     
     game_data = context.chat_data['lmw_game']
     
     # Deduct entry cost and add to pot
-    await db.add_xp(db_client, user.id, user.username, -LMW_ENTRY_COST)
+    await db.add_xp(db_client, user.id, user.username, -LMW_ENTRY_COST, reason='lmw_entry')
     game_data['xp_pot'] += int(LMW_ENTRY_COST * LMW_XP_POT_MULTIPLIER)
 
     game_data['players'][user.id] = {
         'username': user.username if user.username else user.first_name,
-        'mention': user.mention_html(),
-        'has_messaged': False # Track if player has sent their one message
+        'mention': user.mention_html()
     }
 
     keyboard = [
-        [InlineKeyboardButton("Join Game", callback_data='lmw_join')],
-        [InlineKeyboardButton("Start Game", callback_data='lmw_start')]
+        [InlineKeyboardButton("Join Game", callback_data=LMW_JOIN_DATA)],
+        [InlineKeyboardButton("Start Game", callback_data=LMW_START_DATA)]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
@@ -97,7 +104,7 @@ async def start_lmw_lobby(update: Update, context: CallbackContext) -> None:
             reply_markup=reply_markup,
             parse_mode='HTML'
         )
-    logger.info("LMW lobby updated", chat_id=chat_id, players=game_data['players'])
+    logger.info("LMW lobby updated", chat_id=chat_id, players=len(game_data['players']))
 
 async def lmw_callback_handler(update: Update, context: CallbackContext) -> None:
     """Handles callbacks for the 'Last Message Wins' game."""
@@ -112,7 +119,7 @@ async def lmw_callback_handler(update: Update, context: CallbackContext) -> None
     
     game_data = context.chat_data['lmw_game']
 
-    if query.data == 'lmw_join':
+    if callback_data(query) == LMW_JOIN_DATA:
         if game_data['status'] != 'lobby':
             await query.answer("Game already started!", show_alert=True)
             return
@@ -126,13 +133,12 @@ async def lmw_callback_handler(update: Update, context: CallbackContext) -> None
             await query.answer(f"You need at least {LMW_ENTRY_COST} XP to join this game!", show_alert=True)
             return
 
-        await db.add_xp(db_client, user.id, user.username, -LMW_ENTRY_COST)
+        await db.add_xp(db_client, user.id, user.username, -LMW_ENTRY_COST, reason='lmw_entry')
         game_data['xp_pot'] += int(LMW_ENTRY_COST * LMW_XP_POT_MULTIPLIER)
 
         game_data['players'][user.id] = {
             'username': user.username if user.username else user.first_name,
-            'mention': user.mention_html(),
-            'has_messaged': False
+            'mention': user.mention_html()
         }
 
         player_list_html = ', '.join([p['mention'] for p in game_data['players'].values()])
@@ -154,7 +160,7 @@ async def lmw_callback_handler(update: Update, context: CallbackContext) -> None
         )
         logger.info("Player joined LMW lobby", chat_id=chat_id, user_id=user.id)
 
-    elif query.data == 'lmw_start':
+    elif callback_data(query) == LMW_START_DATA:
         if game_data['status'] != 'lobby':
             await query.answer("Game already started!", show_alert=True)
             return
@@ -162,8 +168,11 @@ async def lmw_callback_handler(update: Update, context: CallbackContext) -> None
             await query.answer("Need at least 2 players to start the game!", show_alert=True)
             return
         
-        # Start the game
+        # Start the game. Players who may still send their one message are resolved
+        # into a set up front so the message hot path is a single membership test.
         game_data['status'] = 'in_progress'
+        game_data['pending_players'] = set(game_data['players'])
+        get_registry(context.bot_data).register(chat_id, LAST_MESSAGE_WINS, route_messages=True)
         player_list_html = ', '.join([p['mention'] for p in game_data['players'].values()])
         await context.bot.edit_message_text(
             chat_id=chat_id,
@@ -175,38 +184,63 @@ async def lmw_callback_handler(update: Update, context: CallbackContext) -> None
             parse_mode='HTML',
             reply_markup=None # Remove buttons
         )
-        logger.info("LMW game started", chat_id=chat_id, players=game_data['players'])
+        logger.info("LMW game started", chat_id=chat_id, players=len(game_data['players']))
         await start_lmw_game(update, context)
 
 async def lmw_message_handler(update: Update, context: CallbackContext) -> None:
-    """Handles messages during the 'Last Message Wins' game."""
-    user = update.effective_user
-    
-    if 'lmw_game' not in context.chat_data or context.chat_data['lmw_game']['status'] != 'in_progress':
+    """Handles messages during the 'Last Message Wins' game.
+
+    This runs for every message in the chat during the final seconds of a game,
+    so it does no logging and no database access.
+    """
+    game_data = context.chat_data.get('lmw_game')
+    if game_data is None or game_data['status'] != 'in_progress':
         return # Not in an active LMW game
 
-    game_data = context.chat_data['lmw_game']
+    user = update.effective_user
+    pending_players = game_data['pending_players']
 
-    if user.id not in game_data['players']:
-        # This message is from someone not in the game
+    if user.id not in pending_players:
+        if user.id in game_data['players']:
+            try:
+                await update.message.reply_text("You have already sent your message for this round!")
+            except Exception as e:
+                logger.warning("Could not reply to user, probably because message was deleted.", error=e)
+        # Otherwise the message is from someone not in the game
         return
 
-    if game_data['players'][user.id]['has_messaged']:
-        try:
-            await update.message.reply_text("You have already sent your message for this round!")
-        except Exception as e:
-            logger.warning("Could not reply to user, probably because message was deleted.", error=e)
+    message = update.message
+    if not _is_on_time(game_data, message):
+        # Sent before the game started or after the deadline; processing lag must not change the result.
         return
 
-    # Record the last message
-    game_data['last_message_info'] = {
-        'user_id': user.id,
-        'username': user.username if user.username else user.first_name,
-        'message_id': update.message.message_id,
-        'timestamp': time.time()
-    }
-    game_data['players'][user.id]['has_messaged'] = True
-    logger.info("LMW message recorded", chat_id=update.effective_chat.id, user_id=user.id)
+    pending_players.discard(user.id)
+
+    # Record the message only if Telegram ordered it after the current last one
+    last_message_id = game_data['last_message_info']['message_id']
+    if last_message_id is None or message.message_id > last_message_id:
+        game_data['last_message_info'] = {
+            'user_id': user.id,
+            'username': user.username if user.username else user.first_name,
+            'message_id': message.message_id,
+            'timestamp': message.date
+        }
+
+
+def _is_on_time(game_data: dict, message) -> bool:
+    """Checks a message against the game window using Telegram's own ordering.
+
+    ``message.date`` is stamped by Telegram when the message is sent and
+    ``message_id`` grows monotonically within a chat, so neither depends on how
+    far behind the bot is when the update is finally handled.
+    """
+    start_message_id = game_data.get('start_message_id')
+    if start_message_id is not None and message.message_id <= start_message_id:
+        return False
+    deadline = game_data.get('deadline')
+    if deadline is not None and message.date > deadline:
+        return False
+    return True
 
 
 async def start_lmw_game(update: Update, context: CallbackContext) -> None:
@@ -220,10 +254,17 @@ async def start_lmw_game(update: Update, context: CallbackContext) -> None:
         parse_mode='HTML'
     )
 
-    # Schedule the end of the game
-    game_data['job'] = context.job_queue.run_once(
-        end_lmw_game,
-        LMW_GAME_DURATION,
+    # The deadline is measured on Telegram's clock (the countdown message's date) so it
+    # compares directly against the dates of the players' messages.
+    started_at = countdown_message.date or datetime.now(timezone.utc)
+    game_data['start_message_id'] = countdown_message.message_id
+    game_data['deadline'] = started_at + timedelta(seconds=LMW_GAME_DURATION)
+
+    # Schedule the end of the game, leaving a grace window for in-flight updates.
+    # The job is found by name when cancelled, so game state stays plain data.
+    context.job_queue.run_once(
+        firestore_costs.attributed_job('lmw_end_game', end_lmw_game),
+        LMW_GAME_DURATION + LMW_GRACE_PERIOD,
         data={'chat_id': chat_id, 'countdown_message_id': countdown_message.message_id},
         chat_id=chat_id,
         name=f"lmw_end_game_{chat_id}"
@@ -240,28 +281,70 @@ async def end_lmw_game(context: CallbackContext) -> None:
     winner_info = game_data['last_message_info']
     xp_pot = game_data['xp_pot']
 
-    if winner_info['user_id']:
-        db_client = context.bot_data['db']
-        await db.add_xp(db_client, winner_info['user_id'], winner_info['username'], xp_pot)
-        winner_mention = (await context.bot.get_chat_member(chat_id, winner_info['user_id'])).user.mention_html()
-        
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=f"🎉 Time's up! The winner is {winner_mention} with the last message!\n\n"
-                 f"They win the entire pot of {xp_pot} XP!",
-            parse_mode='HTML',
-            reply_to_message_id=winner_info['message_id']
-        )
-        logger.info("LMW game ended, winner found", chat_id=chat_id, winner_id=winner_info['user_id'], xp_won=xp_pot)
-    else:
-        await context.bot.edit_message_text(
-            chat_id=chat_id,
-            message_id=countdown_message_id,
-            text="😔 Time's up! No one sent a message. The XP pot has been lost to the void...",
-            parse_mode='HTML'
-        )
-        logger.info("LMW game ended, no winner", chat_id=chat_id)
+    try:
+        if winner_info['user_id']:
+            db_client = context.bot_data['db']
+            # The mention was rendered when the winner joined the lobby, so no member lookup is needed
+            winner_mention = game_data['players'][winner_info['user_id']]['mention']
+
+            # Award the pot and announce the winner concurrently; one failing must not cancel the other
+            results = await asyncio.gather(
+                db.add_xp(db_client, winner_info['user_id'], winner_info['username'], xp_pot, reason='lmw_win'),
+                context.bot.send_message(
+                    chat_id=chat_id,
+                    text=f"🎉 Time's up! The winner is {winner_mention} with the last message!\n\n"
+                         f"They win the entire pot of {xp_pot} XP!",
+                    parse_mode='HTML',
+                    reply_to_message_id=winner_info['message_id']
+                ),
+                return_exceptions=True
+            )
+            for step, result in zip(('award_xp', 'announce_winner'), results):
+                if isinstance(result, Exception):
+                    logger.error("LMW game end step failed", chat_id=chat_id, step=step, error=result)
+            logger.info("LMW game ended, winner found", chat_id=chat_id, winner_id=winner_info['user_id'], xp_won=xp_pot)
+        else:
+            await context.bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=countdown_message_id,
+                text="😔 Time's up! No one sent a message. The XP pot has been lost to the void...",
+                parse_mode='HTML'
+            )
+            logger.info("LMW game ended, no winner", chat_id=chat_id)
+    finally:
+        # Clean up game data even if an announcement failed, so the chat can start a new game
+        if 'lmw_game' in context.chat_data:
+            del context.chat_data['lmw_game']
+        get_registry(context.bot_data).unregister(chat_id, LAST_MESSAGE_WINS)
+
+async def cancel_game(context: CallbackContext, chat_id: int, user_id=None) -> None:
+    """Ends the chat's game on behalf of an admin, refunding every player's entry cost."""
+    for job in context.job_queue.get_jobs_by_name(f"lmw_end_game_{chat_id}"):
+        job.schedule_removal()
+    game_data = context.chat_data.pop('lmw_game', None)
+    get_registry(context.bot_data).unregister(chat_id, LAST_MESSAGE_WINS)
+    if game_data is None:
+        return
 
-    # Clean up game data
-    if 'lmw_game' in context.chat_data:
-        del context.chat_data['lmw_game']
+    db_client = context.bot_data['db']
+    players = list(game_data['players'].items())
+    results = await asyncio.gather(
+        *(db.add_xp(db_client, player_id, player['username'], LMW_ENTRY_COST, reason='lmw_refund')
+          for player_id, player in players),
+        return_exceptions=True
+    )
+    for (player_id, _), result in zip(players, results):
+        if result is None or isinstance(result, Exception):
+            logger.error("LMW entry refund failed", chat_id=chat_id, user_id=player_id, error=result)
+
+    # Take the Join/Start buttons (or the running countdown) off the game's messages
+    text = (f"🛑 This 'Last Message Wins' game was cancelled by an admin. "
+            f"Every player's {LMW_ENTRY_COST} XP entry cost has been refunded.")
+    for message_id in (game_data.get('message_id'), game_data.get('start_message_id')):
+        if message_id is None:
+            continue
+        try:
+            await context.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, reply_markup=None)
+        except Exception as e:
+            logger.warning("Could not mark LMW game message as cancelled", chat_id=chat_id, error=e)
+    logger.info("LMW game cancelled", chat_id=chat_id, refunded=len(players))
@@ -4,6 +4,9 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import CallbackContext
 import structlog
 import database as db
+import firestore_costs
+from game_logic.registry import LAST_MAN_STANDING, get_registry
+from .router import callback_data, encode_callback
 
 logger = structlog.get_logger(__name__)
 
@@ -13,6 +16,9 @@ WINNERS_COUNT = 3
 XP_AWARD_WINNER = 10
 XP_AWARD_TOP_3 = 5
 
+LASTMAN_JOIN_DATA = encode_callback('lastman', 'join')
+LASTMAN_START_DATA = encode_callback('lastman', 'start')
+
 async def start_lastman_lobby(update: Update, context: CallbackContext) -> None:
     """Starts a lobby for the 'Last Person Standing' game."""
     chat_id = update.effective_chat.id
@@ -25,6 +31,7 @@ async def start_lastman_lobby(update: Update, context: CallbackContext) -> None:
             'message_id': None,
             'job': None
         }
+        get_registry(context.bot_data).register(chat_id, LAST_MAN_STANDING)
         
     game_data = context.chat_data['lastman_game']
 
@@ -48,8 +55,8 @@ async def start_lastman_lobby(update: Update, context: CallbackContext) -> None:
     }
 
     keyboard = [
-        [InlineKeyboardButton("Join Game", callback_data='lastman_join')],
-        [InlineKeyboardButton("Start Game", callback_data='lastman_start')]
+        [InlineKeyboardButton("Join Game", callback_data=LASTMAN_JOIN_DATA)],
+        [InlineKeyboardButton("Start Game", callback_data=LASTMAN_START_DATA)]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
@@ -74,7 +81,7 @@ async def start_lastman_lobby(update: Update, context: CallbackContext) -> None:
             reply_markup=reply_markup,
             parse_mode='HTML'
         )
-    logger.info("Last Man Standing lobby updated", chat_id=chat_id, players=game_data['players'])
+    logger.info("Last Man Standing lobby updated", chat_id=chat_id, players=len(game_data['players']))
 
 async def lastman_callback_handler(update: Update, context: CallbackContext) -> None:
     """Handles callbacks for the 'Last Person Standing' game."""
@@ -89,7 +96,7 @@ async def lastman_callback_handler(update: Update, context: CallbackContext) ->
     
     game_data = context.chat_data['lastman_game']
 
-    if query.data == 'lastman_join':
+    if callback_data(query) == LASTMAN_JOIN_DATA:
         if game_data['status'] != 'lobby':
             await query.answer("Game already started!", show_alert=True)
             return
@@ -113,7 +120,7 @@ async def lastman_callback_handler(update: Update, context: CallbackContext) ->
         )
         logger.info("Player joined Last Man Standing lobby", chat_id=chat_id, user_id=user.id)
 
-    elif query.data == 'lastman_start':
+    elif callback_data(query) == LASTMAN_START_DATA:
         if game_data['status'] != 'lobby':
             await query.answer("Game already started!", show_alert=True)
             return
@@ -132,7 +139,7 @@ async def lastman_callback_handler(update: Update, context: CallbackContext) ->
             parse_mode='HTML',
             reply_markup=None # Remove buttons
         )
-        logger.info("Last Man Standing game started", chat_id=chat_id, players=game_data['players'])
+        logger.info("Last Man Standing game started", chat_id=chat_id, players=len(game_data['players']))
         await start_elimination_phase(update, context)
 
 async def start_elimination_phase(update: Update, context: CallbackContext) -> None:
@@ -168,7 +175,7 @@ async def notify_next_elimination(context: CallbackContext, chat_id: int) -> Non
 
     # Schedule the elimination
     context.job_queue.run_once(
-        perform_elimination,
+        firestore_costs.attributed_job('lastman_elimination', perform_elimination),
         ELIMINATION_INTERVAL,
         data={'chat_id': chat_id},
         chat_id=chat_id,
@@ -208,7 +215,7 @@ async def end_lastman_game(context: CallbackContext, chat_id: int) -> None:
     winners = []
     for user_id in game_data['players_remaining']:
         winners.append(game_data['players'][user_id]['mention'])
-        await db.add_xp(context.bot_data['db'], user_id, game_data['players'][user_id]['username'], XP_AWARD_TOP_3)
+        await db.add_xp(context.bot_data['db'], user_id, game_data['players'][user_id]['username'], XP_AWARD_TOP_3, reason='lastman_award')
 
     if winners:
         await context.bot.send_message(
@@ -226,3 +233,11 @@ async def end_lastman_game(context: CallbackContext, chat_id: int) -> None:
     logger.info("Last Man Standing game ended", chat_id=chat_id, winners=winners)
     # Clean up game data
     del context.chat_data['lastman_game']
+    get_registry(context.bot_data).unregister(chat_id, LAST_MAN_STANDING)
+
+async def cancel_game(context: CallbackContext, chat_id: int, user_id=None) -> None:
+    """Ends the chat's game on behalf of an admin, stopping any pending elimination."""
+    for job in context.job_queue.get_jobs_by_name(f"lastman_elimination_{chat_id}"):
+        job.schedule_removal()
+    context.chat_data.pop('lastman_game', None)
+    get_registry(context.bot_data).unregister(chat_id, LAST_MAN_STANDING)
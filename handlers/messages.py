@@ -2,6 +2,10 @@ from telegram import Update
 from telegram.ext import CallbackContext
 import structlog
 import database as db
+import leaderboards
+import load_shedding
+import metrics
+import warmup
 
 logger = structlog.get_logger(__name__)
 
@@ -15,6 +19,29 @@ async def handle_message(update: Update, context: CallbackContext) -> None:
     if update.message and update.message.text and update.message.text.startswith('/'):
         return
 
+    chat = update.effective_chat
+    chat_id = chat.id if chat and chat.type != 'private' else None
+    warmup.get_recent_activity(context.bot_data).touch(user.id)
+
+    # When the bot is behind, passive XP is summed in memory or skipped so games and commands keep up
+    shed_level = load_shedding.get_lag_monitor(context.bot_data).level
+    if shed_level == load_shedding.DROP:
+        metrics.PASSIVE_XP_SHED.inc('dropped')
+        return
+    if shed_level == load_shedding.COALESCE:
+        metrics.PASSIVE_XP_SHED.inc('coalesced')
+        load_shedding.get_xp_coalescer(context.bot_data).add(user.id, user.username, 1, chat_id=chat_id)
+        return
+
     logger.info("handle_message: Awarding XP", user_id=user.id, username=user.username)
+    # With the XP ledger enabled passive XP is a buffered append, folded into balances later
+    if db.append_xp(user.id, user.username, 1, 'message', chat_id=chat_id):
+        if chat_id is not None:
+            leaderboards.get_chat_leaderboards(context.bot_data).record_delta(chat_id, user.id, user.username, 1)
+        return
+
     db_client = context.bot_data['db']
-    await db.add_xp(db_client, user.id, user.username, 1)
+    # The per-chat counter is written in the same transaction as the user's XP
+    result = await db.add_xp(db_client, user.id, user.username, 1, chat_id=chat_id, reason='message')
+    if result and chat_id is not None:
+        leaderboards.get_chat_leaderboards(context.bot_data).record(chat_id, user.id, user.username, result['chat_xp'])
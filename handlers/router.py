@@ -0,0 +1,94 @@
+"""Compact callback data encoding and a dict-based callback query router.
+
+Callback data is encoded as ``game:action[:arg...]``, e.g. ``lmw:join`` or
+``lb:page:2``. The router looks up ``(game, action)`` in a dispatch table, so
+routing costs one dict lookup no matter how many games register buttons.
+Buttons sent before this encoding still carry their old data, which
+``LEGACY_CALLBACK_DATA`` translates.
+"""
+from collections import namedtuple
+from telegram import Update
+from telegram.ext import CallbackContext
+import structlog
+import metrics
+
+logger = structlog.get_logger(__name__)
+
+CALLBACK_SEPARATOR = ':'
+MAX_CALLBACK_DATA_BYTES = 64  # Telegram's limit for callback_data
+
+Route = namedtuple('Route', ['handler', 'answer'])
+
+# Data of buttons sent before the game:action encoding; they stay on messages already in chats
+LEGACY_CALLBACK_DATA = {
+    'start_menu': 'menu:start',
+    'profile': 'menu:profile',
+    'leaderboard': 'menu:leaderboard',
+    'game_menu': 'menu:games',
+    'help_menu': 'menu:help',
+    'start_number_game': 'guess:start',
+    'start_lastman_game': 'lastman:lobby',
+    'start_lmw_game': 'lmw:lobby',
+    'lastman_join': 'lastman:join',
+    'lastman_start': 'lastman:start',
+    'lmw_join': 'lmw:join',
+    'lmw_start': 'lmw:start',
+}
+
+
+def encode_callback(game: str, action: str, *args) -> str:
+    """Builds callback data for a button. Arguments are stringified."""
+    data = CALLBACK_SEPARATOR.join([game, action, *(str(arg) for arg in args)])
+    if len(data.encode('utf-8')) > MAX_CALLBACK_DATA_BYTES:
+        raise ValueError(f"Callback data exceeds {MAX_CALLBACK_DATA_BYTES} bytes: {data!r}")
+    return data
+
+
+def callback_data(query) -> str:
+    """Returns the query's callback data, translating legacy button data to the current encoding."""
+    return LEGACY_CALLBACK_DATA.get(query.data, query.data)
+
+
+def decode_callback(data: str):
+    """Splits callback data into ``(game, action, args)``."""
+    game, _, rest = (data or '').partition(CALLBACK_SEPARATOR)
+    action, _, raw_args = rest.partition(CALLBACK_SEPARATOR)
+    args = raw_args.split(CALLBACK_SEPARATOR) if raw_args else []
+    return game, action, args
+
+
+class CallbackRouter:
+    """Dispatch table from ``(game, action)`` to callback query handlers."""
+
+    def __init__(self):
+        self.routes = {}
+
+    def register(self, game: str, action: str, handler, answer: bool = True) -> None:
+        """Routes ``game:action`` callbacks to ``handler``.
+
+        With ``answer`` the router answers the query before calling the handler;
+        handlers that answer queries themselves (e.g. with alerts) should pass False.
+        """
+        self.routes[(game, action)] = Route(handler, answer)
+
+    async def dispatch(self, update: Update, context: CallbackContext) -> None:
+        """Calls the handler registered for the query's data.
+
+        Arguments encoded after the action are exposed as ``context.args``,
+        the same place command arguments live.
+        """
+        query = update.callback_query
+        game, action, args = decode_callback(callback_data(query))
+        route = self.routes.get((game, action))
+
+        if route is None:
+            # The message may be a live lobby or menu, so it is left as it is
+            logger.warning("Unknown callback data", data=query.data)
+            await query.answer("This button is no longer available.", show_alert=True)
+            return
+
+        if route.answer:
+            await query.answer()
+        context.args = args
+        with metrics.track_handler(f"callback:{game}:{action}"):
+            await route.handler(update, context)
@@ -0,0 +1,456 @@
+"""In-memory leaderboard caches.
+
+``LeaderboardPager`` serves the paginated global leaderboard. The top
+``snapshot_size`` users are read in one query and paged from memory; deeper
+pages are read with Firestore cursors that are cached per page, so browsing
+to page N costs one page of reads instead of re-reading the top N users.
+With a ``user_cache.UserCache`` loaded, pages are ranked from memory instead.
+
+``ChatLeaderboards`` keeps a ``RankIndex`` per chat that is seeded once from
+Firestore and then updated with the exact totals returned by each XP write
+(or with deltas when XP goes through the ledger).
+
+``WindowedLeaderboard`` records every XP change into per-user daily buckets.
+Deltas are buffered and flushed to Firestore in batches; rolling-window
+rankings ("today", "this week") are summed from the in-memory buckets.
+"""
+import asyncio
+import heapq
+import time
+from datetime import datetime, timedelta, timezone
+
+import structlog
+
+import database as db
+
+logger = structlog.get_logger(__name__)
+
+LEADERBOARD_PAGE_SIZE = 10
+LEADERBOARD_SNAPSHOT_SIZE = 100  # Top users fetched in one query and paged from memory
+LEADERBOARD_SNAPSHOT_TTL = 60  # seconds before the snapshot is re-read
+LEADERBOARD_MAX_PAGE = 49  # Deepest page served (0-based); requests for later pages get this one
+CHAT_LEADERBOARD_SEED_SIZE = 50  # Members read from Firestore when a chat's index is first needed
+LEADERBOARD_WINDOWS = {'today': 1, 'week': 7}  # Window name -> days, including today
+DAILY_XP_FLUSH_INTERVAL = 30  # seconds between batched writes of daily buckets
+
+
+class LeaderboardPage:
+    """One page of the leaderboard, as served to a handler."""
+
+    def __init__(self, page, version, entries, start_rank, has_next):
+        self.page = page
+        self.version = version
+        self.entries = entries  # [(username, xp)]
+        self.start_rank = start_rank  # 1-based rank of entries[0]
+        self.has_next = has_next
+
+    @property
+    def has_prev(self):
+        return self.page > 0
+
+
+class LeaderboardPager:
+    """Serves leaderboard pages from a versioned snapshot and cached cursors.
+
+    Every snapshot refresh bumps ``version``. Pages are cached under
+    ``(version, page)`` and the previous version is kept around, so a user
+    paging through an older version keeps seeing a consistent ranking.
+    Page numbers come from button data anyone can forge, so they are capped at
+    ``max_page``, and refreshes and cursor walks run one at a time.
+    """
+
+    def __init__(self, page_size=LEADERBOARD_PAGE_SIZE, snapshot_size=LEADERBOARD_SNAPSHOT_SIZE,
+                 ttl=LEADERBOARD_SNAPSHOT_TTL, clock=time.monotonic, max_page=LEADERBOARD_MAX_PAGE):
+        if snapshot_size % page_size:
+            raise ValueError("snapshot_size must be a multiple of page_size")
+        self.page_size = page_size
+        self.snapshot_size = snapshot_size
+        self.ttl = ttl
+        self.max_page = max_page
+        self._clock = clock
+        self._lock = asyncio.Lock()  # Concurrent requests for uncached pages would each read Firestore
+        self.version = 0
+        self._snapshot_taken_at = None
+        self._snapshot_complete = False  # True when the snapshot holds every ranked user
+        self._pages = {}  # (version, page) -> LeaderboardPage
+        self._cursors = {}  # (version, page) -> snapshot of the last user ranked before that page
+
+    def invalidate(self) -> None:
+        """Forces the next request to take a fresh snapshot."""
+        self._snapshot_taken_at = None
+
+    async def get_page(self, db_client, page: int, version: int = None) -> LeaderboardPage:
+        """Returns a page, preferring the requested version while it is still cached.
+
+        While a snapshot-listener user cache is loaded, pages are ranked from it
+        directly; it is always current, so snapshots and cursors are not needed.
+        Pages past ``max_page`` are served as ``max_page``, without a next page.
+        """
+        page = min(max(page, 0), self.max_page)
+        return self._capped(await self._get_page(db_client, page, version))
+
+    async def _get_page(self, db_client, page, version):
+        user_cache = db.get_user_cache()
+        if user_cache is not None and user_cache.ready:
+            return self._page_from_ranking(user_cache.ranking, page)
+
+        if version is not None and (version, page) in self._pages:
+            return self._pages[(version, page)]
+
+        async with self._lock:
+            # Whoever held the lock may have just refreshed the snapshot or fetched this page
+            if self._is_stale():
+                await self._take_snapshot(db_client)
+
+            key = (self.version, page)
+            if key not in self._pages:
+                await self._fetch_with_cursors(db_client, page)
+            return self._pages[key]
+
+    def _capped(self, result) -> LeaderboardPage:
+        if result.page < self.max_page or not result.has_next:
+            return result
+        return LeaderboardPage(result.page, result.version, result.entries, result.start_rank, False)
+
+    def _page_from_ranking(self, ranking, page: int) -> LeaderboardPage:
+        end = (page + 1) * self.page_size
+        ranked = ranking.top(end + 1)  # One extra entry tells us whether a next page exists
+        start = page * self.page_size
+        return LeaderboardPage(page, self.version, ranked[start:end], start + 1, len(ranked) > end)
+
+    def _is_stale(self) -> bool:
+        return self._snapshot_taken_at is None or self._clock() - self._snapshot_taken_at >= self.ttl
+
+    async def _take_snapshot(self, db_client) -> None:
+        # One extra entry tells us whether anything ranks below the snapshot
+        entries, cursors = await _run_sync(db.get_leaderboard_page, db_client, self.snapshot_size + 1)
+        self._snapshot_complete = len(entries) <= self.snapshot_size
+        entries, cursors = entries[:self.snapshot_size], cursors[:self.snapshot_size]
+
+        self.version += 1
+        self._snapshot_taken_at = self._clock()
+        # Keep only the current and previous versions
+        self._pages = {key: value for key, value in self._pages.items() if key[0] >= self.version - 1}
+        self._cursors = {key: value for key, value in self._cursors.items() if key[0] >= self.version - 1}
+
+        page_count = max(1, -(-len(entries) // self.page_size))
+        for page in range(page_count):
+            start = page * self.page_size
+            page_entries = entries[start:start + self.page_size]
+            has_next = start + self.page_size < len(entries) or not self._snapshot_complete
+            self._pages[(self.version, page)] = LeaderboardPage(page, self.version, page_entries, start + 1, has_next)
+        if not self._snapshot_complete and cursors:
+            self._cursors[(self.version, page_count)] = cursors[-1]
+        logger.info("Leaderboard snapshot taken", version=self.version, entries=len(entries))
+
+    async def _fetch_with_cursors(self, db_client, page: int) -> None:
+        """Fetches pages beyond the snapshot, walking forward from the nearest cached cursor."""
+        known = [p for (v, p) in self._cursors if v == self.version and p <= page]
+        if not known:
+            # Past the end of a complete snapshot
+            self._pages[(self.version, page)] = LeaderboardPage(page, self.version, [], page * self.page_size + 1, False)
+            return
+
+        current = max(known)
+        while current <= page:
+            cached = self._pages.get((self.version, current))
+            if cached is not None:
+                if not cached.has_next:
+                    break
+                current += 1
+                continue
+            cursor = self._cursors[(self.version, current)]
+            entries, cursors = await _run_sync(db.get_leaderboard_page, db_client, self.page_size + 1, cursor)
+            has_next = len(entries) > self.page_size
+            entries, cursors = entries[:self.page_size], cursors[:self.page_size]
+            self._pages[(self.version, current)] = LeaderboardPage(
+                current, self.version, entries, current * self.page_size + 1, has_next
+            )
+            if not has_next:
+                break
+            self._cursors[(self.version, current + 1)] = cursors[-1]
+            current += 1
+
+        if (self.version, page) not in self._pages:
+            self._pages[(self.version, page)] = LeaderboardPage(page, self.version, [], page * self.page_size + 1, False)
+
+
+class RankIndex:
+    """Scores for a set of users, queried for the top N."""
+
+    def __init__(self):
+        self._scores = {}  # user_id -> (score, username)
+
+    def __len__(self):
+        return len(self._scores)
+
+    def __contains__(self, user_id):
+        return user_id in self._scores
+
+    def set(self, user_id, username, score) -> None:
+        self._scores[user_id] = (score, username)
+
+    def add(self, user_id, username, delta) -> None:
+        """Adds to a user's score. A missing username keeps the one already known."""
+        score, known_username = self._scores.get(user_id, (0, None))
+        self._scores[user_id] = (score + delta, username or known_username or 'Unknown')
+
+    def items(self):
+        """Yields ``(user_id, username, score)`` for every user in the index."""
+        for user_id, (score, username) in self._scores.items():
+            yield user_id, username, score
+
+    def discard(self, user_id) -> None:
+        self._scores.pop(user_id, None)
+
+    def score(self, user_id, default=0):
+        entry = self._scores.get(user_id)
+        return entry[0] if entry else default
+
+    def top(self, n):
+        """Returns up to ``n`` ``(username, score)`` tuples, highest score first."""
+        best = heapq.nlargest(n, self._scores.items(), key=lambda item: item[1][0])
+        return [(username, score) for _, (score, username) in best]
+
+
+class _ChatSeed:
+    """A chat's seeding read in flight, and the writes that landed while it ran."""
+
+    def __init__(self):
+        self.task = None
+        self.writes = RankIndex()
+        self.stale = False  # A delta arrived whose base the read may or may not include
+
+
+class ChatLeaderboards:
+    """Per-chat top-N leaderboards maintained from the XP write path.
+
+    A chat's index is seeded from its top members in Firestore the first time
+    it is queried. Concurrent first queries share one read, and a failed read
+    is retried by the next query. From then on every XP write in the chat
+    reports the member's exact new total, so anyone outside the seeded set can
+    only enter the top N through a write the index sees.
+
+    Ledger writes only report a delta. A member outside the seed gets it added
+    in place on an unread base, which is at most the lowest seeded total (zero
+    when the whole chat fit in the seed). The chat is only re-seeded once such
+    a member could reach the top N being asked for.
+    """
+
+    def __init__(self, seed_size=CHAT_LEADERBOARD_SEED_SIZE):
+        self.seed_size = seed_size
+        self._indexes = {}  # chat_id -> RankIndex
+        self._floors = {}  # chat_id -> most XP a member left out of the seed can have had
+        self._estimated = {}  # chat_id -> ids of members whose score sits on an unread base
+        self._seeding = {}  # chat_id -> _ChatSeed
+
+    def record(self, chat_id, user_id, username, chat_xp) -> None:
+        """Applies a member's new per-chat total returned by ``database.add_xp``."""
+        seed = self._seeding.get(chat_id)
+        if seed is not None:
+            seed.writes.set(user_id, username, chat_xp)
+        index = self._indexes.get(chat_id)
+        if index is not None:
+            index.set(user_id, username, chat_xp)
+            self._estimated[chat_id].discard(user_id)
+
+    def record_delta(self, chat_id, user_id, username, delta) -> None:
+        """Applies a per-chat change appended to the XP ledger, whose new total is not known."""
+        seed = self._seeding.get(chat_id)
+        if seed is not None:
+            if user_id in seed.writes:
+                seed.writes.add(user_id, username, delta)
+            else:
+                seed.stale = True
+        index = self._indexes.get(chat_id)
+        if index is None:
+            return
+        if user_id not in index and self._floors[chat_id]:
+            self._estimated[chat_id].add(user_id)
+        index.add(user_id, username, delta)
+
+    async def top(self, db_client, chat_id, n):
+        """Returns the chat's top ``n`` members, seeding the index when needed, or None if that read failed."""
+        index = self._indexes.get(chat_id)
+        if index is None or self._may_be_misranked(chat_id, n):
+            seeded = await self._seed(db_client, chat_id)
+            if seeded is None:
+                return None
+            index = seeded
+        return index.top(n)
+
+    def _may_be_misranked(self, chat_id, n) -> bool:
+        """Whether a member with an unread base could belong in the top ``n``."""
+        estimated = self._estimated[chat_id]
+        if not estimated:
+            return False
+        index, floor = self._indexes[chat_id], self._floors[chat_id]
+        entries = index.top(n)
+        if len(entries) < n:
+            return True
+        cutoff = entries[-1][1]
+        return any(index.score(user_id) + floor >= cutoff for user_id in estimated)
+
+    async def _seed(self, db_client, chat_id):
+        seed = self._seeding.get(chat_id)
+        if seed is None:
+            seed = self._seeding[chat_id] = _ChatSeed()
+            seed.task = asyncio.ensure_future(self._read_seed(db_client, chat_id, seed))
+        # Shielded, so one caller giving up does not cancel the read for the others
+        return await asyncio.shield(seed.task)
+
+    async def _read_seed(self, db_client, chat_id, seed):
+        try:
+            members = await _run_sync(db.get_chat_leaderboard, db_client, chat_id, self.seed_size)
+        finally:
+            del self._seeding[chat_id]
+        if members is None:
+            return None
+        index = seed.writes
+        for user_id, username, xp in members:
+            if user_id not in index:
+                index.set(user_id, username, xp)
+        # A stale read still answers the queries waiting on it; the next query reads again
+        if not seed.stale:
+            self._indexes[chat_id] = index
+            self._floors[chat_id] = members[-1][2] if len(members) >= self.seed_size else 0
+            self._estimated[chat_id] = set()
+        return index
+
+
+def _utc_today():
+    return datetime.now(timezone.utc).date()
+
+
+class WindowedLeaderboard:
+    """Rolling-window leaderboards built from per-user daily XP buckets.
+
+    ``record`` is registered as a ``database`` XP listener. Each change is added
+    to a buffer of pending deltas, which ``flush`` writes to Firestore in one
+    batch, and to the in-memory buckets. Buckets are seeded from Firestore on
+    the first query. Seeding and flushing hold the same lock, so every delta is
+    counted exactly once: either it is already in Firestore or it is still pending.
+    """
+
+    def __init__(self, max_days=max(LEADERBOARD_WINDOWS.values()), today=_utc_today):
+        self.max_days = max_days
+        self._today = today
+        self._days = {}  # 'YYYY-MM-DD' -> RankIndex
+        self._pending = {}  # ('YYYY-MM-DD', user_id) -> [delta, username]
+        self._seeded = False
+        self._lock = asyncio.Lock()
+
+    def record(self, user_id, username, delta) -> None:
+        """Records an XP change against today's bucket."""
+        day = self._today().isoformat()
+        pending = self._pending.get((day, user_id))
+        if pending is None:
+            self._pending[(day, user_id)] = [delta, username]
+        else:
+            pending[0] += delta
+            pending[1] = username or pending[1]
+        if self._seeded:
+            self._bucket(day).add(user_id, username, delta)
+
+    async def flush(self, db_client) -> None:
+        """Writes pending deltas to the daily buckets in Firestore."""
+        async with self._lock:
+            if not self._pending:
+                return
+            items = [(key, (delta, username)) for key, (delta, username) in self._pending.items()]
+            self._pending = {}
+            committed = await _run_sync(db.flush_daily_xp, db_client, items)
+            # Re-queue whatever was not written, merging with deltas recorded meanwhile
+            for key, (delta, username) in items[committed:]:
+                pending = self._pending.setdefault(key, [0, username])
+                pending[0] += delta
+            if committed < len(items):
+                logger.warning("Daily XP flush incomplete", committed=committed, requeued=len(items) - committed)
+
+    async def top(self, db_client, n, days):
+        """Returns the top ``n`` ``(username, xp)`` over the last ``days`` days, including today.
+
+        Returns None if the buckets could not be seeded; the next query tries again.
+        """
+        if not self._seeded and not await self._seed(db_client):
+            return None
+        window = self._window(days)
+        self._prune()
+
+        totals = RankIndex()
+        for day in window:
+            bucket = self._days.get(day)
+            if bucket is not None:
+                for user_id, username, xp in bucket.items():
+                    totals.add(user_id, username, xp)
+        return totals.top(n)
+
+    async def _seed(self, db_client) -> bool:
+        """Loads the buckets in the window. Returns False, leaving them unseeded, if a read failed."""
+        async with self._lock:
+            if self._seeded:
+                return True
+            days = {}
+            for day in self._window(self.max_days):
+                members = await _run_sync(db.get_daily_xp, db_client, day)
+                if members is None:
+                    return False
+                bucket = days[day] = RankIndex()
+                for user_id, username, xp in members:
+                    bucket.set(user_id, username, xp)
+            self._days = days
+            # Nothing was flushed while seeding, so pending deltas are not in Firestore yet
+            for (day, user_id), (delta, username) in self._pending.items():
+                self._bucket(day).add(user_id, username, delta)
+            self._seeded = True
+            logger.info("Windowed leaderboard seeded", days=self.max_days)
+            return True
+
+    def _bucket(self, day) -> RankIndex:
+        bucket = self._days.get(day)
+        if bucket is None:
+            bucket = self._days[day] = RankIndex()
+        return bucket
+
+    def _window(self, days):
+        today = self._today()
+        return [(today - timedelta(days=offset)).isoformat() for offset in range(days)]
+
+    def _prune(self) -> None:
+        oldest = (self._today() - timedelta(days=self.max_days - 1)).isoformat()
+        for day in [day for day in self._days if day < oldest]:
+            del self._days[day]
+
+
+async def _run_sync(func, *args):
+    """Runs a blocking database call in the default thread pool executor, within the current trace."""
+    return await asyncio.to_thread(func, *args)
+
+
+def get_pager(bot_data) -> LeaderboardPager:
+    """Returns the application's leaderboard pager, creating it on first use."""
+    pager = bot_data.get('leaderboard_pager')
+    if pager is None:
+        pager = bot_data['leaderboard_pager'] = LeaderboardPager()
+    return pager
+
+
+def get_chat_leaderboards(bot_data) -> ChatLeaderboards:
+    """Returns the application's per-chat leaderboards, creating them on first use."""
+    chat_leaderboards = bot_data.get('chat_leaderboards')
+    if chat_leaderboards is None:
+        chat_leaderboards = bot_data['chat_leaderboards'] = ChatLeaderboards()
+    return chat_leaderboards
+
+
+def get_windowed_leaderboard(bot_data) -> WindowedLeaderboard:
+    """Returns the application's windowed leaderboard, creating it on first use."""
+    windowed = bot_data.get('windowed_leaderboard')
+    if windowed is None:
+        windowed = bot_data['windowed_leaderboard'] = WindowedLeaderboard()
+    return windowed
+
+
+async def flush_daily_xp_job(context) -> None:
+    """Job queue callback that writes buffered daily XP buckets."""
+    await get_windowed_leaderboard(context.bot_data).flush(context.bot_data['db'])
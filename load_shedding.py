@@ -0,0 +1,159 @@
+"""Graceful degradation of passive XP when the bot falls behind.
+
+``LagMonitor`` tracks two signals: update lag, the delay between a message's
+``date`` and the moment it is handled, and event loop lag, how late a
+periodic timer wakes up. Each is smoothed and compared with its threshold;
+the worse ratio sets the shedding level:
+
+* ``NORMAL``: every message's XP is written as usual.
+* ``COALESCE``: per-message XP is summed in memory by ``XpCoalescer`` and
+  written once per user and chat every ``XP_COALESCE_FLUSH_INTERVAL``.
+* ``DROP``: per-message XP is not awarded at all.
+
+Only passive XP is shed; games and commands are always handled. The level
+drops back once both signals fall below ``RECOVERY_RATIO`` of their
+thresholds, so it does not flap around a threshold.
+"""
+import asyncio
+import time
+
+import structlog
+
+import database as db
+import leaderboards
+
+logger = structlog.get_logger(__name__)
+
+NORMAL = 'normal'
+COALESCE = 'coalesce'
+DROP = 'drop'
+SHED_LEVELS = (NORMAL, COALESCE, DROP)
+
+UPDATE_LAG_THRESHOLD = 5.0  # seconds behind Telegram before XP is coalesced
+LOOP_LAG_THRESHOLD = 0.25  # seconds of event loop lag before XP is coalesced
+DROP_RATIO = 4.0  # XP is dropped at this multiple of a threshold
+RECOVERY_RATIO = 0.5  # Shedding stops below this fraction of both thresholds
+LAG_SMOOTHING = 0.2  # Weight of each new sample in the moving averages
+LOOP_LAG_INTERVAL = 0.5  # seconds between event loop lag probes
+UPDATE_LAG_IDLE_RESET = 10  # seconds without messages after which update lag counts as caught up
+XP_COALESCE_FLUSH_INTERVAL = 5  # seconds between writes of coalesced XP
+
+
+class LagMonitor:
+    """Smoothed update and event loop lag, and the shedding level they imply."""
+
+    def __init__(self, update_lag_threshold=UPDATE_LAG_THRESHOLD, loop_lag_threshold=LOOP_LAG_THRESHOLD,
+                 clock=time.time):
+        self.update_lag_threshold = update_lag_threshold
+        self.loop_lag_threshold = loop_lag_threshold
+        self._clock = clock
+        self.update_lag = 0.0
+        self.loop_lag = 0.0
+        self.level = NORMAL
+        self._last_update_at = None
+        self._task = None
+
+    def record_update(self, sent_at) -> None:
+        """Records a message sent at ``sent_at`` (an aware datetime) being handled now."""
+        now = self._clock()
+        self._last_update_at = now
+        self.update_lag = _smooth(self.update_lag, max(0.0, now - sent_at.timestamp()))
+        self._reassess()
+
+    def record_loop_lag(self, lag) -> None:
+        self.loop_lag = _smooth(self.loop_lag, max(0.0, lag))
+        if self._last_update_at is not None and self._clock() - self._last_update_at >= UPDATE_LAG_IDLE_RESET:
+            self.update_lag = 0.0  # Nothing is arriving, so nothing is queued behind
+        self._reassess()
+
+    def pressure(self) -> float:
+        """How far past its threshold the worse signal is; 1.0 means at the threshold."""
+        return max(self.update_lag / self.update_lag_threshold, self.loop_lag / self.loop_lag_threshold)
+
+    def _reassess(self) -> None:
+        pressure = self.pressure()
+        if pressure >= DROP_RATIO:
+            level = DROP
+        elif pressure >= 1:
+            level = COALESCE
+        elif pressure < RECOVERY_RATIO:
+            level = NORMAL
+        else:
+            level = min(self.level, COALESCE, key=SHED_LEVELS.index)
+        if level != self.level:
+            logger.warning("Passive XP shedding level changed", level=level, previous=self.level,
+                           update_lag=round(self.update_lag, 3), loop_lag=round(self.loop_lag, 3))
+            self.level = level
+
+    def start(self) -> None:
+        """Starts probing event loop lag on the running loop."""
+        self._task = asyncio.get_running_loop().create_task(self._probe_loop_lag())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _probe_loop_lag(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            self.record_loop_lag(time.perf_counter() - started - LOOP_LAG_INTERVAL)
+
+
+def _smooth(average, sample):
+    return average + LAG_SMOOTHING * (sample - average)
+
+
+class XpCoalescer:
+    """Per-message XP summed per user and chat, written in one go."""
+
+    def __init__(self):
+        self._pending = {}  # (user_id, chat_id) -> [delta, username]
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, user_id, username, delta, chat_id=None) -> None:
+        entry = self._pending.setdefault((user_id, chat_id), [0, username])
+        entry[0] += delta
+        entry[1] = username or entry[1]
+
+    async def flush(self, bot_data) -> int:
+        """Writes the summed XP, through the ledger when it is enabled. Returns the entries written."""
+        pending, self._pending = self._pending, {}
+        db_client = bot_data['db']
+        chat_leaderboards = leaderboards.get_chat_leaderboards(bot_data)
+        for (user_id, chat_id), (delta, username) in pending.items():
+            if db.append_xp(user_id, username, delta, 'message', chat_id=chat_id):
+                if chat_id is not None:
+                    chat_leaderboards.record_delta(chat_id, user_id, username, delta)
+                continue
+            result = await db.add_xp(db_client, user_id, username, delta, chat_id=chat_id, reason='message')
+            if result and chat_id is not None:
+                chat_leaderboards.record(chat_id, user_id, username, result['chat_xp'])
+        return len(pending)
+
+
+def get_lag_monitor(bot_data) -> LagMonitor:
+    """Returns the application's lag monitor, creating it on first use."""
+    monitor = bot_data.get('lag_monitor')
+    if monitor is None:
+        monitor = bot_data['lag_monitor'] = LagMonitor()
+    return monitor
+
+
+def get_xp_coalescer(bot_data) -> XpCoalescer:
+    """Returns the application's XP coalescer, creating it on first use."""
+    coalescer = bot_data.get('xp_coalescer')
+    if coalescer is None:
+        coalescer = bot_data['xp_coalescer'] = XpCoalescer()
+    return coalescer
+
+
+async def flush_coalesced_xp_job(context) -> None:
+    """Job queue callback that writes XP coalesced while shedding."""
+    coalescer = get_xp_coalescer(context.bot_data)
+    if len(coalescer):
+        await coalescer.flush(context.bot_data)
@@ -1,22 +1,148 @@
+"""Structured logging setup.
+
+Log calls only filter, sample and stamp the event on the calling thread
+(and format the traceback of a logged exception, which is only reachable
+there); the event dict is handed to a ``QueueHandler`` and rendered to JSON
+and written by a ``QueueListener`` thread, so busy handlers do not pay for
+rendering or for a blocking write. orjson renders when it is installed.
+
+Chatty events are sampled by ``LOG_SAMPLE_RATES`` (event -> fraction kept),
+which ``LOG_SAMPLING="event=rate;..."`` extends. The level comes from
+``LOG_LEVEL`` and can be changed at runtime with ``set_log_level``, or by
+sending the process SIGUSR1 (more verbose) or SIGUSR2 (less verbose).
+"""
+import atexit
 import logging
+import logging.handlers
+import os
+import queue
+import random
+import signal
+import threading
+
 import structlog
 
+try:
+    import orjson
+except ImportError:  # Fall back to the standard library renderer
+    orjson = None
+
+# Fraction of each event that is logged; events not listed are always logged
+LOG_SAMPLE_RATES = {
+    "handle_message: Awarding XP": 0.01,
+}
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+
+_listener = None
+
+
+def _orjson_dumps(event_dict, **kwargs):
+    return orjson.dumps(event_dict, default=str).decode()
+
+
+class EventSampler:
+    """structlog processor that keeps only a fraction of the events listed in ``rates``."""
+
+    def __init__(self, rates, random_source=random.random):
+        self.rates = dict(rates)
+        self._random = random_source
+
+    def __call__(self, logger, method_name, event_dict):
+        rate = self.rates.get(event_dict.get('event'))
+        if rate is not None and self._random() >= rate:
+            raise structlog.DropEvent
+        return event_dict
+
+
+def parse_sample_rates(spec):
+    """Parses ``"event=rate;event=rate"`` into a dict; malformed entries are ignored."""
+    rates = {}
+    for entry in (spec or '').split(';'):
+        event, _, rate = entry.rpartition('=')
+        try:
+            rates[event.strip()] = float(rate)
+        except ValueError:
+            continue
+    rates.pop('', None)
+    return rates
+
+
+class _EventQueueHandler(logging.handlers.QueueHandler):
+    """Queues records untouched so the listener's ``ProcessorFormatter`` can render the event dict."""
+
+    def prepare(self, record):
+        return record
+
+
+def set_log_level(level) -> None:
+    """Changes the level of every logger that does not set its own."""
+    logging.getLogger().setLevel(level)
+    structlog.get_logger(__name__).warning("Log level changed", new_level=logging.getLevelName(logging.getLogger().level))
+
+
+def _shift_log_level(step) -> None:
+    current = logging.getLevelName(logging.getLogger().level)
+    index = LOG_LEVELS.index(current) if current in LOG_LEVELS else LOG_LEVELS.index('INFO')
+    set_log_level(LOG_LEVELS[min(max(index + step, 0), len(LOG_LEVELS) - 1)])
+
+
+def _stop_listener() -> None:
+    """Writes out queued records and stops the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(_stop_listener)
+
+
 def setup_logging():
     """Set up structured logging."""
-    logging.basicConfig(level=logging.INFO, format="%(message)s")
-    
+    global _listener
+    renderer = structlog.processors.JSONRenderer(serializer=_orjson_dumps) if orjson else structlog.processors.JSONRenderer()
+    handler = logging.StreamHandler()
+    handler.setFormatter(structlog.stdlib.ProcessorFormatter(
+        processors=[
+            structlog.stdlib.ProcessorFormatter.remove_processors_meta,
+            structlog.processors.format_exc_info,
+            structlog.processors.UnicodeDecoder(),
+            renderer,
+        ],
+        foreign_pre_chain=[structlog.stdlib.add_log_level, structlog.processors.TimeStamper(fmt="iso")],
+    ))
+
+    root = logging.getLogger()
+    _stop_listener()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    log_queue = queue.SimpleQueue()
+    root.addHandler(_EventQueueHandler(log_queue))
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+
     structlog.configure(
         processors=[
+            # Drops disabled levels before any other work is done
+            structlog.stdlib.filter_by_level,
+            EventSampler({**LOG_SAMPLE_RATES, **parse_sample_rates(os.getenv('LOG_SAMPLING'))}),
+            # Adds values bound per update by tracing, e.g. update_id and chat_id
+            structlog.contextvars.merge_contextvars,
             structlog.stdlib.add_log_level,
             structlog.stdlib.PositionalArgumentsFormatter(),
             structlog.processors.TimeStamper(fmt="iso"),
             structlog.processors.StackInfoRenderer(),
+            # exc_info=True means "the exception being handled", which only the calling thread can see
             structlog.processors.format_exc_info,
-            structlog.processors.UnicodeDecoder(),
-            structlog.processors.JSONRenderer()
+            structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
         ],
         context_class=dict,
         logger_factory=structlog.stdlib.LoggerFactory(),
         wrapper_class=structlog.stdlib.BoundLogger,
         cache_logger_on_first_use=True,
     )
+
+    if hasattr(signal, 'SIGUSR1') and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, lambda signum, frame: _shift_log_level(-1))
+        signal.signal(signal.SIGUSR2, lambda signum, frame: _shift_log_level(1))
@@ -0,0 +1,329 @@
+"""Process metrics in the Prometheus text format.
+
+Handlers, database calls and Telegram requests record into the metrics
+defined here; ``MetricsServer`` serves ``REGISTRY.render()`` on
+``/metrics`` for a scraper. The server runs on the event loop, so gauges
+computed at scrape time read bot state from the thread that owns it.
+Database calls record from executor threads, so each metric takes a lock.
+
+Enable the server with ``METRICS_PORT``. Sharded workers listen on
+``METRICS_PORT + worker index``.
+"""
+import asyncio
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+import structlog
+from telegram.request import HTTPXRequest
+
+import firestore_costs
+import tracing
+
+logger = structlog.get_logger(__name__)
+
+METRICS_PATH = '/metrics'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {labels}")
+        return tuple(labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """A value that only goes up, per label combination."""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+
+    def inc(self, *labels, amount=1) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(_Metric):
+    """A value computed when metrics are rendered.
+
+    ``function`` returns ``{label values tuple: value}``; a gauge without one
+    renders no samples.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def _samples(self):
+        if self.function is None:
+            return []
+        try:
+            values = self.function()
+        except Exception as e:
+            logger.error("Gauge function failed", metric=self.name, error=e)
+            return []
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, per label combination."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, *labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """Observes the duration of the ``with`` block, including across awaits."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def count(self, *labels):
+        series = self._series.get(self._key(labels))
+        return sum(series[:-1]) if series else 0
+
+    def _samples(self):
+        with self._lock:
+            series = [(key, list(values)) for key, values in self._series.items()]
+        lines = []
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values[:-1]):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(values[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """The metrics rendered together on ``/metrics``."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+HANDLER_LATENCY = REGISTRY.register(Histogram(
+    'yunks_handler_duration_seconds', 'Time spent handling an update, by handler.', ['handler']))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    'yunks_handler_errors_total', 'Updates whose handler raised, by handler.', ['handler']))
+DB_LATENCY = REGISTRY.register(Histogram(
+    'yunks_db_operation_duration_seconds', 'Time spent in a database operation.', ['operation']))
+DB_ERRORS = REGISTRY.register(Counter(
+    'yunks_db_operation_errors_total', 'Database operations that raised.', ['operation']))
+DB_RETRIES = REGISTRY.register(Counter(
+    'yunks_db_transaction_retries_total', 'Firestore transaction attempts beyond the first.', ['operation']))
+TELEGRAM_REQUESTS = REGISTRY.register(Counter(
+    'yunks_telegram_requests_total', 'Bot API requests, by method and outcome.', ['method', 'outcome']))
+TELEGRAM_LATENCY = REGISTRY.register(Histogram(
+    'yunks_telegram_request_duration_seconds', 'Bot API request latency, by method.', ['method']))
+GAMES = REGISTRY.register(Gauge(
+    'yunks_active_games', 'Games currently registered, by kind and state.', ['kind', 'state']))
+LAG = REGISTRY.register(Gauge(
+    'yunks_lag_seconds', 'Smoothed update lag behind Telegram and event loop lag.', ['kind']))
+SHED_LEVEL = REGISTRY.register(Gauge(
+    'yunks_passive_xp_shed_level', 'Current passive XP shedding level (1 for the active one).', ['level']))
+UPDATES_WAITING = REGISTRY.register(Gauge(
+    'yunks_updates_waiting', 'Updates waiting for a processing slot, by scheduling class.', ['update_class']))
+UPDATE_WAIT = REGISTRY.register(Histogram(
+    'yunks_update_wait_seconds', 'Time updates waited for a processing slot, by scheduling class.', ['update_class']))
+PASSIVE_XP_SHED = REGISTRY.register(Counter(
+    'yunks_passive_xp_shed_total', 'Per-message XP awards coalesced or dropped while behind.', ['action']))
+DB_DOCUMENTS = REGISTRY.register(Counter(
+    'yunks_firestore_documents_total', 'Firestore documents read, written and deleted, by originating handler.',
+    ['origin', 'kind']))
+
+
+@contextmanager
+def track_handler(name):
+    """Times a handler and counts it as failed if it raises.
+
+    The handler is also spanned in its trace, and its Firestore usage is charged to ``name``.
+    """
+    try:
+        with HANDLER_LATENCY.time(name), tracing.handler_span(name), firestore_costs.attributed_to(name):
+            yield
+    except Exception:
+        HANDLER_ERRORS.inc(name)
+        raise
+
+
+def timed_handler(name, handler):
+    """Wraps a PTB callback so its latency is recorded under ``name``."""
+    async def wrapped(update, context):
+        with track_handler(name):
+            return await handler(update, context)
+    wrapped.__name__ = getattr(handler, '__name__', name)
+    wrapped.__doc__ = handler.__doc__
+    return wrapped
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """``HTTPXRequest`` that counts and times every Bot API call by method."""
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        outcome = 'error'
+        try:
+            with TELEGRAM_LATENCY.time(api_method), tracing.span(f"telegram.{api_method}"):
+                code, payload = await super().do_request(
+                    url, method, request_data=request_data, read_timeout=read_timeout,
+                    write_timeout=write_timeout, connect_timeout=connect_timeout, pool_timeout=pool_timeout,
+                )
+            outcome = str(code)
+            return code, payload
+        finally:
+            TELEGRAM_REQUESTS.inc(api_method, outcome)
+
+
+# Where each lobby game keeps its state in chat_data; other games have no states
+GAME_STATE_KEYS = {'lastman': 'lastman_game', 'lmw': 'lmw_game'}
+
+
+def count_games(application):
+    """Counts registered games by ``(kind, state)``, reading lobby game state from chat_data."""
+    from game_logic.registry import get_registry
+
+    counts = {}
+    for chat_id, kind, _ in get_registry(application.bot_data).games():
+        state = 'active'
+        state_key = GAME_STATE_KEYS.get(kind)
+        if state_key is not None:
+            game_data = application.chat_data.get(chat_id, {}).get(state_key)
+            state = game_data.get('status', 'unknown') if game_data else 'unknown'
+        counts[(kind, state)] = counts.get((kind, state), 0) + 1
+    return counts
+
+
+def track_games(application) -> None:
+    """Reports ``application``'s games in the ``yunks_active_games`` gauge."""
+    GAMES.function = lambda: count_games(application)
+
+
+def track_lag(monitor) -> None:
+    """Reports a ``load_shedding.LagMonitor`` in the lag and shedding level gauges."""
+    from load_shedding import SHED_LEVELS
+
+    LAG.function = lambda: {('update',): monitor.update_lag, ('loop',): monitor.loop_lag}
+    SHED_LEVEL.function = lambda: {(level,): int(level == monitor.level) for level in SHED_LEVELS}
+
+
+def track_update_processor(processor) -> None:
+    """Reports a ``priority_updates.PriorityUpdateProcessor``'s queues and waits."""
+    UPDATES_WAITING.function = lambda: {(update_class,): depth for update_class, depth in processor.depths().items()}
+    processor.wait_observer = lambda update_class, waited: UPDATE_WAIT.observe(waited, update_class)
+
+
+def track_firestore_costs(tracker=firestore_costs.COSTS) -> None:
+    """Counts the documents recorded by a ``firestore_costs.CostTracker`` in ``yunks_firestore_documents_total``."""
+    tracker.observer = lambda origin, kind, documents: DB_DOCUMENTS.inc(origin, kind, amount=documents)
+
+
+class MetricsServer:
+    """Minimal HTTP server on the event loop answering ``GET /metrics``."""
+
+    def __init__(self, port, host='127.0.0.1', registry=REGISTRY):
+        self.port = port
+        self.host = host
+        self.registry = registry
+        self._server = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info("Metrics server started", host=self.host, port=self.port)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer) -> None:
+        try:
+            request_line = await reader.readline()
+            # Headers are not needed, but must be read before answering
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?', 1)[0] == METRICS_PATH:
+                status, content_type, body = '200 OK', CONTENT_TYPE, self.registry.render().encode('utf-8')
+            else:
+                status, content_type, body = '404 Not Found', 'text/plain', b'Not found\n'
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
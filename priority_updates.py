@@ -0,0 +1,163 @@
+"""Priority-aware update scheduling.
+
+PTB hands every update to one FIFO, so a burst of ordinary chatter delays a
+Last Message Wins deadline or an admin's /endgame by however long the
+chatter takes. ``PriorityUpdateProcessor`` classifies each update and, when
+updates are waiting, hands free slots out per class by smooth weighted
+round robin (``UPDATE_CLASS_WEIGHTS``):
+
+* ``callback``: inline button presses
+* ``command``: new command messages, and updates that are not messages
+* ``game``: messages, edits included, routed to a running game
+* ``passive``: every other message, edits and non-text messages included
+
+Higher classes get most slots, but every class with waiting updates gets
+its weighted share, so passive XP is delayed under load, never starved.
+Updates of one class run in arrival order, and two updates from the same
+chat never run at the same time, so per-chat handling stays sequential as
+with PTB's default processor.
+"""
+import asyncio
+import time
+from collections import deque
+
+import structlog
+from telegram.ext import BaseUpdateProcessor
+
+from game_logic.registry import ActiveGameRegistry
+
+logger = structlog.get_logger(__name__)
+
+CALLBACK = 'callback'
+COMMAND = 'command'
+GAME = 'game'
+PASSIVE = 'passive'
+UPDATE_CLASSES = (CALLBACK, COMMAND, GAME, PASSIVE)  # Highest first; ties go to the earlier class
+UPDATE_CLASS_WEIGHTS = {CALLBACK: 8, COMMAND: 8, GAME: 4, PASSIVE: 1}
+UPDATE_CONCURRENCY = 1  # Updates handled at once; more than one runs different chats concurrently
+PRIORITY_WINDOW = 256  # Updates admitted for reordering; later ones wait in PTB's FIFO
+
+
+def classify_update(update, registry) -> str:
+    """Returns the scheduling class of ``update``."""
+    if getattr(update, 'callback_query', None) is not None:
+        return CALLBACK
+    message = getattr(update, 'effective_message', None)
+    if message is None:
+        return COMMAND  # Membership changes, polls and the like
+    # Only a new message runs a command; an edit of one is no more urgent than chatter
+    if message is getattr(update, 'message', None) and message.text and message.text.startswith('/'):
+        return COMMAND
+    chat, user = update.effective_chat, update.effective_user
+    if chat is not None and user is not None and registry.route(chat.id, user.id) is not None:
+        return GAME
+    return PASSIVE
+
+
+class _Waiter:
+    __slots__ = ('future', 'chat_id', 'enqueued_at')
+
+    def __init__(self, future, chat_id):
+        self.future = future
+        self.chat_id = chat_id
+        self.enqueued_at = time.perf_counter()
+
+
+class PriorityUpdateProcessor(BaseUpdateProcessor):
+    """Update processor that serves waiting updates by class weight, one update per chat at a time.
+
+    ``registry`` must be set to the application's game registry, which tells
+    game messages apart from passive ones.
+    """
+
+    def __init__(self, concurrency=UPDATE_CONCURRENCY, weights=None, window=PRIORITY_WINDOW):
+        # PTB only hands updates over concurrently when this is above 1; the real limit is ``concurrency``
+        super().__init__(max_concurrent_updates=max(window, concurrency, 2))
+        self.concurrency = concurrency
+        self.weights = dict(weights or UPDATE_CLASS_WEIGHTS)
+        self.registry = ActiveGameRegistry()
+        self.handled = dict.fromkeys(UPDATE_CLASSES, 0)
+        self.wait_observer = None  # Called with (update_class, seconds waited) for every update
+        self._waiting = {update_class: deque() for update_class in UPDATE_CLASSES}
+        self._credit = dict.fromkeys(UPDATE_CLASSES, 0)
+        self._running = 0
+        self._busy_chats = set()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def depths(self):
+        """Returns how many updates of each class are waiting for a slot."""
+        return {update_class: len(waiting) for update_class, waiting in self._waiting.items()}
+
+    async def do_process_update(self, update, coroutine) -> None:
+        update_class = classify_update(update, self.registry)
+        chat = getattr(update, 'effective_chat', None)
+        chat_id = chat.id if chat is not None else None
+        waited = await self._acquire(update_class, chat_id)
+        self.handled[update_class] += 1
+        if self.wait_observer is not None:
+            self.wait_observer(update_class, waited)
+        try:
+            await coroutine
+        finally:
+            self._release(chat_id)
+
+    async def _acquire(self, update_class, chat_id) -> float:
+        """Waits for a slot. Returns the seconds spent waiting."""
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), chat_id)
+        self._waiting[update_class].append(waiter)
+        self._grant()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.cancelled():
+                self._waiting[update_class].remove(waiter)
+            else:
+                self._release(chat_id)  # The slot was granted just before the cancellation
+            raise
+        return time.perf_counter() - waiter.enqueued_at
+
+    def _start(self, chat_id) -> None:
+        self._running += 1
+        if chat_id is not None:
+            self._busy_chats.add(chat_id)
+
+    def _release(self, chat_id) -> None:
+        self._running -= 1
+        self._busy_chats.discard(chat_id)
+        self._grant()
+
+    def _grant(self) -> None:
+        while self._running < self.concurrency:
+            eligible = {}
+            for update_class, waiting in self._waiting.items():
+                index = self._first_free(waiting)
+                if index is not None:
+                    eligible[update_class] = index
+            if not eligible:
+                return
+            # Smooth weighted round robin over the classes that can run now
+            total = 0
+            for update_class in eligible:
+                self._credit[update_class] += self.weights[update_class]
+                total += self.weights[update_class]
+            chosen = max(eligible, key=lambda update_class: self._credit[update_class])
+            self._credit[chosen] -= total
+
+            waiting = self._waiting[chosen]
+            waiter = waiting[eligible[chosen]]
+            del waiting[eligible[chosen]]
+            self._start(waiter.chat_id)
+            waiter.future.set_result(None)
+
+    def _first_free(self, waiting):
+        for index, waiter in enumerate(waiting):
+            if waiter.future.done():
+                continue  # Cancelled, and about to remove itself
+            if waiter.chat_id is None or waiter.chat_id not in self._busy_chats:
+                return index
+        return None
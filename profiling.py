@@ -0,0 +1,169 @@
+"""On-demand, time-boxed profiling of the running bot.
+
+Handlers and the Bot API client run on the event loop thread, so that is the
+thread profiled. Two modes:
+
+* ``cprofile``: deterministic ``cProfile`` of the loop thread, written as a
+  ``.pstats`` file for ``python -m pstats`` or snakeviz. Every call is
+  instrumented, so handlers run noticeably slower while it is on.
+* ``sampling``: an interval timer records the loop thread's stack every
+  ``SAMPLE_INTERVAL`` and writes collapsed stacks (``frame;frame;frame count``)
+  for flamegraph.pl or speedscope. Its overhead stays low under real traffic,
+  but it needs the loop in the main thread, as under ``bot_main``.
+
+Only one session runs at a time and each is capped at
+``PROFILE_MAX_SECONDS``. Files go to ``PROFILE_DIR`` (the system temp
+directory by default). Sessions are started by ``/profilebot`` or by the
+admin dashboard API.
+"""
+import asyncio
+import cProfile
+import os
+import signal
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+CPROFILE = 'cprofile'
+SAMPLING = 'sampling'
+PROFILE_MODES = (CPROFILE, SAMPLING)
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 300  # Longest session; a forgotten profiler must not slow the bot for good
+SAMPLE_INTERVAL = 0.005  # seconds between stack samples in sampling mode
+
+
+class ProfilerError(RuntimeError):
+    """Raised when a session cannot run, e.g. because another one is still running."""
+
+
+def clamp_seconds(seconds) -> float:
+    """Limits a requested duration to between one second and ``PROFILE_MAX_SECONDS``."""
+    return min(max(float(seconds), 1.0), PROFILE_MAX_SECONDS)
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Samples the main thread's Python stack on an interval timer and counts collapsed stacks.
+
+    The ``SIGALRM`` handler runs in the main thread between bytecodes, so each
+    sample shows where the loop really is. A sampling thread would only get
+    the GIL where the loop releases it, and would see little besides select.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._previous_handler = None
+
+    def start(self) -> None:
+        if not hasattr(signal, 'setitimer') or threading.current_thread() is not threading.main_thread():
+            raise ProfilerError("Sampling needs the event loop in the main thread of a POSIX process; use cprofile")
+        self._previous_handler = signal.signal(signal.SIGALRM, self._on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+
+    def stop(self) -> None:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, self._previous_handler or signal.SIG_DFL)
+
+    def _on_alarm(self, signum, frame) -> None:
+        self.record(frame)
+
+    def record(self, frame) -> None:
+        labels = []
+        while frame is not None:
+            labels.append(_frame_label(frame.f_code))
+            frame = frame.f_back
+        if labels:
+            self.stacks[';'.join(reversed(labels))] += 1
+            self.samples += 1
+
+    def write_collapsed(self, path) -> None:
+        """Writes the stacks in the collapsed format read by flamegraph.pl and speedscope."""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class ProfileSession:
+    """A running or finished profiling session."""
+
+    def __init__(self, mode, seconds, path):
+        self.mode = mode
+        self.seconds = seconds
+        self.path = path
+        self.started_at = time.time()
+
+    def as_dict(self):
+        return {'mode': self.mode, 'seconds': self.seconds, 'path': self.path, 'started_at': self.started_at}
+
+
+class Profiler:
+    """Runs one time-boxed profiling session at a time on the event loop thread."""
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.getenv('PROFILE_DIR') or tempfile.gettempdir()
+        self.active = None
+        self.last = None
+
+    async def run(self, mode=SAMPLING, seconds=PROFILE_DEFAULT_SECONDS) -> ProfileSession:
+        """Profiles the event loop thread for ``seconds`` and returns the finished session."""
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profiling mode {mode!r}, expected one of {PROFILE_MODES}")
+        if self.active is not None:
+            raise ProfilerError(f"A {self.active.mode} session is already running")
+        seconds = clamp_seconds(seconds)
+        extension = 'pstats' if mode == CPROFILE else 'collapsed'
+        path = os.path.join(self.directory, f"yunks-{mode}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.{extension}")
+        session = self.active = ProfileSession(mode, seconds, path)
+        logger.warning("Profiling started", mode=mode, seconds=seconds, path=path)
+        try:
+            if mode == CPROFILE:
+                await self._run_cprofile(seconds, path)
+            else:
+                await self._run_sampling(seconds, path)
+        finally:
+            self.active = None
+        self.last = session
+        logger.warning("Profiling finished", mode=mode, seconds=seconds, path=path)
+        return session
+
+    async def _run_cprofile(self, seconds, path) -> None:
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+        await asyncio.to_thread(profile.dump_stats, path)
+
+    async def _run_sampling(self, seconds, path) -> None:
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            sampler.stop()
+        await asyncio.to_thread(sampler.write_collapsed, path)
+
+    def status(self):
+        return {
+            'active': self.active.as_dict() if self.active else None,
+            'last': self.last.as_dict() if self.last else None,
+        }
+
+
+def get_profiler(bot_data) -> Profiler:
+    """Returns the application's profiler, creating it on first use."""
+    profiler = bot_data.get('profiler')
+    if profiler is None:
+        profiler = bot_data['profiler'] = Profiler()
+    return profiler
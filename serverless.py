@@ -0,0 +1,364 @@
+"""Serverless entry point: one Telegram update per invocation.
+
+For scale-to-zero platforms, where an instance may be created for a single
+request and frozen as soon as it answers:
+
+* The Application and Firestore client are built on the first invocation and
+  reused while the instance stays warm. The cold start is measured and logged
+  against ``COLD_START_TARGET_SECONDS``; ``benchmarks/bench_cold_start.py``
+  measures it locally.
+* ``chat_data``, ``user_data`` and the chat's entries in the game registry are
+  loaded from Firestore before the update is handled and written back after.
+  A per-chat lease serializes invocations for the same chat across instances.
+* Game timers cannot wait in memory, so ``HandoffJobQueue`` stores them in
+  Firestore. Due timers are fired by whichever invocation comes next; a
+  platform scheduler should call ``/tick`` so timers also fire in quiet chats.
+  A claimed timer is hidden from other invocations for ``TIMER_CLAIM_TTL``
+  and deleted only once it has run with its chat's state saved; if the
+  invocation fails first, the timer runs again when the claim expires.
+  Repeating timers are stored again for their next run when they fire.
+* Once the update has been handled and its state saved, failures in the
+  timers and flushes that follow are logged and the webhook still answers
+  200, so Telegram never redelivers an update that was already applied.
+
+Serve with ``uvicorn serverless:app``. Telegram must be set up with
+``WEBHOOK_SECRET`` as the webhook's secret token, and ``/tick`` expects the
+same secret.
+"""
+import asyncio
+import hmac
+import importlib
+import os
+import pickle
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+
+import structlog
+from fastapi import FastAPI, Request, Response
+
+import database as db
+import firestore_costs
+import leaderboards
+import load_shedding
+from game_logic.registry import get_registry
+
+logger = structlog.get_logger(__name__)
+
+COLD_START_TARGET_SECONDS = 2.0  # Budget for building the Application on a fresh instance
+LEASE_TTL = 30  # seconds a chat lease is held before others may take it over
+LEASE_WAIT = 10  # seconds to wait for a busy chat before failing the invocation
+LEASE_POLL_INTERVAL = 0.05
+DUE_TIMERS_PER_INVOCATION = 10
+TIMER_CLAIM_TTL = 60  # seconds a claimed timer is hidden before an unfinished one runs again
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+_application = None
+
+
+class LeaseTimeout(RuntimeError):
+    """Raised when a chat stays locked by another invocation for longer than ``LEASE_WAIT``."""
+
+
+class HandoffJob:
+    """Stand-in for ``telegram.ext.Job`` describing a timer stored in Firestore."""
+
+    def __init__(self, job_queue, name, callback=None, data=None, chat_id=None, user_id=None):
+        self._job_queue = job_queue
+        self.name = name
+        self.callback = callback
+        self.data = data
+        self.chat_id = chat_id
+        self.user_id = user_id
+
+    def schedule_removal(self) -> None:
+        self._job_queue.remove(self.name)
+
+
+class HandoffJobQueue:
+    """Job queue that stores one-off timers in Firestore instead of running them in-process.
+
+    Timers scheduled or removed while handling an update are written by
+    ``flush`` when the invocation finishes.
+    """
+
+    def __init__(self):
+        self.application = None
+        self._scheduled = {}  # name -> stored timer
+        self._removed = set()
+
+    def set_application(self, application) -> None:
+        self.application = application
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self, wait=True) -> None:
+        pass
+
+    def run_once(self, callback, when, data=None, name=None, chat_id=None, user_id=None, job_kwargs=None):
+        name = name or f"{callback.__name__}_{uuid.uuid4().hex}"
+        self._scheduled[name] = {
+            'callback': f"{callback.__module__}:{callback.__qualname__}",
+            'due_at': _due_at(when),
+            'data': data,
+            'chat_id': chat_id,
+            'user_id': user_id,
+            'origin': getattr(callback, 'cost_origin', None),
+        }
+        self._removed.discard(name)
+        return HandoffJob(self, name, callback, data, chat_id, user_id)
+
+    def run_repeating(self, callback, interval, first=None, last=None, data=None, name=None, chat_id=None,
+                      user_id=None, job_kwargs=None):
+        """Stores a timer that is re-armed ``interval`` after each time it fires, until ``last``."""
+        if isinstance(interval, timedelta):
+            interval = interval.total_seconds()
+        job = self.run_once(callback, 0 if first is None else first, data=data, name=name, chat_id=chat_id,
+                            user_id=user_id)
+        self._scheduled[job.name].update(interval=interval, last=_due_at(last) if last is not None else None)
+        return job
+
+    def get_jobs_by_name(self, name):
+        """Returns a handle for the named timer without reading Firestore.
+
+        Handlers only look jobs up to remove them, and removing a timer that
+        does not exist is a no-op.
+        """
+        return (HandoffJob(self, name),)
+
+    def remove(self, name) -> None:
+        self._scheduled.pop(name, None)
+        self._removed.add(name)
+
+    async def flush(self, db_client) -> None:
+        """Writes timers scheduled or removed since the last flush."""
+        if not self._scheduled and not self._removed:
+            return
+        scheduled, removed = self._scheduled, self._removed
+        self._scheduled, self._removed = {}, set()
+        await _run_sync(db.save_timers, db_client, scheduled, removed)
+
+
+def _due_at(when) -> float:
+    """Converts a PTB ``when`` (seconds, timedelta or datetime) to an epoch timestamp."""
+    if isinstance(when, datetime):
+        return (when if when.tzinfo else when.replace(tzinfo=timezone.utc)).timestamp()
+    if isinstance(when, timedelta):
+        when = when.total_seconds()
+    return time.time() + when
+
+
+def _resolve_callback(path):
+    module_name, _, qualname = path.partition(':')
+    target = importlib.import_module(module_name)
+    for attribute in qualname.split('.'):
+        target = getattr(target, attribute)
+    return target
+
+
+def create_application(token, db_client):
+    """Builds the Application for serverless use, without initializing it."""
+    import bot_main
+
+    application = bot_main.build_application(
+        token, db_client, updater=False, job_queue=HandoffJobQueue(), background_jobs=False
+    )
+    # Daily buckets are flushed at the end of every invocation instead of on a timer
+    db.add_xp_listener(leaderboards.get_windowed_leaderboard(application.bot_data).record)
+    return application
+
+
+async def get_application():
+    """Returns the instance's initialized Application, building it on the first invocation."""
+    global _application
+    if _application is None:
+        started = time.perf_counter()
+        import bot_main
+
+        config = bot_main.load_config()
+        if config is None:
+            raise RuntimeError("Bot configuration is incomplete")
+        token, firebase_credentials_data, is_json_string = config
+        import tracing
+        tracing.configure_from_env()
+        db_client = db.init_firebase(firebase_credentials_data, is_json_string=is_json_string)
+        if not db_client:
+            raise RuntimeError("Failed to initialize Firebase")
+        application = create_application(token, db_client)
+        await application.initialize()
+        _application = application
+
+        cold_start = time.perf_counter() - started
+        log = logger.warning if cold_start > COLD_START_TARGET_SECONDS else logger.info
+        log("Serverless cold start", cold_start_seconds=round(cold_start, 3), target_seconds=COLD_START_TARGET_SECONDS)
+    return _application
+
+
+async def handle_update(application, data) -> None:
+    """Handles one update with its chat's state loaded, then fires any due timers."""
+    from telegram import Update
+
+    update = Update.de_json(data, application.bot)
+    chat, user = update.effective_chat, update.effective_user
+    async with chat_state(application, chat.id if chat else None, user.id if user else None):
+        await application.process_update(update)
+    # The update is applied and saved; failing from here on would make Telegram redeliver it
+    try:
+        await fire_due_timers(application)
+        # Nothing flushes between invocations, so XP coalesced for a late update is written now
+        await load_shedding.get_xp_coalescer(application.bot_data).flush(application.bot_data)
+        await leaderboards.get_windowed_leaderboard(application.bot_data).flush(application.bot_data['db'])
+    except Exception as e:
+        logger.error("Serverless post-update work failed", update_id=update.update_id, error=e)
+
+
+async def fire_due_timers(application, limit=DUE_TIMERS_PER_INVOCATION) -> int:
+    """Runs timers that are due, each with its chat's state loaded. Returns how many ran."""
+    from telegram.ext import CallbackContext
+
+    db_client = application.bot_data['db']
+    holder = uuid.uuid4().hex
+    timers = await _run_sync(db.claim_due_timers, db_client, time.time(), limit, holder, TIMER_CLAIM_TTL)
+    fired = 0
+    for timer in timers:
+        callback = _resolve_callback(timer['callback'])
+        job = HandoffJob(application.job_queue, timer['name'], callback, timer.get('data'),
+                         timer.get('chat_id'), timer.get('user_id'))
+        try:
+            async with chat_state(application, job.chat_id, job.user_id):
+                if timer.get('interval'):
+                    _rearm(application.job_queue, timer, callback)
+                try:
+                    # The stored path names the unwrapped callback, so charge its usage here
+                    with firestore_costs.attributed_to(timer.get('origin') or f"job:{callback.__name__}"):
+                        await callback(CallbackContext.from_job(job, application))
+                except Exception as e:
+                    logger.error("Serverless timer failed", timer=job.name, error=e)
+        except Exception as e:
+            # The claim expires and the timer runs again with the chat's state intact
+            logger.error("Serverless timer could not run", timer=job.name, error=e)
+            continue
+        await _run_sync(db.finish_timer, db_client, job.name, holder)
+        fired += 1
+    return fired
+
+
+def _rearm(job_queue, timer, callback) -> None:
+    """Schedules the next run of a repeating timer; the callback may still remove it."""
+    last = timer.get('last')
+    if last is not None and time.time() + timer['interval'] > last:
+        return
+    job_queue.run_repeating(
+        callback, timer['interval'], first=timer['interval'],
+        last=datetime.fromtimestamp(last, timezone.utc) if last is not None else None,
+        data=timer.get('data'), name=timer['name'], chat_id=timer.get('chat_id'), user_id=timer.get('user_id'),
+    )
+
+
+@asynccontextmanager
+async def chat_state(application, chat_id, user_id):
+    """Holds the chat's lease and loads its state for the duration; writes changes back on success."""
+    db_client = application.bot_data['db']
+    lease_key = f"chat_{chat_id}" if chat_id is not None else None
+    holder = uuid.uuid4().hex
+    if lease_key is not None:
+        await _acquire_lease(db_client, lease_key, holder)
+    try:
+        loaded = await _load_state(application, chat_id, user_id)
+        yield
+        await _save_state(application, chat_id, user_id, loaded)
+        await application.job_queue.flush(db_client)
+    finally:
+        if lease_key is not None:
+            await _run_sync(db.release_lease, db_client, lease_key, holder)
+
+
+async def _acquire_lease(db_client, key, holder) -> None:
+    deadline = time.monotonic() + LEASE_WAIT
+    while not await _run_sync(db.acquire_lease, db_client, key, holder, LEASE_TTL):
+        if time.monotonic() >= deadline:
+            raise LeaseTimeout(key)
+        await asyncio.sleep(LEASE_POLL_INTERVAL)
+
+
+def _state_keys(chat_id, user_id):
+    keys = {}
+    if chat_id is not None:
+        keys['chat'] = f"chat_{chat_id}"
+    if user_id is not None:
+        keys['user'] = f"user_{user_id}"
+    return keys
+
+
+async def _load_state(application, chat_id, user_id):
+    """Replaces the in-memory state for the chat and user with the stored copy.
+
+    Returns the stored blobs, so unchanged state is not written back.
+    """
+    keys = _state_keys(chat_id, user_id)
+    stored = await _run_sync(db.get_states, application.bot_data['db'], list(keys.values()))
+    blobs = {kind: stored.get(key, {}).get('state') for kind, key in keys.items()}
+
+    if 'chat' in keys:
+        state = pickle.loads(blobs['chat']) if blobs['chat'] else {'chat_data': {}, 'games': []}
+        application.drop_chat_data(chat_id)
+        application.chat_data[chat_id].update(state['chat_data'])
+        get_registry(application.bot_data).import_chat(chat_id, state['games'])
+    if 'user' in keys:
+        state = pickle.loads(blobs['user']) if blobs['user'] else {'user_data': {}}
+        application.drop_user_data(user_id)
+        application.user_data[user_id].update(state['user_data'])
+    return blobs
+
+
+async def _save_state(application, chat_id, user_id, loaded) -> None:
+    keys = _state_keys(chat_id, user_id)
+    blobs = {}
+    if 'chat' in keys:
+        blobs['chat'] = pickle.dumps({
+            'chat_data': dict(application.chat_data[chat_id]),
+            'games': get_registry(application.bot_data).export_chat(chat_id),
+        })
+    if 'user' in keys:
+        blobs['user'] = pickle.dumps({'user_data': dict(application.user_data[user_id])})
+
+    changed = {
+        keys[kind]: {'state': blob, 'updated_at': time.time()}
+        for kind, blob in blobs.items() if blob != loaded.get(kind)
+    }
+    if changed:
+        await _run_sync(db.set_states, application.bot_data['db'], changed)
+
+
+async def _run_sync(func, *args):
+    """Runs a blocking database call in the default thread pool executor, within the current trace."""
+    return await asyncio.to_thread(func, *args)
+
+
+def _authorized(request) -> bool:
+    secret = os.getenv('WEBHOOK_SECRET', '')
+    return bool(secret) and hmac.compare_digest(request.headers.get(SECRET_TOKEN_HEADER, ''), secret)
+
+
+app = FastAPI()
+
+
+@app.post('/webhook')
+async def webhook(request: Request) -> Response:
+    # Serverless platforms may stop the CPU once the response is sent, so the update is handled first
+    if not _authorized(request):
+        return Response(status_code=403)
+    try:
+        await handle_update(await get_application(), await request.json())
+    except LeaseTimeout:
+        return Response(status_code=503)  # Telegram redelivers once the chat is free
+    return Response(status_code=200)
+
+
+@app.post('/tick')
+async def tick(request: Request):
+    if not _authorized(request):
+        return Response(status_code=403)
+    return {'fired': await fire_due_timers(await get_application())}
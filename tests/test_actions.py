@@ -4,6 +4,7 @@ import time
 from telegram import Update
 from telegram.ext import CallbackContext
 from handlers import actions
+from game_logic.registry import GUESS_NUMBER, LAST_MAN_STANDING, LAST_MESSAGE_WINS, get_registry
 import database
 
 @pytest.fixture
@@ -62,7 +63,7 @@ async def test_give_xp_success(mock_update, mock_context, mocker):
     await actions.give_xp(mock_update, mock_context)
 
     database.get_user_data.assert_called_once_with(mock_context.bot_data['db'], 123)
-    mock_transfer.assert_called_once_with(mock_context.bot_data['db'], from_user_id=123, to_user_id=456, amount=50)
+    mock_transfer.assert_called_once_with(mock_context.bot_data['db'], from_user_id=123, to_user_id=456, amount=50, reason='give')
     mock_update.message.reply_html.assert_called_once()
     assert "generously gave 50 XP" in mock_update.message.reply_html.call_args[0][0]
 
@@ -122,7 +123,7 @@ async def test_steal_xp_success(mock_update, mock_context, mocker):
 
     await actions.steal_xp(mock_update, mock_context)
 
-    mock_transfer.assert_called_once_with(mock_context.bot_data['db'], from_user_id=456, to_user_id=123, amount=10)
+    mock_transfer.assert_called_once_with(mock_context.bot_data['db'], from_user_id=456, to_user_id=123, amount=10, reason='steal')
     mock_update.message.reply_html.assert_called_once()
     assert "masterfully swiped 10 XP" in mock_update.message.reply_html.call_args[0][0]
 
@@ -134,7 +135,7 @@ async def test_steal_xp_failure(mock_update, mock_context, mocker):
 
     await actions.steal_xp(mock_update, mock_context)
 
-    mock_add_xp.assert_called_once_with(mock_context.bot_data['db'], 123, 'giver', xp_to_add=-5)
+    mock_add_xp.assert_called_once_with(mock_context.bot_data['db'], 123, 'giver', xp_to_add=-5, reason='steal_penalty')
     mock_update.message.reply_html.assert_called_once()
     assert "fumbled the attempt" in mock_update.message.reply_html.call_args[0][0]
 
@@ -165,7 +166,7 @@ async def test_award_xp_success(mock_update, mock_context, mocker):
 
     await actions.award_xp(mock_update, mock_context)
 
-    mock_add_xp.assert_called_once_with(mock_context.bot_data['db'], 456, 'receiver', xp_to_add=100)
+    mock_add_xp.assert_called_once_with(mock_context.bot_data['db'], 456, 'receiver', xp_to_add=100, reason='award')
     mock_update.message.reply_html.assert_called_once()
     assert "awarded 100 XP" in mock_update.message.reply_html.call_args[0][0]
 
@@ -211,24 +212,47 @@ async def test_award_xp_to_bot(mock_update, mock_context):
 
 @pytest.mark.asyncio
 async def test_end_game_active_game(mock_update, mock_context):
-    """Test ending an active game."""
-    mock_context.user_data['game'] = {'secret_number': 50, 'tries_left': 5}
+    """Test ending another player's active game."""
     mock_update.effective_chat.id = 12345 # Example chat ID
+    player_data = {'game': {'secret_number': 50, 'tries_left': 5, 'chat_id': 12345}}
+    mock_context.application.user_data = {456: player_data}
+    get_registry(mock_context.bot_data).register(12345, GUESS_NUMBER, user_id=456, route_messages=True)
 
     await actions.end_game(mock_update, mock_context)
 
     mock_update.message.reply_text.assert_called_once_with("The active game has been ended.")
-    assert 'game' not in mock_context.user_data
+    assert 'game' not in player_data
+    assert get_registry(mock_context.bot_data).games_in_chat(12345) == []
+    assert get_registry(mock_context.bot_data).route(12345, 456) is None
+
+@pytest.mark.asyncio
+async def test_end_game_ends_every_game_in_chat(mock_update, mock_context):
+    """Test that /endgame stops lobby games and cancels their timers."""
+    mock_update.effective_chat.id = 12345
+    mock_context.chat_data = {
+        'lastman_game': {'status': 'in_progress', 'players': {}},
+        'lmw_game': {'status': 'in_progress', 'players': {}},
+    }
+    pending_job = MagicMock()
+    mock_context.job_queue = MagicMock()
+    mock_context.job_queue.get_jobs_by_name.return_value = [pending_job]
+    registry = get_registry(mock_context.bot_data)
+    registry.register(12345, LAST_MAN_STANDING)
+    registry.register(12345, LAST_MESSAGE_WINS, route_messages=True)
+
+    await actions.end_game(mock_update, mock_context)
+
+    mock_update.message.reply_text.assert_called_once_with("2 active games have been ended.")
+    assert mock_context.chat_data == {}
+    assert pending_job.schedule_removal.call_count == 2
+    assert registry.games_in_chat(12345) == []
+    assert registry.route(12345, 123) is None
 
 @pytest.mark.asyncio
 async def test_end_game_no_active_game(mock_update, mock_context):
     """Test ending game when no game is active."""
     mock_update.effective_chat.id = 12345 # Example chat ID
-    # Ensure no 'game' in user_data
-    if 'game' in mock_context.user_data:
-        del mock_context.user_data['game']
 
     await actions.end_game(mock_update, mock_context)
 
-    mock_update.message.reply_text.assert_called_once_with("No active game found in this chat for you to end.")
-    assert 'game' not in mock_context.user_data
\ No newline at end of file
+    mock_update.message.reply_text.assert_called_once_with("No active game found in this chat.")
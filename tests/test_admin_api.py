@@ -0,0 +1,47 @@
+from unittest.mock import MagicMock
+from fastapi.testclient import TestClient
+
+import profiling
+from admin_dashboard.backend.api import create_app
+
+TOKEN = 'admin-token'
+
+def _client(tmp_path):
+    application = MagicMock()
+    application.bot_data = {'profiler': profiling.Profiler(directory=str(tmp_path))}
+    return TestClient(create_app(application, TOKEN))
+
+def test_admin_api_requires_token(tmp_path):
+    """Test that requests without the bearer token are refused."""
+    client = _client(tmp_path)
+
+    assert client.get('/profile').status_code == 401
+    assert client.post('/profile', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+
+def test_admin_api_profiles_and_returns_file(tmp_path):
+    """Test that a session started over the API answers with the profile and shows up in the status."""
+    client = _client(tmp_path)
+    headers = {'Authorization': f'Bearer {TOKEN}'}
+
+    response = client.post('/profile', params={'seconds': 1, 'mode': 'cprofile'}, headers=headers)
+
+    assert response.status_code == 200
+    status = client.get('/profile', headers=headers).json()
+    assert status['active'] is None
+    assert status['last']['mode'] == 'cprofile'
+
+def test_admin_api_refuses_sampling_off_the_main_thread(tmp_path):
+    """Test that sampling is refused when the loop is not in the main thread, as under the test client."""
+    client = _client(tmp_path)
+
+    response = client.post('/profile', params={'seconds': 1, 'mode': 'sampling'}, headers={'Authorization': f'Bearer {TOKEN}'})
+
+    assert response.status_code == 409
+
+def test_admin_api_rejects_unknown_mode(tmp_path):
+    """Test that an unknown profiler mode is a bad request."""
+    client = _client(tmp_path)
+
+    response = client.post('/profile', params={'mode': 'perf'}, headers={'Authorization': f'Bearer {TOKEN}'})
+
+    assert response.status_code == 400
@@ -3,6 +3,7 @@ from unittest.mock import MagicMock, AsyncMock, patch
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import CallbackContext
 from handlers import callbacks, core, game_guess_number
+from handlers.router import Route, decode_callback, encode_callback
 import database
 
 @pytest.fixture
@@ -32,11 +33,16 @@ def mock_context_with_admin():
 
     return context
 
+def _patch_route(game, action, answer=True):
+    """Replaces a route's handler in the dispatch table with an AsyncMock."""
+    mock_handler = AsyncMock()
+    return mock_handler, patch.dict(callbacks.router.routes, {(game, action): Route(mock_handler, answer)})
+
 @pytest.mark.asyncio
-@patch('handlers.core.leaderboard', new_callable=AsyncMock)
-async def test_button_handler_leaderboard(mock_leaderboard, mock_update_callback):
-    """Test that the button_handler calls core.leaderboard for 'leaderboard' data."""
-    mock_update_callback.callback_query.data = 'leaderboard'
+async def test_button_handler_leaderboard(mock_update_callback):
+    """Test that the button_handler routes 'menu:leaderboard' to the leaderboard handler."""
+    mock_update_callback.callback_query.data = 'menu:leaderboard'
+    mock_leaderboard, routes_patch = _patch_route('menu', 'leaderboard')
     
     mock_context = MagicMock(spec=CallbackContext)
     mock_context.bot = AsyncMock()
@@ -44,16 +50,17 @@ async def test_button_handler_leaderboard(mock_leaderboard, mock_update_callback
     admin_member.user.id = 123
     mock_context.bot.get_chat_administrators.return_value = [admin_member]
 
-    await callbacks.button_handler(mock_update_callback, mock_context)
+    with routes_patch:
+        await callbacks.button_handler(mock_update_callback, mock_context)
     
     mock_update_callback.callback_query.answer.assert_called_once()
     mock_leaderboard.assert_called_once()
 
 @pytest.mark.asyncio
-@patch('handlers.core.start', new_callable=AsyncMock)
-async def test_button_handler_start_menu(mock_start, mock_update_callback):
-    """Test that the button_handler calls core.start for 'start_menu' data."""
-    mock_update_callback.callback_query.data = 'start_menu'
+async def test_button_handler_start_menu(mock_update_callback):
+    """Test that the button_handler routes 'menu:start' to the start handler."""
+    mock_update_callback.callback_query.data = 'menu:start'
+    mock_start, routes_patch = _patch_route('menu', 'start')
 
     mock_context = MagicMock(spec=CallbackContext)
     mock_context.bot = AsyncMock()
@@ -61,7 +68,8 @@ async def test_button_handler_start_menu(mock_start, mock_update_callback):
     admin_member.user.id = 123
     mock_context.bot.get_chat_administrators.return_value = [admin_member]
     
-    await callbacks.button_handler(mock_update_callback, mock_context)
+    with routes_patch:
+        await callbacks.button_handler(mock_update_callback, mock_context)
     
     mock_update_callback.callback_query.answer.assert_called_once()
     mock_start.assert_called_once()
@@ -69,7 +77,7 @@ async def test_button_handler_start_menu(mock_start, mock_update_callback):
 @pytest.mark.asyncio
 async def test_button_handler_profile_user_exists(mock_update_callback, mock_context_with_admin, mocker):
     """Test the profile button when the user exists."""
-    mock_update_callback.callback_query.data = 'profile'
+    mock_update_callback.callback_query.data = 'menu:profile'
     
     mocker.patch('database.get_user_data', return_value={'username': 'testuser', 'xp': 120})
 
@@ -85,7 +93,7 @@ async def test_button_handler_profile_user_exists(mock_update_callback, mock_con
 @pytest.mark.asyncio
 async def test_button_handler_profile_no_user(mock_update_callback, mock_context_with_admin, mocker):
     """Test the profile button when the user does not exist."""
-    mock_update_callback.callback_query.data = 'profile'
+    mock_update_callback.callback_query.data = 'menu:profile'
     
     mocker.patch('database.get_user_data', return_value=None)
 
@@ -96,24 +104,103 @@ async def test_button_handler_profile_no_user(mock_update_callback, mock_context
     assert "You don't have a profile yet" in mock_update_callback.callback_query.message.edit_text.call_args.kwargs['text']
 
 @pytest.mark.asyncio
-@patch('handlers.core.help_command', new_callable=AsyncMock)
-async def test_button_handler_help_menu(mock_help_command, mock_update_callback, mock_context_with_admin):
-    """Test that the help button calls core.help_command."""
-    mock_update_callback.callback_query.data = 'help_menu'
+async def test_button_handler_help_menu(mock_update_callback, mock_context_with_admin):
+    """Test that the help button calls the help handler."""
+    mock_update_callback.callback_query.data = 'menu:help'
+    mock_help_command, routes_patch = _patch_route('menu', 'help')
 
-    await callbacks.button_handler(mock_update_callback, mock_context_with_admin)
+    with routes_patch:
+        await callbacks.button_handler(mock_update_callback, mock_context_with_admin)
     
     mock_update_callback.callback_query.answer.assert_called_once()
     mock_help_command.assert_called_once()
 
 @pytest.mark.asyncio
-@patch('handlers.game_guess_number.start_new_game', new_callable=AsyncMock)
-async def test_button_handler_start_number_game(mock_start_new_game, mock_update_callback, mock_context_with_admin):
+async def test_button_handler_start_number_game(mock_update_callback, mock_context_with_admin):
     """Test that the 'Guess the Number' button starts a new game."""
-    mock_update_callback.callback_query.data = 'start_number_game'
+    mock_update_callback.callback_query.data = 'guess:start'
+    mock_start_new_game, routes_patch = _patch_route('guess', 'start')
 
-    await callbacks.button_handler(mock_update_callback, mock_context_with_admin)
+    with routes_patch:
+        await callbacks.button_handler(mock_update_callback, mock_context_with_admin)
 
     mock_update_callback.callback_query.answer.assert_called_once()
     mock_start_new_game.assert_called_once_with(mock_update_callback, mock_context_with_admin)
 
+
+
+@pytest.mark.asyncio
+async def test_button_handler_game_menu(mock_update_callback, mock_context_with_admin):
+    """Test that the game menu lists every game with encoded callback data."""
+    mock_update_callback.callback_query.data = 'menu:games'
+
+    await callbacks.button_handler(mock_update_callback, mock_context_with_admin)
+
+    reply_markup = mock_update_callback.callback_query.message.edit_text.call_args.kwargs['reply_markup']
+    callback_data = [row[0].callback_data for row in reply_markup.inline_keyboard]
+    assert callback_data == ['guess:start', 'lastman:lobby', 'lmw:lobby', 'menu:start']
+
+@pytest.mark.asyncio
+async def test_button_handler_passes_args(mock_update_callback, mock_context_with_admin):
+    """Test that arguments after the action are exposed as context.args."""
+    mock_update_callback.callback_query.data = 'menu:leaderboard:3'
+    mock_leaderboard, routes_patch = _patch_route('menu', 'leaderboard')
+
+    with routes_patch:
+        await callbacks.button_handler(mock_update_callback, mock_context_with_admin)
+
+    assert mock_context_with_admin.args == ['3']
+    mock_leaderboard.assert_called_once_with(mock_update_callback, mock_context_with_admin)
+
+@pytest.mark.asyncio
+async def test_button_handler_self_answering_route(mock_update_callback, mock_context_with_admin):
+    """Test that routes registered with answer=False leave answering to the handler."""
+    mock_update_callback.callback_query.data = 'lmw:join'
+    mock_join, routes_patch = _patch_route('lmw', 'join', answer=False)
+
+    with routes_patch:
+        await callbacks.button_handler(mock_update_callback, mock_context_with_admin)
+
+    mock_update_callback.callback_query.answer.assert_not_called()
+    mock_join.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_button_handler_unknown_action(mock_update_callback, mock_context_with_admin):
+    """Test that unknown callback data is answered with an alert, leaving the message alone."""
+    mock_update_callback.callback_query.data = 'farm:start'
+
+    await callbacks.button_handler(mock_update_callback, mock_context_with_admin)
+
+    mock_update_callback.callback_query.answer.assert_called_once_with("This button is no longer available.", show_alert=True)
+    mock_update_callback.callback_query.message.edit_text.assert_not_called()
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('legacy, route', [
+    ('lmw_join', ('lmw', 'join')),
+    ('lastman_start', ('lastman', 'start')),
+    ('leaderboard', ('menu', 'leaderboard')),
+    ('start_menu', ('menu', 'start')),
+])
+async def test_button_handler_routes_legacy_callback_data(mocker, mock_update_callback, mock_context_with_admin, legacy, route):
+    """Test that buttons sent before the game:action encoding still reach their handler."""
+    handler = AsyncMock()
+    mocker.patch.dict(callbacks.router.routes, {route: Route(handler, False)})
+    mock_update_callback.callback_query.data = legacy
+
+    await callbacks.button_handler(mock_update_callback, mock_context_with_admin)
+
+    handler.assert_awaited_once()
+    mock_update_callback.callback_query.message.edit_text.assert_not_called()
+
+def test_encode_decode_callback_round_trip():
+    """Test the game:action:args encoding."""
+    data = encode_callback('lb', 'page', 2, 'global')
+
+    assert data == 'lb:page:2:global'
+    assert decode_callback(data) == ('lb', 'page', ['2', 'global'])
+    assert decode_callback('menu:start') == ('menu', 'start', [])
+
+def test_encode_callback_rejects_oversized_data():
+    """Test that callback data longer than Telegram allows is rejected."""
+    with pytest.raises(ValueError):
+        encode_callback('lb', 'page', 'x' * 64)
@@ -4,6 +4,7 @@ from telegram import Update
 from telegram.ext import CallbackContext
 from handlers import core
 import database
+import leaderboards
 
 @pytest.fixture
 def mock_context_with_admin():
@@ -60,18 +61,21 @@ async def test_start_command(mock_context_with_admin):
 
 @pytest.mark.asyncio
 async def test_leaderboard_command_default_limit(mock_context_with_admin, mocker):
-    """Test the /leaderboard command uses default limit of 10."""
+    """Test the /leaderboard command without a limit serves the first page from a snapshot."""
     update = AsyncMock(spec=Update)
     update.effective_user.id = 123
     update.message = AsyncMock()
     update.callback_query = None
     update.effective_chat.type = 'group'
     mock_context_with_admin.args = [] # Ensure args is empty for default limit
-    mocker.patch('database.get_leaderboard', return_value=[])
+    mocker.patch('database.get_leaderboard_page', return_value=([], []))
 
     await core.leaderboard(update, mock_context_with_admin)
 
-    database.get_leaderboard.assert_called_once_with(mock_context_with_admin.bot_data['db'], limit=10)
+    database.get_leaderboard_page.assert_called_once_with(
+        mock_context_with_admin.bot_data['db'], leaderboards.LEADERBOARD_SNAPSHOT_SIZE + 1
+    )
+    update.message.reply_text.assert_called_once_with(text="The leaderboard is currently empty.")
 
 @pytest.mark.asyncio
 async def test_leaderboard_command_with_valid_limit(mock_context_with_admin, mocker):
@@ -132,7 +136,7 @@ async def test_leaderboard_output_populated(mock_context_with_admin, mocker):
     update.effective_chat.type = 'group'
     mock_context_with_admin.args = []
     mock_leaderboard_data = [('user1', 100), ('user2', 95)]
-    mocker.patch('database.get_leaderboard', return_value=mock_leaderboard_data)
+    mocker.patch('database.get_leaderboard_page', return_value=(mock_leaderboard_data, [MagicMock(), MagicMock()]))
 
     await core.leaderboard(update, mock_context_with_admin)
 
@@ -141,7 +145,72 @@ async def test_leaderboard_output_populated(mock_context_with_admin, mocker):
     assert "🏆 <b>Top 10 Players</b>" in reply_text
     assert "🥇 @user1 - 100 XP" in reply_text
     assert "🥈 @user2 - 95 XP" in reply_text
+    # Everything fits on one page, so there is nothing to navigate to
+    assert update.message.reply_html.call_args.kwargs['reply_markup'] is None
+
+@pytest.mark.asyncio
+async def test_leaderboard_page_navigation(mock_context_with_admin, mocker):
+    """Test that Next/Prev pages are served from the cached snapshot."""
+    update = AsyncMock(spec=Update)
+    update.effective_user.id = 123
+    update.callback_query = AsyncMock()
+    update.callback_query.message.edit_text = AsyncMock()
+    entries = [(f'user{i}', 1000 - i) for i in range(25)]
+    mock_page = mocker.patch('database.get_leaderboard_page', return_value=(entries, [MagicMock() for _ in entries]))
+
+    mock_context_with_admin.args = []
+    await core.leaderboard(update, mock_context_with_admin)
+    first_markup = update.callback_query.message.edit_text.call_args.kwargs['reply_markup']
+    assert [button.text for button in first_markup.inline_keyboard[0]] == ["Next »"]
+    assert first_markup.inline_keyboard[0][0].callback_data == 'lb:page:1:1'
+
+    mock_context_with_admin.args = ['1', '1']
+    await core.leaderboard_page(update, mock_context_with_admin)
+
+    page_text = update.callback_query.message.edit_text.call_args.kwargs['text']
+    assert "Players 11-20" in page_text
+    assert "  11.  @user10 - 990 XP" in page_text
+    markup = update.callback_query.message.edit_text.call_args.kwargs['reply_markup']
+    assert [button.callback_data for button in markup.inline_keyboard[0]] == ['lb:page:0:1', 'lb:page:2:1']
+    mock_page.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_leaderboard_here(mock_context_with_admin, mocker):
+    """Test that /leaderboard here shows the chat's own top players."""
+    update = AsyncMock(spec=Update)
+    update.effective_user.id = 123
+    update.message = AsyncMock()
+    update.callback_query = None
+    update.effective_chat.type = 'group'
+    update.effective_chat.id = -100
+    mock_context_with_admin.args = ['here']
+    mocker.patch('database.get_chat_leaderboard', return_value=[(1, 'local1', 40), (2, 'local2', 12)])
+
+    await core.leaderboard(update, mock_context_with_admin)
 
+    reply_text = update.message.reply_html.call_args[0][0]
+    assert "Top 2 in this chat" in reply_text
+    assert "🥇 @local1 - 40 XP" in reply_text
+    database.get_chat_leaderboard.assert_called_once_with(
+        mock_context_with_admin.bot_data['db'], -100, leaderboards.CHAT_LEADERBOARD_SEED_SIZE
+    )
+@pytest.mark.asyncio
+async def test_leaderboard_week(mock_context_with_admin, mocker):
+    """Test that /leaderboard week ranks XP earned over the last seven days."""
+    update = AsyncMock(spec=Update)
+    update.effective_user.id = 123
+    update.message = AsyncMock()
+    update.callback_query = None
+    update.effective_chat.type = 'group'
+    mock_context_with_admin.args = ['week']
+    mock_daily = mocker.patch('database.get_daily_xp', return_value=[(1, 'grinder', 8)])
+
+    await core.leaderboard(update, mock_context_with_admin)
+
+    reply_text = update.message.reply_html.call_args[0][0]
+    assert "Top 1 Players of the last 7 days" in reply_text
+    assert "🥇 @grinder - 56 XP" in reply_text  # The same bucket served for each of the 7 days
+    assert mock_daily.call_count == 7
 
 @pytest.mark.asyncio
 async def test_help_command(mock_context_with_admin):
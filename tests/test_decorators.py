@@ -37,6 +37,7 @@ def mock_context():
     context = MagicMock(spec=CallbackContext)
     context.bot = AsyncMock()
     context.bot.get_chat_administrators = AsyncMock()
+    context.bot_data = {}
     return context
 
 @pytest.mark.asyncio
@@ -82,3 +83,45 @@ async def test_is_admin_group_non_admin_fails(mock_update_group_non_admin, mock_
     mock_func.assert_not_called()
     mock_context.bot.get_chat_administrators.assert_called_once()
     mock_update_group_non_admin.message.reply_text.assert_called_once_with("This command can only be used by group admins.")
+
+@pytest.mark.asyncio
+async def test_is_admin_caches_admin_list(mock_update_group_admin, mock_context):
+    """Test that repeated admin checks in a chat look the admins up once."""
+    admin_member = MagicMock()
+    admin_member.user.id = mock_update_group_admin.effective_user.id
+    mock_context.bot.get_chat_administrators.return_value = [admin_member]
+    wrapped_func = decorators.is_admin(AsyncMock())
+
+    await wrapped_func(mock_update_group_admin, mock_context)
+    await wrapped_func(mock_update_group_admin, mock_context)
+
+    mock_context.bot.get_chat_administrators.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_is_admin_rechecks_older_list_for_refused_user(mock_update_group_non_admin, mock_context, mocker):
+    """Test that a user missing from a list older than ADMIN_RECHECK_AFTER gets a fresh lookup."""
+    new_admin = MagicMock()
+    new_admin.user.id = mock_update_group_non_admin.effective_user.id
+    mock_context.bot.get_chat_administrators.return_value = [new_admin]
+    mocker.patch('time.monotonic', return_value=1000.0)
+    mock_context.bot_data['chat_admins'] = {mock_update_group_non_admin.effective_chat.id: (1000.0 - decorators.ADMIN_RECHECK_AFTER, frozenset({999}))}
+    mock_func = AsyncMock()
+
+    await decorators.is_admin(mock_func)(mock_update_group_non_admin, mock_context)
+
+    mock_func.assert_called_once()
+    mock_context.bot.get_chat_administrators.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_is_admin_refuses_demoted_admin_after_ttl(mock_update_group_admin, mock_context, mocker):
+    """Test that an admin list older than ADMIN_CACHE_TTL is looked up again, so a demoted admin is refused."""
+    mock_context.bot.get_chat_administrators.return_value = []
+    mocker.patch('time.monotonic', return_value=1000.0)
+    user_id = mock_update_group_admin.effective_user.id
+    mock_context.bot_data['chat_admins'] = {mock_update_group_admin.effective_chat.id: (1000.0 - decorators.ADMIN_CACHE_TTL, frozenset({user_id}))}
+    mock_func = AsyncMock()
+
+    await decorators.is_admin(mock_func)(mock_update_group_admin, mock_context)
+
+    mock_func.assert_not_called()
+    mock_context.bot.get_chat_administrators.assert_called()
@@ -0,0 +1,101 @@
+import pytest
+from unittest.mock import MagicMock
+
+import database
+import firestore_costs
+import metrics
+from firestore_costs import COSTS, Usage
+
+@pytest.fixture(autouse=True)
+def fresh_costs():
+    """Starts every test with no recorded usage."""
+    COSTS.reset()
+    yield
+    COSTS.reset()
+    COSTS.observer = None
+
+@pytest.fixture
+def mock_db():
+    return MagicMock()
+
+def _snapshot(data):
+    snapshot = MagicMock()
+    snapshot.exists = data is not None
+    snapshot.to_dict.return_value = data
+    return snapshot
+
+def test_handler_usage_is_charged_to_the_handler(mock_db):
+    """Test that a database operation run by a handler is charged to that handler."""
+    mock_db.collection.return_value.document.return_value.get.return_value = _snapshot({'user_ids': [1]})
+
+    with metrics.track_handler('command:start'):
+        database.get_recent_activity(mock_db)
+        database.save_recent_activity(mock_db, [2])
+
+    totals = COSTS.totals()
+    assert totals[('command:start', 'get_recent_activity')].reads == 1
+    assert totals[('command:start', 'save_recent_activity')].writes == 1
+    assert totals[('command:start', 'save_recent_activity')].calls == 1
+
+def test_usage_outside_handlers_is_background(mock_db):
+    """Test that an empty query still costs one read, charged to the background origin."""
+    mock_db.collection.return_value.document.return_value.collection.return_value.stream.return_value = []
+
+    assert database.get_daily_xp(mock_db, '2024-01-01') == []
+
+    assert COSTS.totals()[(firestore_costs.BACKGROUND, 'get_daily_xp')].reads == 1
+
+@pytest.mark.asyncio
+async def test_origin_follows_reads_into_worker_threads(mocker, mock_db):
+    """Test that user reads made in a worker thread are charged to the handler that awaited them."""
+    mocker.patch('database._user_cache', None)
+    mock_db.collection.return_value.document.return_value.get.return_value = _snapshot({'xp': 5})
+
+    with firestore_costs.attributed_to('message:handle_message'):
+        assert (await database.get_user_data(mock_db, 7))['xp'] == 5
+
+    assert COSTS.totals()[('message:handle_message', 'get_user_data')].reads == 1
+
+@pytest.mark.asyncio
+async def test_jobs_are_charged_to_their_name(mock_db):
+    """Test that attributed jobs charge their operations to job:<name>."""
+    async def job(context):
+        database.set_states(mock_db, {'a': {}, 'b': {}})
+
+    await firestore_costs.attributed_job('save_states', job)(MagicMock())
+
+    assert COSTS.totals()[('job:save_states', 'set_states')].writes == 2
+
+def test_report_ranks_origins_by_spend():
+    """Test that the report lists the costliest origin first with its operations."""
+    COSTS.record('command:leaderboard', 'get_leaderboard', Usage(calls=2, reads=20))
+    COSTS.record('message:handle_message', 'add_xp', Usage(calls=10, reads=10, writes=30))
+
+    lines = firestore_costs.report().splitlines()
+
+    assert lines[0] == "Firestore usage: 30 reads, 30 writes, 0 deletes (~$0.0000)"
+    assert lines[1].startswith('message:handle_message: 10r/30w/0d')
+    assert lines[2] == '  add_xp x10: 10r/30w/0d'
+    assert lines[3].startswith('command:leaderboard: 20r/0w/0d')
+
+def test_metrics_observer_counts_documents():
+    """Test that tracked usage is exported as a documents counter per origin and kind."""
+    metrics.track_firestore_costs(COSTS)
+    before = metrics.DB_DOCUMENTS.value('command:give', 'writes')
+
+    COSTS.record('command:give', 'transfer_xp', Usage(calls=1, reads=2, writes=4))
+
+    assert metrics.DB_DOCUMENTS.value('command:give', 'writes') == before + 4
+
+@pytest.mark.asyncio
+async def test_summary_job_logs_each_interval_once(mocker):
+    """Test that the periodic summary covers only usage since the previous summary."""
+    log = mocker.patch('firestore_costs.logger')
+    COSTS.record('command:lmw', 'get_user_data', Usage(calls=1, reads=1))
+
+    await firestore_costs.log_costs_job(MagicMock())
+    await firestore_costs.log_costs_job(MagicMock())
+
+    log.info.assert_called_once()
+    assert log.info.call_args.kwargs['origins']['command:lmw']['reads'] == 1
+    assert COSTS.totals()[('command:lmw', 'get_user_data')].reads == 1
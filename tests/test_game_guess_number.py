@@ -3,6 +3,7 @@ from unittest.mock import MagicMock, AsyncMock, patch
 from telegram import Update
 from telegram.ext import CallbackContext
 from handlers import game_guess_number
+from game_logic.registry import GUESS_NUMBER, get_registry
 import database
 
 @pytest.fixture
@@ -26,6 +27,7 @@ def mock_context():
     """Fixture for a mock CallbackContext object."""
     context = MagicMock(spec=CallbackContext)
     context.user_data = {}
+    context.bot_data = {'db': MagicMock()}
     context.bot = AsyncMock()
     admin_member = MagicMock()
     admin_member.user.id = 123
@@ -44,6 +46,8 @@ async def test_start_new_game_command(mock_randint, mock_admin_update, mock_cont
     assert 'game' in mock_context.user_data
     assert mock_context.user_data['game']['secret_number'] == 42
     assert mock_context.user_data['game']['tries_left'] == 7
+    chat_id = mock_admin_update.effective_chat.id
+    assert get_registry(mock_context.bot_data).route(chat_id, 123) == GUESS_NUMBER
 
 @pytest.mark.asyncio
 @patch('random.randint', return_value=42)
@@ -64,7 +68,8 @@ async def test_start_new_game_callback(mock_randint, mock_admin_update, mock_con
 async def test_handle_guess_correct(mock_admin_update, mock_context, mocker):
     """Test a correct guess."""
     mock_add_xp = mocker.patch('database.add_xp', new_callable=AsyncMock)
-    mock_context.user_data['game'] = {'secret_number': 42, 'tries_left': 5}
+    mock_context.user_data['game'] = {'secret_number': 42, 'tries_left': 5, 'chat_id': -1}
+    get_registry(mock_context.bot_data).register(-1, GUESS_NUMBER, user_id=123, route_messages=True)
     mock_admin_update.message.text = '42'
     
     await game_guess_number.handle_guess(mock_admin_update, mock_context)
@@ -72,6 +77,7 @@ async def test_handle_guess_correct(mock_admin_update, mock_context, mocker):
     mock_admin_update.message.reply_text.assert_called_once()
     assert "Congratulations! You guessed the number 42" in mock_admin_update.message.reply_text.call_args[0][0]
     assert 'game' not in mock_context.user_data
+    assert get_registry(mock_context.bot_data).route(-1, 123) is None
     mock_add_xp.assert_called_once()
 
 @pytest.mark.asyncio
@@ -114,4 +120,18 @@ async def test_handle_guess_game_over(mock_admin_update, mock_context):
     await game_guess_number.handle_guess(mock_admin_update, mock_context)
     
     mock_admin_update.message.reply_text.assert_called_once_with("😔 Oh no! You ran out of tries. The secret number was 42.\n\nUse /start_game to play again.")
-    assert 'game' not in mock_context.user_data
\ No newline at end of file
+    assert 'game' not in mock_context.user_data
+@pytest.mark.asyncio
+async def test_start_new_game_releases_game_in_other_chat(mock_admin_update, mock_context):
+    """Test that starting a game elsewhere stops the old chat from routing the player's messages to it."""
+    mock_admin_update.callback_query = None
+    mock_admin_update.effective_chat.id = -100
+    await game_guess_number.start_new_game(mock_admin_update, mock_context)
+
+    mock_admin_update.effective_chat.id = -200
+    await game_guess_number.start_new_game(mock_admin_update, mock_context)
+
+    registry = get_registry(mock_context.bot_data)
+    assert registry.route(-100, 123) is None
+    assert registry.route(-200, 123) == GUESS_NUMBER
+    assert mock_context.user_data['game']['chat_id'] == -200
@@ -1,13 +1,16 @@
 import pytest
-from unittest.mock import MagicMock, AsyncMock, patch
+from unittest.mock import ANY, MagicMock, AsyncMock, patch
 from telegram import Update
 from telegram.ext import CallbackContext, JobQueue
 import asyncio
 import time
+from datetime import datetime, timedelta, timezone
 
 from handlers import last_message_wins_game
 import database
 
+GAME_START = datetime(2024, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+
 @pytest.fixture
 def mock_update():
     """Fixture for a mock Update object."""
@@ -69,7 +72,7 @@ async def test_start_lmw_lobby_new_lobby_success(mock_update, mock_context, mock
     assert 'lmw_game' in mock_context.chat_data
     assert mock_context.chat_data['lmw_game']['status'] == 'lobby'
     assert 1 in mock_context.chat_data['lmw_game']['players']
-    mock_db_add_xp.assert_called_once_with(mock_context.bot_data['db'], 1, 'testuser1', -last_message_wins_game.LMW_ENTRY_COST)
+    mock_db_add_xp.assert_called_once_with(mock_context.bot_data['db'], 1, 'testuser1', -last_message_wins_game.LMW_ENTRY_COST, reason='lmw_entry')
     assert mock_context.chat_data['lmw_game']['xp_pot'] > 0
     mock_update.message.reply_html.assert_called_once()
     assert "Last Message Wins Lobby" in mock_update.message.reply_html.call_args[0][0]
@@ -90,7 +93,7 @@ async def test_lmw_callback_handler_join_success(mock_update, mock_context, mock
     mock_context.chat_data['lmw_game'] = {
         'status': 'lobby', 'players': {2: {'username': 'p2', 'mention': 'P2'}}, 'message_id': 100, 'xp_pot': 2
     }
-    mock_update.callback_query.data = 'lmw_join'
+    mock_update.callback_query.data = last_message_wins_game.LMW_JOIN_DATA
     mock_update.callback_query.from_user.id = 1
     mock_db_get_user.return_value = {'xp': 50}
 
@@ -99,7 +102,7 @@ async def test_lmw_callback_handler_join_success(mock_update, mock_context, mock
     mock_update.callback_query.answer.assert_called_once()
     assert 1 in mock_context.chat_data['lmw_game']['players']
     assert len(mock_context.chat_data['lmw_game']['players']) == 2
-    mock_db_add_xp.assert_called_once_with(mock_context.bot_data['db'], 1, 'testuser1', -last_message_wins_game.LMW_ENTRY_COST)
+    mock_db_add_xp.assert_called_once_with(mock_context.bot_data['db'], 1, 'testuser1', -last_message_wins_game.LMW_ENTRY_COST, reason='lmw_entry')
     mock_context.bot.edit_message_text.assert_called_once()
 
 @pytest.mark.asyncio
@@ -112,39 +115,96 @@ async def test_lmw_callback_handler_start_success(mock_update, mock_context, moc
         'xp_pot': 5,
         'job': None
     }
-    mock_update.callback_query.data = 'lmw_start'
+    mock_update.callback_query.data = last_message_wins_game.LMW_START_DATA
     mock_start_game = mocker.patch('handlers.last_message_wins_game.start_lmw_game', new_callable=AsyncMock)
 
     await last_message_wins_game.lmw_callback_handler(mock_update, mock_context)
 
     assert mock_context.chat_data['lmw_game']['status'] == 'in_progress'
+    assert mock_context.chat_data['lmw_game']['pending_players'] == {1, 2}
     mock_context.bot.edit_message_text.assert_called_once()
     assert "Game Started!" in mock_context.bot.edit_message_text.call_args[1]['text']
     mock_start_game.assert_called_once()
 
+def _in_progress_game(players):
+    """Builds an in-progress game whose window opened at GAME_START with countdown message 500."""
+    return {
+        'status': 'in_progress',
+        'players': players,
+        'pending_players': set(players),
+        'start_message_id': 500,
+        'deadline': GAME_START + timedelta(seconds=last_message_wins_game.LMW_GAME_DURATION),
+        'last_message_info': {'user_id': None, 'message_id': None}
+    }
+
 @pytest.mark.asyncio
 async def test_lmw_message_handler_records_message(mock_update, mock_context):
     """Test that the message handler correctly records a player's message."""
-    mock_context.chat_data['lmw_game'] = {
-        'status': 'in_progress',
-        'players': {1: {'has_messaged': False}},
-        'last_message_info': {'user_id': None}
-    }
+    mock_context.chat_data['lmw_game'] = _in_progress_game({1: {'username': 'p1'}})
     mock_update.effective_user.id = 1
     mock_update.message.message_id = 555
+    mock_update.message.date = GAME_START + timedelta(seconds=10)
 
     await last_message_wins_game.lmw_message_handler(mock_update, mock_context)
 
     assert mock_context.chat_data['lmw_game']['last_message_info']['user_id'] == 1
     assert mock_context.chat_data['lmw_game']['last_message_info']['message_id'] == 555
-    assert mock_context.chat_data['lmw_game']['players'][1]['has_messaged'] is True
+    assert mock_context.chat_data['lmw_game']['last_message_info']['timestamp'] == GAME_START + timedelta(seconds=10)
+    assert 1 not in mock_context.chat_data['lmw_game']['pending_players']
+
+@pytest.mark.asyncio
+async def test_lmw_message_handler_ignores_message_after_deadline(mock_update, mock_context):
+    """A message dated after the deadline loses even if it is processed during the grace window."""
+    mock_context.chat_data['lmw_game'] = _in_progress_game({1: {'username': 'p1'}})
+    mock_update.effective_user.id = 1
+    mock_update.message.message_id = 555
+    mock_update.message.date = GAME_START + timedelta(seconds=last_message_wins_game.LMW_GAME_DURATION + 1)
+
+    await last_message_wins_game.lmw_message_handler(mock_update, mock_context)
+
+    assert mock_context.chat_data['lmw_game']['last_message_info']['user_id'] is None
+    assert 1 in mock_context.chat_data['lmw_game']['pending_players']
+
+@pytest.mark.asyncio
+async def test_lmw_message_handler_ignores_message_sent_before_start(mock_update, mock_context):
+    """A message sent before the countdown is not counted even if it is processed late."""
+    mock_context.chat_data['lmw_game'] = _in_progress_game({1: {'username': 'p1'}})
+    mock_update.effective_user.id = 1
+    mock_update.message.message_id = 499
+    mock_update.message.date = GAME_START
+
+    await last_message_wins_game.lmw_message_handler(mock_update, mock_context)
+
+    assert mock_context.chat_data['lmw_game']['last_message_info']['user_id'] is None
+
+@pytest.mark.asyncio
+async def test_lmw_message_handler_orders_by_message_id(mock_update, mock_context):
+    """Messages processed out of order are adjudicated by Telegram's ordering, not arrival."""
+    mock_context.chat_data['lmw_game'] = _in_progress_game({1: {'username': 'p1'}, 2: {'username': 'p2'}})
+
+    mock_update.effective_user.id = 2
+    mock_update.message.message_id = 560
+    mock_update.message.date = GAME_START + timedelta(seconds=20)
+    await last_message_wins_game.lmw_message_handler(mock_update, mock_context)
+
+    # An earlier message from player 1 arrives late
+    mock_update.effective_user.id = 1
+    mock_update.message.message_id = 555
+    mock_update.message.date = GAME_START + timedelta(seconds=19)
+    await last_message_wins_game.lmw_message_handler(mock_update, mock_context)
+
+    game_data = mock_context.chat_data['lmw_game']
+    assert game_data['last_message_info']['user_id'] == 2
+    assert game_data['last_message_info']['message_id'] == 560
+    assert game_data['pending_players'] == set()
 
 @pytest.mark.asyncio
 async def test_lmw_message_handler_already_messaged(mock_update, mock_context):
     """Test that a player cannot send more than one message."""
     mock_context.chat_data['lmw_game'] = {
         'status': 'in_progress',
-        'players': {1: {'has_messaged': True}},
+        'players': {1: {'username': 'p1'}},
+        'pending_players': set(),
     }
     mock_update.effective_user.id = 1
 
@@ -152,6 +212,17 @@ async def test_lmw_message_handler_already_messaged(mock_update, mock_context):
     
     mock_update.message.reply_text.assert_called_once_with("You have already sent your message for this round!")
 
+@pytest.mark.asyncio
+async def test_lmw_message_handler_ignores_non_players(mock_update, mock_context):
+    """Test that messages from people outside the game are ignored silently."""
+    mock_context.chat_data['lmw_game'] = _in_progress_game({2: {'username': 'p2'}})
+    mock_update.effective_user.id = 1
+
+    await last_message_wins_game.lmw_message_handler(mock_update, mock_context)
+
+    mock_update.message.reply_text.assert_not_called()
+    assert mock_context.chat_data['lmw_game']['last_message_info']['user_id'] is None
+
 @pytest.mark.asyncio
 @patch('asyncio.sleep', new_callable=AsyncMock) # Prevent sleeping in tests
 async def test_start_lmw_game_schedules_end(mock_sleep, mock_update, mock_context):
@@ -159,17 +230,23 @@ async def test_start_lmw_game_schedules_end(mock_sleep, mock_update, mock_contex
     mock_context.chat_data['lmw_game'] = {
         'status': 'in_progress', 'players': {}, 'job': None
     }
-    mock_context.bot.send_message.return_value = MagicMock(message_id=200)
+    mock_context.bot.send_message.return_value = MagicMock(message_id=200, date=GAME_START)
 
     await last_message_wins_game.start_lmw_game(mock_update, mock_context)
 
+    game_data = mock_context.chat_data['lmw_game']
+    assert game_data['start_message_id'] == 200
+    assert game_data['deadline'] == GAME_START + timedelta(seconds=last_message_wins_game.LMW_GAME_DURATION)
     mock_context.job_queue.run_once.assert_called_once_with(
-        last_message_wins_game.end_lmw_game,
-        last_message_wins_game.LMW_GAME_DURATION,
+        ANY,
+        last_message_wins_game.LMW_GAME_DURATION + last_message_wins_game.LMW_GRACE_PERIOD,
         data={'chat_id': -12345, 'countdown_message_id': 200},
         chat_id=-12345,
         name='lmw_end_game_-12345'
     )
+    callback = mock_context.job_queue.run_once.call_args.args[0]
+    assert callback.__wrapped__ is last_message_wins_game.end_lmw_game
+    assert callback.cost_origin == 'job:lmw_end_game'  # Not whichever update re-armed the scheduler
     assert mock_context.bot.send_message.called
 
 @pytest.mark.asyncio
@@ -180,22 +257,38 @@ async def test_end_lmw_game_with_winner(mock_context, mock_db_add_xp):
     xp_pot = 50
     mock_context.chat_data['lmw_game'] = {
         'status': 'in_progress',
+        'players': {winner_id: {'username': winner_username, 'mention': 'Winner Mention'}},
         'last_message_info': {'user_id': winner_id, 'username': winner_username, 'message_id': 999},
         'xp_pot': xp_pot
     }
-    
-    # Mock get_chat_member to return a mock user object
-    mock_chat_member = MagicMock()
-    mock_chat_member.user.mention_html.return_value = "Winner Mention"
-    mock_context.bot.get_chat_member.return_value = mock_chat_member
 
     await last_message_wins_game.end_lmw_game(mock_context)
 
-    mock_db_add_xp.assert_called_once_with(mock_context.bot_data['db'], winner_id, winner_username, xp_pot)
+    mock_db_add_xp.assert_called_once_with(mock_context.bot_data['db'], winner_id, winner_username, xp_pot, reason='lmw_win')
     mock_context.bot.send_message.assert_called_once()
     assert "The winner is Winner Mention" in mock_context.bot.send_message.call_args.kwargs['text']
+    mock_context.bot.get_chat_member.assert_not_called()
     assert 'lmw_game' not in mock_context.chat_data # Check cleanup
 
+@pytest.mark.asyncio
+async def test_end_lmw_game_cleans_up_when_announcement_fails(mock_context, mock_db_add_xp):
+    """Test that a failed winner announcement still awards the pot and frees the chat."""
+    from game_logic.registry import LAST_MESSAGE_WINS, get_registry
+    get_registry(mock_context.bot_data).register(-12345, LAST_MESSAGE_WINS, route_messages=True)
+    mock_context.chat_data['lmw_game'] = {
+        'status': 'in_progress',
+        'players': {1: {'username': 'winner', 'mention': 'Winner Mention'}},
+        'last_message_info': {'user_id': 1, 'username': 'winner', 'message_id': 999},
+        'xp_pot': 50
+    }
+    mock_context.bot.send_message.side_effect = Exception("Telegram is down")
+
+    await last_message_wins_game.end_lmw_game(mock_context)
+
+    mock_db_add_xp.assert_awaited_once()
+    assert 'lmw_game' not in mock_context.chat_data
+    assert not get_registry(mock_context.bot_data).has_game(-12345, LAST_MESSAGE_WINS)
+
 @pytest.mark.asyncio
 async def test_end_lmw_game_no_winner(mock_context, mock_db_add_xp):
     """Test ending the game with no winner."""
@@ -213,3 +306,30 @@ async def test_end_lmw_game_no_winner(mock_context, mock_db_add_xp):
     mock_context.bot.edit_message_text.assert_called_once()
     assert "No one sent a message" in mock_context.bot.edit_message_text.call_args.kwargs['text']
     assert 'lmw_game' not in mock_context.chat_data
+
+@pytest.mark.asyncio
+async def test_cancel_game_refunds_players(mock_context, mock_db_add_xp):
+    """Test that an admin cancelling the game refunds each entry and clears the lobby buttons."""
+    from game_logic.registry import LAST_MESSAGE_WINS, get_registry
+    get_registry(mock_context.bot_data).register(-12345, LAST_MESSAGE_WINS)
+    mock_context.chat_data['lmw_game'] = {
+        'status': 'lobby',
+        'players': {1: {'username': 'alice', 'mention': 'Alice'}, 2: {'username': 'bob', 'mention': 'Bob'}},
+        'message_id': 300,
+        'xp_pot': 4,
+        'last_message_info': {'user_id': None},
+    }
+    mock_context.job_queue.get_jobs_by_name.return_value = []
+
+    await last_message_wins_game.cancel_game(mock_context, -12345)
+
+    cost = last_message_wins_game.LMW_ENTRY_COST
+    assert mock_db_add_xp.await_args_list == [
+        ((mock_context.bot_data['db'], 1, 'alice', cost), {'reason': 'lmw_refund'}),
+        ((mock_context.bot_data['db'], 2, 'bob', cost), {'reason': 'lmw_refund'}),
+    ]
+    mock_context.bot.edit_message_text.assert_awaited_once()
+    edit = mock_context.bot.edit_message_text.call_args.kwargs
+    assert edit['message_id'] == 300 and edit['reply_markup'] is None and 'cancelled' in edit['text']
+    assert 'lmw_game' not in mock_context.chat_data
+    assert not get_registry(mock_context.bot_data).has_game(-12345, LAST_MESSAGE_WINS)
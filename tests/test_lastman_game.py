@@ -113,7 +113,7 @@ async def test_lastman_callback_handler_join_success(mock_update, mock_context):
         'message_id': 100,
         'job': None
     }
-    mock_update.callback_query.data = 'lastman_join'
+    mock_update.callback_query.data = lastman_game.LASTMAN_JOIN_DATA
     mock_update.callback_query.from_user.id = 1
     mock_update.callback_query.from_user.username = 'testuser1'
     mock_update.callback_query.from_user.first_name = 'Test'
@@ -128,6 +128,19 @@ async def test_lastman_callback_handler_join_success(mock_update, mock_context):
     assert len(mock_context.chat_data['lastman_game']['players']) == 2
 
 
+@pytest.mark.asyncio
+async def test_lastman_callback_handler_join_with_legacy_button(mock_update, mock_context):
+    """Test that a Join button sent before the game:action encoding still joins the lobby."""
+    mock_context.chat_data['lastman_game'] = {'status': 'lobby', 'players': {}, 'message_id': 100, 'job': None}
+    mock_update.callback_query.data = 'lastman_join'
+    mock_update.callback_query.from_user.id = 1
+    mock_update.callback_query.from_user.username = 'testuser1'
+
+    await lastman_game.lastman_callback_handler(mock_update, mock_context)
+
+    assert 1 in mock_context.chat_data['lastman_game']['players']
+
+
 @pytest.mark.asyncio
 async def test_lastman_callback_handler_join_game_started(mock_update, mock_context):
     """Test trying to join via callback when game has started."""
@@ -137,7 +150,7 @@ async def test_lastman_callback_handler_join_game_started(mock_update, mock_cont
         'message_id': 100,
         'job': None
     }
-    mock_update.callback_query.data = 'lastman_join'
+    mock_update.callback_query.data = lastman_game.LASTMAN_JOIN_DATA
     mock_update.callback_query.from_user.id = 2 # New user trying to join
 
     await lastman_game.lastman_callback_handler(mock_update, mock_context)
@@ -157,7 +170,7 @@ async def test_lastman_callback_handler_start_insufficient_players(mock_update,
         'message_id': 100,
         'job': None
     }
-    mock_update.callback_query.data = 'lastman_start'
+    mock_update.callback_query.data = lastman_game.LASTMAN_START_DATA
 
     await lastman_game.lastman_callback_handler(mock_update, mock_context)
     # query.answer() is called once initially, then again for the alert
@@ -181,7 +194,7 @@ async def test_lastman_callback_handler_start_success(mock_update, mock_context,
         'message_id': 100,
         'job': None
     }
-    mock_update.callback_query.data = 'lastman_start'
+    mock_update.callback_query.data = lastman_game.LASTMAN_START_DATA
     
     # Patch start_elimination_phase to prevent actual job scheduling during unit test
     mocker.patch('handlers.lastman_game.start_elimination_phase', new_callable=AsyncMock)
@@ -274,6 +287,6 @@ async def test_end_lastman_game(mock_db_add_xp, mock_update, mock_context):
     assert "They each earned 5 XP!" in mock_context.bot.send_message.call_args.kwargs['text']
     assert 'lastman_game' not in mock_context.chat_data # Game data should be cleared
     assert mock_db_add_xp.call_count == 3
-    mock_db_add_xp.assert_any_call(mock_context.bot_data['db'], 1, 'winner1', 5)
-    mock_db_add_xp.assert_any_call(mock_context.bot_data['db'], 2, 'winner2', 5)
-    mock_db_add_xp.assert_any_call(mock_context.bot_data['db'], 3, 'winner3', 5)
+    mock_db_add_xp.assert_any_call(mock_context.bot_data['db'], 1, 'winner1', 5, reason='lastman_award')
+    mock_db_add_xp.assert_any_call(mock_context.bot_data['db'], 2, 'winner2', 5, reason='lastman_award')
+    mock_db_add_xp.assert_any_call(mock_context.bot_data['db'], 3, 'winner3', 5, reason='lastman_award')
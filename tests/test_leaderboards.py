@@ -0,0 +1,347 @@
+import asyncio
+import pytest
+from datetime import date, timedelta
+from unittest.mock import MagicMock
+
+import leaderboards
+from leaderboards import ChatLeaderboards, LeaderboardPager, RankIndex, WindowedLeaderboard
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def _ranked(count):
+    """Builds (entries, cursors) for `count` users ranked by descending XP."""
+    entries = [(f'user{i}', 1000 - i) for i in range(count)]
+    cursors = [f'cursor{i}' for i in range(count)]
+    return entries, cursors
+
+@pytest.fixture
+def ranked_users(mocker):
+    """Serves get_leaderboard_page from an in-memory ranking of 35 users."""
+    entries, cursors = _ranked(35)
+
+    def fake_page(db_client, limit, start_after=None):
+        start = 0 if start_after is None else cursors.index(start_after) + 1
+        return entries[start:start + limit], cursors[start:start + limit]
+
+    return mocker.patch('database.get_leaderboard_page', side_effect=fake_page)
+
+@pytest.mark.asyncio
+async def test_pages_within_snapshot_use_one_query(ranked_users):
+    """Test that pages inside the snapshot are sliced from memory."""
+    pager = LeaderboardPager(page_size=5, snapshot_size=20, clock=FakeClock())
+
+    first = await pager.get_page(MagicMock(), 0)
+    third = await pager.get_page(MagicMock(), 2)
+
+    assert first.entries[0] == ('user0', 1000)
+    assert first.start_rank == 1 and first.has_next and not first.has_prev
+    assert third.entries[0] == ('user10', 990)
+    assert third.start_rank == 11
+    assert ranked_users.call_count == 1
+
+@pytest.mark.asyncio
+async def test_pages_beyond_snapshot_use_cursors(ranked_users):
+    """Test that deep pages start after the cached cursor instead of re-reading from rank 1."""
+    pager = LeaderboardPager(page_size=5, snapshot_size=20, clock=FakeClock())
+
+    page = await pager.get_page(MagicMock(), 4)
+
+    assert page.entries[0] == ('user20', 980)
+    assert page.has_next
+    assert ranked_users.call_args.args[1:] == (6, 'cursor19')
+
+    ranked_users.reset_mock()
+    next_page = await pager.get_page(MagicMock(), 5)
+    assert next_page.entries[0] == ('user25', 975)
+    assert ranked_users.call_args.args[1:] == (6, 'cursor24')
+    assert ranked_users.call_count == 1
+
+@pytest.mark.asyncio
+async def test_last_page_has_no_next(ranked_users):
+    """Test that the final page and pages past the end report no next page."""
+    pager = LeaderboardPager(page_size=5, snapshot_size=20, clock=FakeClock())
+
+    last = await pager.get_page(MagicMock(), 6)
+    calls_to_last_page = ranked_users.call_count
+    past_end = await pager.get_page(MagicMock(), 9)
+
+    assert last.entries == [(f'user{i}', 1000 - i) for i in range(30, 35)]
+    assert not last.has_next
+    assert past_end.entries == []
+    assert not past_end.has_next
+    assert ranked_users.call_count == calls_to_last_page
+
+@pytest.mark.asyncio
+async def test_complete_snapshot(mocker):
+    """Test that a snapshot holding every user never queries past it."""
+    mock_page = mocker.patch('database.get_leaderboard_page', return_value=_ranked(7))
+    pager = LeaderboardPager(page_size=5, snapshot_size=20, clock=FakeClock())
+
+    second = await pager.get_page(MagicMock(), 1)
+    third = await pager.get_page(MagicMock(), 2)
+
+    assert second.entries == _ranked(7)[0][5:]
+    assert not second.has_next
+    assert third.entries == []
+    assert mock_page.call_count == 1
+
+@pytest.mark.asyncio
+async def test_snapshot_refresh_bumps_version(ranked_users):
+    """Test that an expired snapshot is re-read and the previous version stays browsable."""
+    clock = FakeClock()
+    pager = LeaderboardPager(page_size=5, snapshot_size=20, ttl=60, clock=clock)
+
+    first = await pager.get_page(MagicMock(), 0)
+    clock.now = 61
+    refreshed = await pager.get_page(MagicMock(), 1)
+    old_version_page = await pager.get_page(MagicMock(), 0, version=first.version)
+
+    assert refreshed.version == first.version + 1
+    assert old_version_page is first
+    assert ranked_users.call_count == 2
+
+@pytest.mark.asyncio
+async def test_invalidate_forces_new_snapshot(ranked_users):
+    """Test that invalidate() makes the next request take a fresh snapshot."""
+    pager = LeaderboardPager(page_size=5, snapshot_size=20, clock=FakeClock())
+
+    await pager.get_page(MagicMock(), 0)
+    pager.invalidate()
+    page = await pager.get_page(MagicMock(), 0)
+
+    assert page.version == 2
+    assert ranked_users.call_count == 2
+
+def test_snapshot_size_must_be_page_multiple():
+    with pytest.raises(ValueError):
+        LeaderboardPager(page_size=10, snapshot_size=25)
+
+@pytest.mark.asyncio
+async def test_forged_deep_page_is_capped(ranked_users):
+    """Test that a forged page number cannot walk cursors past max_page."""
+    pager = LeaderboardPager(page_size=5, snapshot_size=10, clock=FakeClock(), max_page=3)
+
+    page = await pager.get_page(MagicMock(), 10_000)
+
+    assert page.page == 3 and page.entries[0] == ('user15', 985)
+    assert not page.has_next
+    assert ranked_users.call_count == 3  # The snapshot, then pages 2 and 3
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_one_refresh(ranked_users):
+    """Test that requests arriving together wait for one snapshot instead of each taking their own."""
+    import asyncio
+
+    pager = LeaderboardPager(page_size=5, snapshot_size=20, clock=FakeClock())
+
+    first, second = await asyncio.gather(pager.get_page(MagicMock(), 0), pager.get_page(MagicMock(), 1))
+
+    assert first.version == second.version
+    assert ranked_users.call_count == 1
+
+def test_get_pager_creates_once():
+    bot_data = {}
+    pager = leaderboards.get_pager(bot_data)
+
+    assert bot_data['leaderboard_pager'] is pager
+    assert leaderboards.get_pager(bot_data) is pager
+
+
+def test_rank_index_top():
+    """Test that the index returns the highest scores first."""
+    index = RankIndex()
+    index.set(1, 'a', 5)
+    index.set(2, 'b', 9)
+    index.add(3, 'c', 4)
+    index.add(3, 'c', 4)
+    index.set(4, 'd', 1)
+    index.discard(4)
+
+    assert index.top(2) == [('b', 9), ('c', 8)]
+    assert index.score(3) == 8
+    assert len(index) == 3
+
+@pytest.mark.asyncio
+async def test_chat_leaderboard_seeds_once(mocker):
+    """Test that a chat's index is read from Firestore once and then kept up to date."""
+    mock_seed = mocker.patch('database.get_chat_leaderboard', return_value=[(1, 'a', 30), (2, 'b', 20)])
+    chat_leaderboards = ChatLeaderboards(seed_size=50)
+
+    assert await chat_leaderboards.top(MagicMock(), -100, 10) == [('a', 30), ('b', 20)]
+    chat_leaderboards.record(-100, 3, 'c', 25)
+    chat_leaderboards.record(-100, 2, 'b', 31)
+
+    assert await chat_leaderboards.top(MagicMock(), -100, 2) == [('b', 31), ('a', 30)]
+    assert mock_seed.call_count == 1
+    assert mock_seed.call_args.args[1:] == (-100, 50)
+
+@pytest.mark.asyncio
+async def test_chat_leaderboard_ignores_unseeded_chats(mocker):
+    """Test that writes to chats nobody has queried do not build indexes."""
+    mocker.patch('database.get_chat_leaderboard', return_value=[(1, 'a', 30)])
+    chat_leaderboards = ChatLeaderboards()
+
+    chat_leaderboards.record(-100, 1, 'a', 29)
+
+    assert await chat_leaderboards.top(MagicMock(), -100, 10) == [('a', 30)]
+
+
+class FakeToday:
+    def __init__(self, day):
+        self.day = day
+
+    def __call__(self):
+        return self.day
+
+@pytest.mark.asyncio
+async def test_windowed_leaderboard_sums_window(mocker):
+    """Test that rolling windows sum seeded buckets and new deltas."""
+    today = FakeToday(date(2024, 3, 10))
+    seeded = {
+        '2024-03-10': [(1, 'a', 5)],
+        '2024-03-08': [(2, 'b', 20), (1, 'a', 4)],
+        '2024-03-01': [(3, 'c', 100)],  # Outside the week
+    }
+    mocker.patch('database.get_daily_xp', side_effect=lambda db_client, day: seeded.get(day, []))
+    windowed = WindowedLeaderboard(max_days=7, today=today)
+
+    assert await windowed.top(MagicMock(), 10, 7) == [('b', 20), ('a', 9)]
+    windowed.record(1, 'a', 12)
+
+    assert await windowed.top(MagicMock(), 10, 7) == [('a', 21), ('b', 20)]
+    assert await windowed.top(MagicMock(), 10, 1) == [('a', 17)]
+
+@pytest.mark.asyncio
+async def test_windowed_leaderboard_counts_pending_deltas_once(mocker):
+    """Test that deltas recorded before seeding are counted exactly once."""
+    today = FakeToday(date(2024, 3, 10))
+    mocker.patch('database.get_daily_xp', return_value=[])
+    windowed = WindowedLeaderboard(max_days=7, today=today)
+
+    windowed.record(1, 'a', 3)
+    windowed.record(1, None, 2)
+
+    assert await windowed.top(MagicMock(), 10, 1) == [('a', 5)]
+
+@pytest.mark.asyncio
+async def test_windowed_leaderboard_flush_batches_pending(mocker):
+    """Test that pending deltas are written together and cleared."""
+    today = FakeToday(date(2024, 3, 10))
+    mock_flush = mocker.patch('database.flush_daily_xp', side_effect=lambda db_client, items: len(items))
+    windowed = WindowedLeaderboard(max_days=7, today=today)
+
+    windowed.record(1, 'a', 3)
+    windowed.record(2, 'b', 1)
+    windowed.record(1, 'a', 2)
+    await windowed.flush(MagicMock())
+    await windowed.flush(MagicMock())  # Nothing left to write
+
+    mock_flush.assert_called_once()
+    assert sorted(mock_flush.call_args.args[1]) == [
+        (('2024-03-10', 1), (5, 'a')),
+        (('2024-03-10', 2), (1, 'b')),
+    ]
+
+@pytest.mark.asyncio
+async def test_windowed_leaderboard_requeues_failed_flush(mocker):
+    """Test that deltas that could not be written are retried on the next flush."""
+    today = FakeToday(date(2024, 3, 10))
+    mock_flush = mocker.patch('database.flush_daily_xp', return_value=0)
+    windowed = WindowedLeaderboard(max_days=7, today=today)
+
+    windowed.record(1, 'a', 3)
+    await windowed.flush(MagicMock())
+    windowed.record(1, 'a', 1)
+    mock_flush.return_value = 1
+    await windowed.flush(MagicMock())
+
+    assert mock_flush.call_args.args[1] == [(('2024-03-10', 1), (4, 'a'))]
+
+@pytest.mark.asyncio
+async def test_windowed_leaderboard_rolls_over_days(mocker):
+    """Test that buckets older than the longest window are dropped."""
+    today = FakeToday(date(2024, 3, 10))
+    mocker.patch('database.get_daily_xp', return_value=[])
+    windowed = WindowedLeaderboard(max_days=2, today=today)
+
+    await windowed.top(MagicMock(), 10, 2)
+    windowed.record(1, 'a', 3)
+    today.day += timedelta(days=1)
+    windowed.record(2, 'b', 1)
+
+    assert await windowed.top(MagicMock(), 10, 2) == [('a', 3), ('b', 1)]
+    today.day += timedelta(days=1)
+    assert await windowed.top(MagicMock(), 10, 2) == [('b', 1)]
+
+@pytest.mark.asyncio
+async def test_windowed_leaderboard_retries_failed_seed(mocker):
+    """Test that a failed daily read leaves the buckets unseeded so the next query loads the whole window."""
+    today = FakeToday(date(2024, 3, 10))
+    failing = {'2024-03-08'}
+    mocker.patch('database.get_daily_xp', side_effect=lambda db_client, day: None if day in failing else (
+        [(2, 'b', 20)] if day == '2024-03-08' else []))
+    windowed = WindowedLeaderboard(max_days=7, today=today)
+
+    assert await windowed.top(MagicMock(), 10, 7) is None
+    windowed.record(1, 'a', 3)
+    failing.clear()
+
+    assert await windowed.top(MagicMock(), 10, 7) == [('b', 20), ('a', 3)]
+
+@pytest.mark.asyncio
+async def test_chat_leaderboard_record_delta(mocker):
+    """Test that ledger deltas update members in place, including ones the seed did not include."""
+    seed = mocker.patch('database.get_chat_leaderboard', return_value=[(1, 'alice', 10), (2, 'bob', 8)])
+    boards = ChatLeaderboards()
+    await boards.top(MagicMock(), -100, 10)
+
+    boards.record_delta(-100, 2, 'bob', 3)
+    assert await boards.top(MagicMock(), -100, 10) == [('bob', 11), ('alice', 10)]
+
+    # The whole chat fit in the seed, so a new member started from zero
+    boards.record_delta(-100, 3, 'carol', 1)
+    assert await boards.top(MagicMock(), -100, 10) == [('bob', 11), ('alice', 10), ('carol', 1)]
+    assert seed.call_count == 1
+
+@pytest.mark.asyncio
+async def test_chat_leaderboard_reseeds_when_unread_member_may_rank(mocker):
+    """Test that a member left out of a full seed only forces a re-read once they could reach the top N."""
+    members = [(1, 'a', 50), (2, 'b', 40), (3, 'c', 30)]
+    seed = mocker.patch('database.get_chat_leaderboard', return_value=members)
+    boards = ChatLeaderboards(seed_size=3)
+    await boards.top(MagicMock(), -100, 1)
+
+    boards.record_delta(-100, 9, 'outsider', 5)  # At most 30 + 5, short of first place
+    assert await boards.top(MagicMock(), -100, 1) == [('a', 50)]
+    assert seed.call_count == 1
+
+    boards.record_delta(-100, 9, 'outsider', 20)  # May now be up to 55
+    seed.return_value = [(9, 'outsider', 55), (1, 'a', 50), (2, 'b', 40)]
+    assert await boards.top(MagicMock(), -100, 1) == [('outsider', 55)]
+    assert seed.call_count == 2
+
+@pytest.mark.asyncio
+async def test_chat_leaderboard_shares_one_seed(mocker):
+    """Test that concurrent first queries for a chat wait on the same read."""
+    seed = mocker.patch('database.get_chat_leaderboard', return_value=[(1, 'a', 30)])
+    boards = ChatLeaderboards()
+
+    first, second = await asyncio.gather(boards.top(MagicMock(), -100, 10), boards.top(MagicMock(), -100, 10))
+
+    assert first == second == [('a', 30)]
+    assert seed.call_count == 1
+
+@pytest.mark.asyncio
+async def test_chat_leaderboard_retries_failed_seed(mocker):
+    """Test that a failed seed is not kept, so the next query reads again."""
+    seed = mocker.patch('database.get_chat_leaderboard', return_value=None)
+    boards = ChatLeaderboards()
+
+    assert await boards.top(MagicMock(), -100, 10) is None
+    seed.return_value = [(1, 'a', 30)]
+    assert await boards.top(MagicMock(), -100, 10) == [('a', 30)]
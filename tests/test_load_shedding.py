@@ -0,0 +1,120 @@
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock
+from telegram import Update
+from telegram.ext import CallbackContext
+
+import load_shedding
+from handlers import messages
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def sent_at(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+def test_update_lag_raises_and_recovers_with_hysteresis():
+    """Test that lag past the threshold coalesces, far past drops, and recovery needs to fall well below."""
+    clock = FakeClock()
+    monitor = load_shedding.LagMonitor(update_lag_threshold=5, clock=clock)
+    monitor.update_lag = 6
+    monitor.record_update(sent_at(clock.now - 6))
+    assert monitor.level == load_shedding.COALESCE
+
+    monitor.update_lag = 25
+    monitor.record_update(sent_at(clock.now - 25))
+    assert monitor.level == load_shedding.DROP
+
+    monitor.update_lag = 3
+    monitor.record_update(sent_at(clock.now - 3))
+    assert monitor.level == load_shedding.COALESCE  # Between the recovery ratio and the threshold
+
+    monitor.update_lag = 1
+    monitor.record_update(sent_at(clock.now - 1))
+    assert monitor.level == load_shedding.NORMAL
+
+def test_idle_update_lag_resets():
+    """Test that update lag counts as caught up once messages stop arriving."""
+    clock = FakeClock()
+    monitor = load_shedding.LagMonitor(update_lag_threshold=5, clock=clock)
+    monitor.update_lag = 10
+    monitor.record_update(sent_at(clock.now - 10))
+    assert monitor.level == load_shedding.COALESCE
+
+    clock.now += load_shedding.UPDATE_LAG_IDLE_RESET
+    monitor.record_loop_lag(0)
+
+    assert monitor.update_lag == 0
+    assert monitor.level == load_shedding.NORMAL
+
+def test_loop_lag_triggers_shedding():
+    """Test that event loop lag alone can start shedding."""
+    monitor = load_shedding.LagMonitor(loop_lag_threshold=0.1)
+    monitor.loop_lag = 0.2
+    monitor.record_loop_lag(0.2)
+
+    assert monitor.level == load_shedding.COALESCE
+
+def _message_update():
+    update = AsyncMock(spec=Update)
+    update.effective_user.id = 7
+    update.effective_user.username = "chatter"
+    update.message = AsyncMock()
+    update.message.text = "hello"
+    update.effective_chat.id = -100
+    update.effective_chat.type = 'group'
+    return update
+
+@pytest.mark.asyncio
+async def test_handle_message_coalesces_while_behind(mocker):
+    """Test that messages handled while behind are summed and written once per user and chat."""
+    context = MagicMock(spec=CallbackContext)
+    context.bot_data = {'db': MagicMock()}
+    load_shedding.get_lag_monitor(context.bot_data).level = load_shedding.COALESCE
+    mocker.patch('database.append_xp', return_value=False)
+    add_xp = mocker.patch('database.add_xp', new_callable=AsyncMock, return_value={'xp': 3, 'chat_xp': 3})
+
+    for _ in range(3):
+        await messages.handle_message(_message_update(), context)
+    add_xp.assert_not_called()
+
+    assert await load_shedding.get_xp_coalescer(context.bot_data).flush(context.bot_data) == 1
+    add_xp.assert_called_once_with(context.bot_data['db'], 7, "chatter", 3, chat_id=-100, reason='message')
+
+@pytest.mark.asyncio
+async def test_handle_message_drops_xp_far_behind(mocker):
+    """Test that no XP work is done for messages while dropping."""
+    context = MagicMock(spec=CallbackContext)
+    context.bot_data = {'db': MagicMock()}
+    load_shedding.get_lag_monitor(context.bot_data).level = load_shedding.DROP
+    append_xp = mocker.patch('database.append_xp')
+    add_xp = mocker.patch('database.add_xp', new_callable=AsyncMock)
+
+    await messages.handle_message(_message_update(), context)
+
+    append_xp.assert_not_called()
+    add_xp.assert_not_called()
+    assert len(load_shedding.get_xp_coalescer(context.bot_data)) == 0
+
+@pytest.mark.asyncio
+async def test_edited_messages_do_not_count_as_lag(mocker):
+    """Test that an edit, which carries its original send time, is not taken for a backlog."""
+    import bot_main
+    mocker.patch('handlers.messages.handle_message', new_callable=AsyncMock)
+    context = MagicMock(spec=CallbackContext)
+    context.bot_data = {'db': MagicMock()}
+    update = MagicMock(spec=Update)
+    update.message = None
+    update.edited_message.date = sent_at(0)
+    update.edited_message.edit_date = datetime.now(timezone.utc)
+    update.effective_message = update.edited_message
+    update.effective_chat.id = -100
+    update.effective_user.id = 7
+
+    await bot_main.main_message_handler(update, context)
+
+    assert load_shedding.get_lag_monitor(context.bot_data).update_lag == 0.0
@@ -0,0 +1,63 @@
+import logging
+import pytest
+import structlog
+
+import logging_config
+
+def test_event_sampler_keeps_listed_fraction():
+    """Test that listed events are dropped unless the draw falls under their rate."""
+    draws = iter([0.5, 0.005])
+    sampler = logging_config.EventSampler({'Awarding XP': 0.01}, random_source=lambda: next(draws))
+
+    with pytest.raises(structlog.DropEvent):
+        sampler(None, 'info', {'event': 'Awarding XP'})
+    assert sampler(None, 'info', {'event': 'Awarding XP'}) == {'event': 'Awarding XP'}
+    assert sampler(None, 'info', {'event': 'Game won'}) == {'event': 'Game won'}
+
+def test_parse_sample_rates():
+    """Test that LOG_SAMPLING entries are parsed and malformed ones skipped."""
+    assert logging_config.parse_sample_rates('User made a guess=0.1; LMW lobby updated=0.5;bad;=1') == {
+        'User made a guess': 0.1, 'LMW lobby updated': 0.5,
+    }
+
+def test_queue_handler_keeps_event_dict():
+    """Test that records reach the listener with the event dict intact for rendering there."""
+    record = logging.LogRecord('x', logging.INFO, __file__, 1, {'event': 'hello'}, None, None)
+
+    assert logging_config._EventQueueHandler(None).prepare(record).msg == {'event': 'hello'}
+
+def test_shift_log_level_is_clamped():
+    """Test that signal-driven level changes step through the levels and stop at the ends."""
+    root = logging.getLogger()
+    previous = root.level
+    try:
+        root.setLevel(logging.INFO)
+        logging_config._shift_log_level(-1)
+        assert root.level == logging.DEBUG
+        logging_config._shift_log_level(-1)
+        assert root.level == logging.DEBUG
+        logging_config._shift_log_level(2)
+        assert root.level == logging.WARNING
+    finally:
+        root.setLevel(previous)
+
+def test_logged_exception_keeps_traceback():
+    """Test that logger.exception's traceback is captured on the calling thread, not lost on the listener."""
+    import io
+    import json
+
+    logging_config.setup_logging()
+    output = io.StringIO()
+    logging_config._listener.handlers[0].setStream(output)
+    try:
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            structlog.get_logger('test_logging_config').exception("Something failed")
+        logging_config._stop_listener()  # Drains the queue
+
+        event = json.loads(output.getvalue().splitlines()[-1])
+        assert event['event'] == "Something failed"
+        assert 'ValueError: boom' in event['exception']
+    finally:
+        logging_config.setup_logging()
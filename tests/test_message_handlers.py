@@ -4,6 +4,7 @@ from telegram import Update
 from telegram.ext import CallbackContext
 from handlers import messages
 import database
+import leaderboards
 
 @pytest.mark.asyncio
 async def test_handle_message_awards_xp(mocker):
@@ -14,15 +15,81 @@ async def test_handle_message_awards_xp(mocker):
     update.effective_user.username = "test_username"
     update.message = AsyncMock()
     update.message.text = "This is a regular message."
+    update.effective_chat.id = -100
+    update.effective_chat.type = 'group'
 
     context = MagicMock(spec=CallbackContext)
     mock_db_client = MagicMock()
     context.bot_data = {'db': mock_db_client}
 
-    mock_add_xp = mocker.patch('database.add_xp', new_callable=AsyncMock)
+    mock_add_xp = mocker.patch('database.add_xp', new_callable=AsyncMock, return_value={'xp': 5, 'chat_xp': 3})
 
     # Act
     await messages.handle_message(update, context)
 
     # Assert
-    mock_add_xp.assert_called_once_with(mock_db_client, "test_user", "test_username", 1)
+    mock_add_xp.assert_called_once_with(mock_db_client, "test_user", "test_username", 1, chat_id=-100, reason='message')
+
+@pytest.mark.asyncio
+async def test_handle_message_updates_chat_leaderboard(mocker):
+    """Test that the per-chat total returned by the write lands in the chat's index."""
+    update = AsyncMock(spec=Update)
+    update.effective_user.id = 7
+    update.effective_user.username = "chatter"
+    update.message = AsyncMock()
+    update.message.text = "hello"
+    update.effective_chat.id = -100
+    update.effective_chat.type = 'group'
+
+    context = MagicMock(spec=CallbackContext)
+    context.bot_data = {'db': MagicMock()}
+    chat_leaderboards = leaderboards.get_chat_leaderboards(context.bot_data)
+    mocker.patch('database.get_chat_leaderboard', return_value=[(8, 'other', 10)])
+    await chat_leaderboards.top(context.bot_data['db'], -100, 10)  # Seed the index
+
+    mocker.patch('database.add_xp', new_callable=AsyncMock, return_value={'xp': 50, 'chat_xp': 12})
+    await messages.handle_message(update, context)
+
+    assert await chat_leaderboards.top(context.bot_data['db'], -100, 10) == [('chatter', 12), ('other', 10)]
+
+@pytest.mark.asyncio
+async def test_handle_message_private_chat_has_no_chat_counter(mocker):
+    """Test that private chats only award global XP."""
+    update = AsyncMock(spec=Update)
+    update.effective_user.id = 7
+    update.effective_user.username = "chatter"
+    update.message = AsyncMock()
+    update.message.text = "hello"
+    update.effective_chat.type = 'private'
+
+    context = MagicMock(spec=CallbackContext)
+    context.bot_data = {'db': MagicMock()}
+    mock_add_xp = mocker.patch('database.add_xp', new_callable=AsyncMock, return_value={'xp': 5, 'chat_xp': None})
+
+    await messages.handle_message(update, context)
+
+    mock_add_xp.assert_called_once_with(context.bot_data['db'], 7, "chatter", 1, chat_id=None, reason='message')
+
+@pytest.mark.asyncio
+async def test_handle_message_appends_to_ledger(mocker):
+    """Test that with the XP ledger enabled messages append events instead of writing balances."""
+    update = AsyncMock(spec=Update)
+    update.effective_user.id = 7
+    update.effective_user.username = "chatter"
+    update.message = AsyncMock()
+    update.message.text = "hello"
+    update.effective_chat.id = -100
+    update.effective_chat.type = 'group'
+
+    context = MagicMock(spec=CallbackContext)
+    context.bot_data = {'db': MagicMock()}
+    mock_add_xp = mocker.patch('database.add_xp', new_callable=AsyncMock)
+    ledger = MagicMock()
+    database.set_xp_ledger(ledger)
+    try:
+        await messages.handle_message(update, context)
+    finally:
+        database.set_xp_ledger(None)
+
+    ledger.append.assert_called_once_with(7, "chatter", 1, 'message', chat_id=-100)
+    mock_add_xp.assert_not_called()
@@ -0,0 +1,108 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+import database
+import metrics
+from game_logic.registry import ActiveGameRegistry, GUESS_NUMBER, LAST_MAN_STANDING
+
+def test_histogram_renders_cumulative_buckets():
+    """Test that histogram samples are cumulative and end with +Inf, sum and count."""
+    histogram = metrics.Histogram('test_seconds', 'Test.', ['handler'], buckets=(0.1, 1.0))
+    histogram.observe(0.05, 'a')
+    histogram.observe(0.5, 'a')
+    histogram.observe(5, 'a')
+
+    assert histogram.render() == [
+        '# HELP test_seconds Test.',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{handler="a",le="0.1"} 1',
+        'test_seconds_bucket{handler="a",le="1.0"} 2',
+        'test_seconds_bucket{handler="a",le="+Inf"} 3',
+        'test_seconds_sum{handler="a"} 5.55',
+        'test_seconds_count{handler="a"} 3',
+    ]
+
+def test_counter_checks_labels():
+    """Test that counters add per label combination and reject the wrong number of labels."""
+    counter = metrics.Counter('test_total', 'Test.', ['method'])
+    counter.inc('sendMessage')
+    counter.inc('sendMessage', amount=2)
+
+    assert counter.value('sendMessage') == 3
+    assert counter.render()[-1] == 'test_total{method="sendMessage"} 3'
+    with pytest.raises(ValueError):
+        counter.inc()
+
+@pytest.mark.asyncio
+async def test_track_handler_counts_errors():
+    """Test that a failing handler is timed and counted as an error."""
+    handler = AsyncMock(side_effect=RuntimeError("boom"))
+    wrapped = metrics.timed_handler('test:failing', handler)
+
+    with pytest.raises(RuntimeError):
+        await wrapped(MagicMock(), MagicMock())
+
+    assert metrics.HANDLER_ERRORS.value('test:failing') == 1
+    assert metrics.HANDLER_LATENCY.count('test:failing') == 1
+
+@pytest.mark.asyncio
+async def test_instrumented_request_counts_by_method(mocker):
+    """Test that Bot API calls are counted by method and status code."""
+    mocker.patch('telegram.request.HTTPXRequest.do_request', new_callable=AsyncMock, return_value=(200, b'{}'))
+    request = metrics.InstrumentedRequest()
+    before = metrics.TELEGRAM_REQUESTS.value('getChatAdministrators', '200')
+
+    await request.do_request('https://api.telegram.org/bot123:ABC/getChatAdministrators', 'POST')
+
+    assert metrics.TELEGRAM_REQUESTS.value('getChatAdministrators', '200') == before + 1
+
+def test_count_games_by_state():
+    """Test that lobby games are counted by their status and other games as active."""
+    registry = ActiveGameRegistry()
+    registry.register(-1, LAST_MAN_STANDING)
+    registry.register(-2, LAST_MAN_STANDING)
+    registry.register(-1, GUESS_NUMBER, user_id=1)
+    application = MagicMock()
+    application.bot_data = {'games': registry}
+    application.chat_data = {-1: {'lastman_game': {'status': 'lobby'}}, -2: {'lastman_game': {'status': 'in_progress'}}}
+
+    assert metrics.count_games(application) == {
+        (LAST_MAN_STANDING, 'lobby'): 1, (LAST_MAN_STANDING, 'in_progress'): 1, (GUESS_NUMBER, 'active'): 1,
+    }
+
+def test_transaction_retries_counted(mocker):
+    """Test that transaction attempts beyond the first are counted per operation."""
+    def transactional(func):
+        def retrying(transaction, *args, **kwargs):
+            func(transaction, *args, **kwargs)  # first attempt hits contention
+            return func(transaction, *args, **kwargs)
+        return retrying
+    mocker.patch('database.firestore', MagicMock(transactional=transactional))
+    before = metrics.DB_RETRIES.value('_claim_timer_transaction')
+
+    database._claim_timer_transaction(MagicMock(), MagicMock(), 'timer', 'holder', 60.0)
+
+    assert metrics.DB_RETRIES.value('_claim_timer_transaction') == before + 1
+
+@pytest.mark.asyncio
+async def test_metrics_server_serves_registry():
+    """Test that the server answers GET /metrics with the rendered registry and 404 otherwise."""
+    registry = metrics.MetricsRegistry()
+    registry.register(metrics.Gauge('test_games', 'Test.', ['kind'], function=lambda: {('lmw',): 2}))
+    server = metrics.MetricsServer(0, registry=registry)
+    await server.start()
+    port = server._server.sockets[0].getsockname()[1]
+
+    async def get(path):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        response = await reader.read()
+        writer.close()
+        return response
+
+    try:
+        assert b'test_games{kind="lmw"} 2' in await get('/metrics')
+        assert (await get('/')).startswith(b'HTTP/1.1 404')
+    finally:
+        await server.stop()
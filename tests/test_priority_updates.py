@@ -0,0 +1,119 @@
+import asyncio
+import pytest
+from unittest.mock import MagicMock
+
+from game_logic.registry import ActiveGameRegistry, LAST_MESSAGE_WINS
+from priority_updates import (
+    CALLBACK, COMMAND, GAME, PASSIVE, PriorityUpdateProcessor, classify_update
+)
+
+def _update(chat_id=-100, user_id=1, text='hello', callback=False, edited=False):
+    update = MagicMock()
+    update.callback_query = MagicMock() if callback else None
+    update.effective_message.text = text
+    update.message = None if edited else update.effective_message
+    update.effective_chat.id = chat_id
+    update.effective_user.id = user_id
+    return update
+
+def test_classify_update():
+    """Test that updates are classed as callbacks, commands, game messages or passive messages."""
+    registry = ActiveGameRegistry()
+    registry.register(-1, LAST_MESSAGE_WINS, route_messages=True)
+
+    assert classify_update(_update(callback=True), registry) == CALLBACK
+    assert classify_update(_update(text='/endgame'), registry) == COMMAND
+    assert classify_update(_update(chat_id=-1), registry) == GAME
+    assert classify_update(_update(chat_id=-2), registry) == PASSIVE
+
+def test_classify_edits_and_non_text_messages():
+    """Test that edits and non-text messages queue behind commands unless a game is waiting for them."""
+    registry = ActiveGameRegistry()
+    registry.register(-1, LAST_MESSAGE_WINS, route_messages=True)
+
+    assert classify_update(_update(chat_id=-2, edited=True), registry) == PASSIVE
+    assert classify_update(_update(chat_id=-2, text='/endgame', edited=True), registry) == PASSIVE
+    assert classify_update(_update(chat_id=-2, text=None), registry) == PASSIVE
+    assert classify_update(_update(chat_id=-1, edited=True), registry) == GAME
+    not_a_message = _update()
+    not_a_message.effective_message = None
+    assert classify_update(not_a_message, registry) == COMMAND
+
+async def _run_backlog(processor, updates):
+    """Blocks the only slot, queues ``updates`` in order, then releases and records the handling order."""
+    order = []
+    gate = asyncio.Event()
+
+    async def blocker():
+        await gate.wait()
+
+    async def handle(name):
+        order.append(name)
+
+    first = asyncio.create_task(processor.process_update(_update(chat_id=0, callback=True), blocker()))
+    await asyncio.sleep(0)
+    tasks = [asyncio.create_task(processor.process_update(update, handle(name))) for name, update in updates]
+    await asyncio.sleep(0)
+    gate.set()
+    await asyncio.gather(first, *tasks)
+    return order
+
+@pytest.mark.asyncio
+async def test_higher_classes_served_first_without_starving_passive():
+    """Test that waiting commands and callbacks go ahead of passive messages, which still get their share."""
+    processor = PriorityUpdateProcessor(weights={CALLBACK: 2, COMMAND: 2, GAME: 2, PASSIVE: 1})
+    backlog = [(f'passive{i}', _update(chat_id=-i)) for i in range(3)]
+    backlog += [('command', _update(chat_id=-10, text='/endgame')), ('callback', _update(chat_id=-11, callback=True))]
+
+    order = await _run_backlog(processor, backlog)
+
+    assert order.index('command') < order.index('passive1')
+    assert order.index('callback') < order.index('passive1')
+    assert [name for name in order if name.startswith('passive')] == ['passive0', 'passive1', 'passive2']
+    assert processor.handled[PASSIVE] == 3
+    assert processor.depths() == {CALLBACK: 0, COMMAND: 0, GAME: 0, PASSIVE: 0}
+
+@pytest.mark.asyncio
+async def test_same_chat_never_runs_concurrently():
+    """Test that with several slots, updates from one chat still run one at a time."""
+    processor = PriorityUpdateProcessor(concurrency=4)
+    running = {}
+    overlaps = []
+
+    async def handle(chat_id):
+        running[chat_id] = running.get(chat_id, 0) + 1
+        if running[chat_id] > 1:
+            overlaps.append(chat_id)
+        await asyncio.sleep(0.01)
+        running[chat_id] -= 1
+
+    updates = [_update(chat_id=-(i % 2)) for i in range(6)]
+    await asyncio.gather(*(processor.process_update(update, handle(update.effective_chat.id)) for update in updates))
+
+    assert overlaps == []
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_gives_up_its_place():
+    """Test that a cancelled waiting update is removed and does not hold a slot."""
+    processor = PriorityUpdateProcessor()
+    gate = asyncio.Event()
+
+    async def blocker():
+        await gate.wait()
+
+    async def noop():
+        pass
+
+    first = asyncio.create_task(processor.process_update(_update(chat_id=0), blocker()))
+    await asyncio.sleep(0)
+    cancelled_coroutine = noop()
+    waiting = asyncio.create_task(processor.process_update(_update(chat_id=-1), cancelled_coroutine))
+    await asyncio.sleep(0)
+    waiting.cancel()
+    await asyncio.gather(waiting, return_exceptions=True)
+    cancelled_coroutine.close()
+    gate.set()
+    await first
+
+    await asyncio.wait_for(processor.process_update(_update(chat_id=-2), noop()), timeout=1)
+    assert processor.depths()[PASSIVE] == 0
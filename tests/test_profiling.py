@@ -0,0 +1,106 @@
+import asyncio
+import pstats
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+import profiling
+from handlers import diagnostics
+
+def _busy_work():
+    return sum(i * i for i in range(20000))
+
+async def _keep_busy(seconds):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + seconds
+    while loop.time() < deadline:
+        _busy_work()
+        await asyncio.sleep(0)
+
+@pytest.mark.asyncio
+async def test_cprofile_session_writes_pstats(tmp_path):
+    """Test that a cProfile session profiles the event loop thread and writes loadable stats."""
+    profiler = profiling.Profiler(directory=str(tmp_path))
+
+    session, _ = await asyncio.gather(profiler.run(profiling.CPROFILE, 1), _keep_busy(0.5))
+
+    assert session.path.endswith('.pstats')
+    functions = {name for _, _, name in pstats.Stats(session.path).stats}
+    assert '_busy_work' in functions
+    assert profiler.active is None and profiler.last is session
+
+@pytest.mark.asyncio
+async def test_sampling_session_writes_collapsed_stacks(tmp_path):
+    """Test that sampled stacks are written in the collapsed format, root first."""
+    profiler = profiling.Profiler(directory=str(tmp_path))
+
+    session, _ = await asyncio.gather(profiler.run(profiling.SAMPLING, 1), _keep_busy(0.9))
+
+    lines = open(session.path).read().splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(' ', 1)
+    assert int(count) >= 1
+    assert any('_busy_work' in line for line in lines)
+    assert not stack.startswith('_busy_work')
+
+@pytest.mark.asyncio
+async def test_only_one_session_runs_at_a_time(tmp_path):
+    """Test that a second session is refused while one is running, and that durations are capped."""
+    profiler = profiling.Profiler(directory=str(tmp_path))
+    running = asyncio.create_task(profiler.run(profiling.SAMPLING, 1))
+    await asyncio.sleep(0)
+
+    with pytest.raises(profiling.ProfilerError):
+        await profiler.run(profiling.CPROFILE, 1)
+    await running
+    assert profiling.clamp_seconds(10_000) == profiling.PROFILE_MAX_SECONDS
+    assert profiling.clamp_seconds(0) == 1
+
+@pytest.fixture
+def command_update():
+    update = MagicMock()
+    update.effective_user.id = 42
+    update.effective_chat.id = 42
+    update.message.reply_text = AsyncMock()
+    return update
+
+@pytest.fixture
+def command_context():
+    context = MagicMock()
+    context.bot_data = {}
+    context.bot.send_document = AsyncMock()
+    return context
+
+@pytest.mark.asyncio
+async def test_profile_command_refuses_non_operators(command_update, command_context, monkeypatch):
+    """Test that chat admins who are not bot operators cannot profile the bot."""
+    monkeypatch.setenv('BOT_ADMIN_IDS', '7, 8')
+    command_context.args = ['5']
+
+    await diagnostics.profile_bot(command_update, command_context)
+
+    command_update.message.reply_text.assert_awaited_once_with("This command can only be used by the bot's operators.")
+    command_context.application.create_task.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_profile_command_profiles_and_sends_file(command_update, command_context, monkeypatch, tmp_path):
+    """Test that an operator's session runs in the background and the file is sent when it ends."""
+    monkeypatch.setenv('BOT_ADMIN_IDS', '42')
+    command_context.bot_data['profiler'] = profiling.Profiler(directory=str(tmp_path))
+    command_context.args = ['1', 'cprofile']
+
+    await diagnostics.profile_bot(command_update, command_context)
+
+    command_update.message.reply_text.assert_awaited_once_with("Profiling the bot (cprofile) for 1 seconds...")
+    await command_context.application.create_task.call_args.args[0]
+    command_context.bot.send_document.assert_awaited_once()
+    assert command_context.bot.send_document.call_args.args == (42,)
+
+@pytest.mark.asyncio
+async def test_profile_command_rejects_unknown_mode(command_update, command_context, monkeypatch):
+    """Test that an unknown profiler mode gets the usage message."""
+    monkeypatch.setenv('BOT_ADMIN_IDS', '42')
+    command_context.args = ['5', 'perf']
+
+    await diagnostics.profile_bot(command_update, command_context)
+
+    command_update.message.reply_text.assert_awaited_once_with(diagnostics.PROFILE_USAGE)
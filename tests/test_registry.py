@@ -0,0 +1,95 @@
+import pytest
+from game_logic.registry import (
+    ActiveGameRegistry, GUESS_NUMBER, LAST_MAN_STANDING, LAST_MESSAGE_WINS, get_registry
+)
+
+@pytest.fixture
+def registry():
+    return ActiveGameRegistry()
+
+def test_route_empty_chat(registry):
+    """Test that chats without games route nowhere."""
+    assert registry.route(-1, 1) is None
+
+def test_route_chat_wide_game(registry):
+    """Test that a chat-wide game captures messages from every user in the chat."""
+    registry.register(-1, LAST_MESSAGE_WINS, route_messages=True)
+
+    assert registry.route(-1, 1) == LAST_MESSAGE_WINS
+    assert registry.route(-1, 2) == LAST_MESSAGE_WINS
+    assert registry.route(-2, 1) is None
+
+def test_route_player_game_takes_precedence(registry):
+    """Test that a player's own game wins over a chat-wide game."""
+    registry.register(-1, LAST_MESSAGE_WINS, route_messages=True)
+    registry.register(-1, GUESS_NUMBER, user_id=1, route_messages=True)
+
+    assert registry.route(-1, 1) == GUESS_NUMBER
+    assert registry.route(-1, 2) == LAST_MESSAGE_WINS
+
+def test_lobby_registration_does_not_route(registry):
+    """Test that games registered without routing are listed but do not capture messages."""
+    registry.register(-1, LAST_MAN_STANDING)
+
+    assert registry.route(-1, 1) is None
+    assert registry.games_in_chat(-1) == [(LAST_MAN_STANDING, None)]
+
+def test_register_again_enables_routing(registry):
+    """Test that re-registering a lobby game when it starts turns routing on."""
+    registry.register(-1, LAST_MESSAGE_WINS)
+    registry.register(-1, LAST_MESSAGE_WINS, route_messages=True)
+
+    assert registry.route(-1, 1) == LAST_MESSAGE_WINS
+    assert registry.games_in_chat(-1) == [(LAST_MESSAGE_WINS, None)]
+
+def test_unregister(registry):
+    """Test that unregistering removes both the listing and the route."""
+    registry.register(-1, GUESS_NUMBER, user_id=1, route_messages=True)
+    registry.register(-1, LAST_MAN_STANDING)
+
+    registry.unregister(-1, GUESS_NUMBER, user_id=1)
+    registry.unregister(-1, LAST_MESSAGE_WINS)  # Unknown games are ignored
+
+    assert registry.route(-1, 1) is None
+    assert registry.games_in_chat(-1) == [(LAST_MAN_STANDING, None)]
+    assert registry.has_game(-1, LAST_MAN_STANDING)
+    assert not registry.has_game(-1, GUESS_NUMBER, user_id=1)
+
+def test_count_by_kind(registry):
+    """Test counting active games across chats."""
+    registry.register(-1, GUESS_NUMBER, user_id=1, route_messages=True)
+    registry.register(-1, GUESS_NUMBER, user_id=2, route_messages=True)
+    registry.register(-2, LAST_MESSAGE_WINS)
+
+    assert registry.count_by_kind() == {GUESS_NUMBER: 2, LAST_MESSAGE_WINS: 1}
+
+def test_get_registry_creates_once():
+    """Test that get_registry stores a single registry in bot_data."""
+    bot_data = {}
+    registry = get_registry(bot_data)
+
+    assert bot_data['games'] is registry
+    assert get_registry(bot_data) is registry
+
+def test_export_and_import_chat(registry):
+    """Test that a chat's games round-trip through export_chat/import_chat, replacing what was there."""
+    registry.register(-1, LAST_MESSAGE_WINS, route_messages=True)
+    registry.register(-1, GUESS_NUMBER, user_id=1, route_messages=True)
+    registry.register(-1, LAST_MAN_STANDING)
+    exported = registry.export_chat(-1)
+
+    other = ActiveGameRegistry()
+    other.register(-1, LAST_MAN_STANDING, route_messages=True)
+    other.import_chat(-1, exported)
+
+    assert sorted(other.games_in_chat(-1), key=str) == sorted(registry.games_in_chat(-1), key=str)
+    assert other.route(-1, 1) == GUESS_NUMBER
+    assert other.route(-1, 2) == LAST_MESSAGE_WINS
+    assert ('lastman', None, False) in other.export_chat(-1)
+
+def test_games_lists_every_game(registry):
+    """Test that games() lists every registered game with its chat."""
+    registry.register(-1, LAST_MAN_STANDING)
+    registry.register(-2, GUESS_NUMBER, user_id=1, route_messages=True)
+
+    assert sorted(registry.games()) == [(-2, GUESS_NUMBER, 1), (-1, LAST_MAN_STANDING, None)]
@@ -0,0 +1,175 @@
+import pickle
+import pytest
+from unittest.mock import MagicMock
+from telegram.ext import Application
+
+import serverless
+from game_logic.registry import LAST_MESSAGE_WINS, get_registry
+from serverless import HandoffJobQueue, LeaseTimeout, chat_state, fire_due_timers
+
+async def timer_callback(context):
+    """Module-level so stored timers can resolve it by name."""
+    context.chat_data['fired_with'] = context.job.data
+
+@pytest.fixture
+def application():
+    application = Application.builder().token('123:ABC').updater(None).job_queue(HandoffJobQueue()).build()
+    application.bot_data['db'] = MagicMock()
+    return application
+
+@pytest.fixture
+def store(mocker):
+    """In-memory stand-ins for the Firestore state, lease and timer helpers."""
+    states = {}
+    timers = {}
+    mocker.patch('database.get_states', side_effect=lambda db_client, keys: {k: states[k] for k in keys if k in states})
+    set_states = mocker.patch('database.set_states', side_effect=lambda db_client, changed: states.update(changed))
+    mocker.patch('database.acquire_lease', return_value=True)
+    mocker.patch('database.release_lease')
+
+    def save_timers(db_client, scheduled, removed=()):
+        for name in removed:
+            timers.pop(name, None)
+        timers.update(scheduled)
+
+    def claim_due_timers(db_client, now, limit, holder, claim_ttl):
+        due = [dict(timer, name=name) for name, timer in timers.items() if timer['due_at'] <= now][:limit]
+        for timer in due:
+            timers[timer['name']] = dict(timers[timer['name']], due_at=now + claim_ttl, claimed_by=holder)
+        return due
+
+    def finish_timer(db_client, name, holder):
+        if timers.get(name, {}).get('claimed_by') == holder:
+            del timers[name]
+
+    mocker.patch('database.save_timers', side_effect=save_timers)
+    mocker.patch('database.claim_due_timers', side_effect=claim_due_timers)
+    mocker.patch('database.finish_timer', side_effect=finish_timer)
+    return {'states': states, 'timers': timers, 'set_states': set_states}
+
+@pytest.mark.asyncio
+async def test_state_round_trips_between_invocations(application, store):
+    """Test that chat data, user data and the chat's registry entries survive to the next invocation."""
+    async with chat_state(application, -100, 7):
+        application.chat_data[-100]['lmw_game'] = {'status': 'in_progress', 'pending_players': {7}}
+        application.user_data[7]['seen'] = True
+        get_registry(application.bot_data).register(-100, LAST_MESSAGE_WINS, route_messages=True)
+
+    # A fresh instance starts empty and loads what the first one saved
+    fresh = Application.builder().token('123:ABC').updater(None).job_queue(HandoffJobQueue()).build()
+    fresh.bot_data['db'] = MagicMock()
+    async with chat_state(fresh, -100, 7):
+        assert fresh.chat_data[-100]['lmw_game']['pending_players'] == {7}
+        assert fresh.user_data[7] == {'seen': True}
+        assert get_registry(fresh.bot_data).route(-100, 8) == LAST_MESSAGE_WINS
+
+@pytest.mark.asyncio
+async def test_unchanged_state_is_not_written(application, store):
+    """Test that invocations that leave state alone skip the write."""
+    async with chat_state(application, -100, 7):
+        application.chat_data[-100]['x'] = 1
+    store['set_states'].reset_mock()
+
+    async with chat_state(application, -100, 7):
+        pass
+
+    store['set_states'].assert_not_called()
+
+@pytest.mark.asyncio
+async def test_timers_are_handed_off_and_fired(application, store):
+    """Test that a timer scheduled in one invocation runs later with its chat's state."""
+    async with chat_state(application, -100, None):
+        application.chat_data[-100]['game'] = 'running'
+        application.job_queue.run_once(timer_callback, -1, data={'round': 2}, chat_id=-100, name='end_-100')
+
+    assert 'end_-100' in store['timers']
+    assert await fire_due_timers(application) == 1
+    assert store['timers'] == {}
+    saved = pickle.loads(store['states']['chat_-100']['state'])
+    assert saved['chat_data'] == {'game': 'running', 'fired_with': {'round': 2}}
+
+@pytest.mark.asyncio
+async def test_removed_timers_do_not_fire(application, store):
+    """Test that cancelling through get_jobs_by_name deletes the stored timer."""
+    async with chat_state(application, -100, None):
+        application.job_queue.run_once(timer_callback, -1, chat_id=-100, name='end_-100')
+    async with chat_state(application, -100, None):
+        for job in application.job_queue.get_jobs_by_name('end_-100'):
+            job.schedule_removal()
+
+    assert await fire_due_timers(application) == 0
+
+@pytest.mark.asyncio
+async def test_busy_chat_times_out(mocker, application, store):
+    """Test that a chat locked by another invocation fails fast enough for Telegram to retry."""
+    mocker.patch('database.acquire_lease', return_value=False)
+    mocker.patch('serverless.LEASE_WAIT', 0)
+
+    with pytest.raises(LeaseTimeout):
+        async with chat_state(application, -100, None):
+            pass
+
+@pytest.mark.asyncio
+async def test_repeating_timers_are_rearmed(mocker, application, store):
+    """Test that a repeating timer is stored again for its next run each time it fires."""
+    mocker.patch('serverless.time.time', return_value=1000.0)
+    async with chat_state(application, -100, None):
+        application.job_queue.run_repeating(timer_callback, 60, data={'round': 1}, chat_id=-100, name='tick_-100')
+
+    assert await fire_due_timers(application) == 1
+    assert store['timers']['tick_-100']['due_at'] == 1060.0
+    assert store['timers']['tick_-100']['interval'] == 60
+    assert await fire_due_timers(application) == 0
+
+@pytest.mark.asyncio
+async def test_repeating_timer_stops_after_last(mocker, application, store):
+    """Test that a repeating timer is not re-armed past its ``last`` run."""
+    mocker.patch('serverless.time.time', return_value=1000.0)
+    async with chat_state(application, -100, None):
+        application.job_queue.run_repeating(timer_callback, 60, last=30, chat_id=-100, name='tick_-100')
+
+    assert await fire_due_timers(application) == 1
+    assert store['timers'] == {}
+
+@pytest.mark.asyncio
+async def test_timer_survives_a_failed_invocation(mocker, application, store):
+    """Test that a claimed timer whose chat state cannot be loaded runs again once the claim expires."""
+    clock = mocker.patch('serverless.time.time', return_value=1000.0)
+    async with chat_state(application, -100, None):
+        application.job_queue.run_once(timer_callback, 0, data={'round': 3}, chat_id=-100, name='end_-100')
+    mocker.patch('database.get_states', side_effect=RuntimeError("Firestore unavailable"))
+
+    assert await fire_due_timers(application) == 0
+    assert 'end_-100' in store['timers']
+
+    mocker.patch('database.get_states', return_value={})
+    assert await fire_due_timers(application) == 0  # Still claimed
+    clock.return_value = 1000.0 + serverless.TIMER_CLAIM_TTL
+    assert await fire_due_timers(application) == 1
+    assert store['timers'] == {}
+
+@pytest.mark.asyncio
+async def test_post_update_failures_do_not_fail_the_update(mocker, application, store):
+    """Test that errors after the update was handled are logged instead of making Telegram redeliver it."""
+    process_update = mocker.patch.object(Application, 'process_update')
+    mocker.patch('serverless.fire_due_timers', side_effect=LeaseTimeout('chat_-200'))
+    update = {'update_id': 1, 'message': {'message_id': 5, 'date': 0, 'chat': {'id': -100, 'type': 'group'},
+                                          'from': {'id': 7, 'is_bot': False, 'first_name': 'A'}, 'text': 'hi'}}
+
+    await serverless.handle_update(application, update)
+
+    process_update.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_attributed_timers_keep_their_origin(mocker, application, store):
+    """Test that a timer wrapped with attributed_job is stored by its own name and charged to its job."""
+    import firestore_costs
+    async with chat_state(application, -100, None):
+        application.job_queue.run_once(firestore_costs.attributed_job('end_round', timer_callback), -1,
+                                       chat_id=-100, name='end_-100')
+    assert store['timers']['end_-100']['callback'] == f"{timer_callback.__module__}:timer_callback"
+    attributed_to = mocker.spy(firestore_costs, 'attributed_to')
+
+    assert await fire_due_timers(application) == 1
+
+    attributed_to.assert_called_once_with('job:end_round')
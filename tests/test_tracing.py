@@ -0,0 +1,101 @@
+import asyncio
+import json
+import pytest
+import structlog
+from unittest.mock import AsyncMock, MagicMock
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+import database
+import metrics
+import tracing
+
+class RecordingExporter:
+    def __init__(self):
+        self.traces = []
+
+    def export(self, trace, duration):
+        self.traces.append(trace)
+
+@pytest.fixture
+def exporter():
+    exporter = RecordingExporter()
+    tracing.set_tracer(tracing.Tracer(exporter, sample_rate=0, slow_seconds=0))
+    yield exporter
+    tracing.set_tracer(None)
+
+def test_span_outside_trace_does_nothing():
+    """Test that spans are no-ops when no update is being traced."""
+    with tracing.span('db.get_user_data') as span:
+        assert span is None
+
+@pytest.mark.asyncio
+async def test_update_trace_nests_handler_and_database_spans(exporter):
+    """Test that handler, threaded database and Bot API spans land in the update's trace."""
+    @database._instrumented
+    def read_user(db, user_id):
+        return {'xp': 1}
+
+    update = MagicMock(update_id=7)
+    update.effective_chat.id = -100
+    with tracing.update_trace(update):
+        with metrics.track_handler('command:profile'):
+            assert structlog.contextvars.get_contextvars()['handler'] == 'command:profile'
+            await asyncio.to_thread(read_user, None, 1)
+
+    trace, = exporter.traces
+    spans = {span.name: span for span in trace.spans}
+    assert trace.attributes == {'update_id': 7, 'chat_id': -100, 'handler': 'command:profile'}
+    assert spans['db.read_user'].parent_id == spans['handler'].span_id
+    assert spans['handler'].parent_id == spans['update'].span_id
+    assert spans['update'].parent_id is None
+    assert 'update_id' not in structlog.contextvars.get_contextvars()
+
+def test_fast_unsampled_trace_not_exported():
+    """Test that traces below the slow threshold are dropped unless sampled."""
+    exporter = RecordingExporter()
+    tracing.set_tracer(tracing.Tracer(exporter, sample_rate=0, slow_seconds=60))
+    try:
+        with tracing.update_trace(MagicMock(update_id=1)):
+            pass
+    finally:
+        tracing.set_tracer(None)
+
+    assert exporter.traces == []
+
+def test_file_exporter_writes_span_lines(tmp_path):
+    """Test that each span is written as a JSON line carrying the trace's ids."""
+    path = tmp_path / 'traces.jsonl'
+    tracing.set_tracer(tracing.Tracer(tracing.FileSpanExporter(str(path)), sample_rate=1))
+    try:
+        with tracing.update_trace(MagicMock(update_id=3, effective_chat=None)):
+            with pytest.raises(ValueError), tracing.span('telegram.sendMessage'):
+                raise ValueError("bad request")
+    finally:
+        tracing.get_tracer().exporter.close()
+        tracing.set_tracer(None)
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [line['name'] for line in lines] == ['telegram.sendMessage', 'update']
+    assert lines[0]['error'] == 'ValueError'
+    assert {line['update_id'] for line in lines} == {3}
+    assert lines[0]['trace_id'] == lines[1]['trace_id']
+
+@pytest.mark.asyncio
+async def test_tracing_application_traces_updates(exporter, mocker):
+    """Test that TracingApplication handles each update inside a trace."""
+    application = Application.builder().token('123:ABC').updater(None).application_class(tracing.TracingApplication).build()
+    seen = []
+
+    async def callback(update, context):
+        with tracing.span('work'):
+            seen.append(update)
+
+    application.add_handler(TypeHandler(Update, callback))
+    mocker.patch('telegram.Bot.initialize', new_callable=AsyncMock)
+    async with application:
+        await application.process_update(Update(update_id=42))
+
+    trace, = exporter.traces
+    assert trace.attributes['update_id'] == 42
+    assert {span.name for span in trace.spans} == {'work', 'update'}
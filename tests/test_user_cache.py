@@ -0,0 +1,92 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import database
+from leaderboards import LeaderboardPager
+from user_cache import UserCache
+
+@pytest.fixture
+def user_cache():
+    cache = UserCache()
+    cache.apply([
+        ('ADDED', 1, {'username': 'alice', 'xp': 30}),
+        ('ADDED', 2, {'username': 'bob', 'xp': 20}),
+        ('ADDED', 3, {'username': 'carol', 'xp': 10}),
+    ])
+    database.set_user_cache(cache)
+    yield cache
+    database.set_user_cache(None)
+
+def test_apply_changes(user_cache):
+    """Test that modified and removed users update both the lookup and the ranking."""
+    user_cache.apply([
+        ('MODIFIED', 3, {'username': 'carol', 'xp': 40}),
+        ('REMOVED', 2, None),
+    ])
+
+    assert user_cache.get(3) == {'username': 'carol', 'xp': 40}
+    assert user_cache.get(2) is None
+    assert user_cache.ranking.top(5) == [('carol', 40), ('alice', 30)]
+
+@pytest.mark.asyncio
+async def test_snapshot_is_applied_on_the_loop(mocker):
+    """Test that listener callbacks from another thread are handed to the event loop."""
+    watch = MagicMock()
+    mocker.patch('database.watch_users', return_value=watch)
+    cache = UserCache()
+    cache.start(MagicMock(), asyncio.get_running_loop())
+    callback = database.watch_users.call_args.args[1]
+
+    document = MagicMock(id='5')
+    document.to_dict.return_value = {'username': 'eve', 'xp': 7}
+    change = SimpleNamespace(type=SimpleNamespace(name='ADDED'), document=document)
+    await asyncio.to_thread(callback, [document], [change], None)
+    await asyncio.sleep(0)
+
+    assert cache.ready
+    assert cache.get(5) == {'username': 'eve', 'xp': 7}
+    cache.stop()
+    watch.unsubscribe.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_get_user_data_reads_from_cache(user_cache):
+    """Test that a loaded cache serves user reads without touching Firestore."""
+    db_client = MagicMock()
+
+    assert await database.get_user_data(db_client, 1) == {'username': 'alice', 'xp': 30}
+    assert await database.get_user_data(db_client, 9) is None
+    db_client.collection.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_pager_ranks_from_cache(mocker, user_cache):
+    """Test that leaderboard pages come from the cache's ranking while it is loaded."""
+    query = mocker.patch('database.get_leaderboard_page')
+    pager = LeaderboardPager(page_size=2, snapshot_size=2)
+
+    first = await pager.get_page(MagicMock(), 0)
+    second = await pager.get_page(MagicMock(), 1)
+
+    assert first.entries == [('alice', 30), ('bob', 20)] and first.has_next
+    assert second.entries == [('carol', 10)] and second.start_rank == 3 and not second.has_next
+    query.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_closed_stream_unreadies_cache_and_restarts(mocker):
+    """Test that a closed snapshot stream sends reads back to Firestore and starts a new listener."""
+    mocker.patch('user_cache.WATCH_CHECK_INTERVAL', 0)
+    old_watch, new_watch = MagicMock(is_active=False), MagicMock(is_active=True)
+    mocker.patch('database.watch_users', side_effect=[old_watch, new_watch])
+    cache = UserCache()
+    cache.start(MagicMock(), asyncio.get_running_loop())
+    cache.apply([('ADDED', 1, {'username': 'alice', 'xp': 30})])
+
+    await asyncio.sleep(0.01)
+
+    assert not cache.ready
+    assert cache.get(1) is None and cache.ranking.top(5) == []
+    old_watch.unsubscribe.assert_called_once()
+    assert database.watch_users.call_count == 2
+    cache.stop()
+    new_watch.unsubscribe.assert_called_once()
@@ -0,0 +1,87 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+import database
+import warmup
+
+@pytest.fixture
+def application():
+    application = MagicMock()
+    application.bot_data = {}
+    return application
+
+@pytest.mark.asyncio
+async def test_warm_up_builds_client_and_connects(mocker, application):
+    """Test that warmup builds the deferred client and opens the connection."""
+    client = MagicMock()
+    application.bot_data['db'] = database.DeferredClient(lambda: client)
+    ping = mocker.patch('database.ping')
+    preload = mocker.patch('warmup.preload_caches', new_callable=AsyncMock)
+
+    await warmup.warm_up(application)
+
+    preload.assert_awaited_once_with(application)
+    assert ping.call_args.args[0].get() is client
+    application.stop_running.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_warm_up_stops_bot_when_firebase_fails(mocker, application):
+    """Test that a client that cannot be built stops the bot, as failing at startup used to."""
+    application.bot_data['db'] = database.DeferredClient(lambda: None)
+    ping = mocker.patch('database.ping')
+
+    await warmup.warm_up(application)
+
+    application.stop_running.assert_called_once()
+    ping.assert_not_called()
+
+def test_recent_activity_keeps_most_recent():
+    """Test that the tracker orders by recency and evicts the least recent."""
+    activity = warmup.RecentActivity(user_limit=2)
+    activity.touch(1)
+    activity.touch(2)
+    activity.touch(1)
+    activity.touch(3)
+
+    assert activity.user_ids() == [3, 1]
+
+@pytest.mark.asyncio
+async def test_preload_caches_loads_recent_users(mocker, application):
+    """Test that the preload fills the leaderboard and user caches and reports coverage."""
+    application.bot_data['db'] = MagicMock()
+    application.bot.get_chat_administrators = AsyncMock()
+    mocker.patch('database.get_recent_activity', return_value=[1, 2, 3])
+    prefetch = mocker.patch('database.prefetch_users', return_value=2)
+    mocker.patch('database.get_user_cache', return_value=None)
+    page = MagicMock(entries=[('alice', 10), ('bob', 5)])
+    get_page = mocker.patch('leaderboards.LeaderboardPager.get_page', new_callable=AsyncMock, return_value=page)
+
+    coverage = await warmup.preload_caches(application)
+
+    assert coverage == {'top_users': 2, 'users': 2, 'users_requested': 3}
+    get_page.assert_awaited_once_with(application.bot_data['db'], 0)
+    prefetch.assert_called_once_with(application.bot_data['db'], [1, 2, 3])
+    application.bot.get_chat_administrators.assert_not_called()  # Admin lists expire too fast to preload
+
+def test_prefetched_user_served_once(mocker):
+    """Test that a prefetched user answers one read and is dropped after an XP write."""
+    mocker.patch.dict(database._prefetched_users, clear=True)
+    snapshot = MagicMock(id='1', exists=True)
+    snapshot.to_dict.return_value = {'username': 'alice', 'xp': 10}
+    db_client = MagicMock()
+    db_client.get_all.return_value = [snapshot]
+
+    assert database.prefetch_users(db_client, [1]) == 1
+    assert 1 in database._prefetched_users
+    database._forget_prefetched_user(1)
+    assert 1 not in database._prefetched_users
+
+@pytest.mark.asyncio
+async def test_get_user_data_uses_prefetched_user(mocker):
+    """Test that get_user_data answers from a prefetched entry without reading Firestore."""
+    mocker.patch.dict(database._prefetched_users, {1: (database.time.monotonic(), {'username': 'alice', 'xp': 10})}, clear=True)
+    db_client = MagicMock()
+
+    assert await database.get_user_data(db_client, 1) == {'username': 'alice', 'xp': 10}
+    db_client.collection.assert_not_called()
+    assert 1 not in database._prefetched_users
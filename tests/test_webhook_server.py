@@ -0,0 +1,94 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from fastapi.testclient import TestClient
+from telegram.ext import SimpleUpdateProcessor
+
+import webhook_server
+from webhook_server import SECRET_TOKEN_HEADER, UpdateQueues, create_app
+from workers import shard_for
+
+SECRET = 'test-secret'
+
+def _update(update_id, chat_id=-100):
+    return {'update_id': update_id, 'message': {'message_id': update_id, 'date': 0, 'chat': {'id': chat_id, 'type': 'group'}}}
+
+@pytest.fixture
+def application():
+    application = MagicMock()
+    application.__aenter__ = AsyncMock(return_value=application)
+    application.__aexit__ = AsyncMock(return_value=False)
+    application.post_init = AsyncMock()
+    application.post_shutdown = AsyncMock()
+    application.start = AsyncMock()
+    application.stop = AsyncMock()
+    application.process_update = AsyncMock()
+    application.update_processor = SimpleUpdateProcessor(1)
+    application.bot.set_webhook = AsyncMock()
+    return application
+
+def test_webhook_rejects_wrong_secret(application):
+    """Test that requests without Telegram's secret token are refused before queueing."""
+    with TestClient(create_app(application, SECRET)) as client:
+        response = client.post(webhook_server.WEBHOOK_PATH, json=_update(1), headers={SECRET_TOKEN_HEADER: 'nope'})
+
+        assert response.status_code == 403
+        assert client.get('/queue').json()['depth'] == 0
+
+def test_webhook_acknowledges_and_processes(application):
+    """Test that accepted updates are acknowledged and then handled by the application."""
+    with TestClient(create_app(application, SECRET, webhook_url='https://example.com')) as client:
+        response = client.post(webhook_server.WEBHOOK_PATH, json=_update(1), headers={SECRET_TOKEN_HEADER: SECRET})
+        assert response.status_code == 200
+
+    # Shutdown drains the queue before stopping the application
+    application.process_update.assert_awaited_once()
+    assert application.process_update.call_args.args[0].update_id == 1
+    application.bot.set_webhook.assert_awaited_once()
+    assert application.bot.set_webhook.call_args.kwargs['url'] == 'https://example.com' + webhook_server.WEBHOOK_PATH
+    application.post_shutdown.assert_awaited_once_with(application)
+
+@pytest.mark.asyncio
+async def test_full_queue_rejects_updates(application):
+    """Test that a chat whose queue is full is refused instead of buffering without bound."""
+    queues = UpdateQueues(application, consumers=2, capacity=2)
+
+    assert queues.submit(_update(1, chat_id=-100))
+    assert not queues.submit(_update(2, chat_id=-100))
+    assert queues.submit(_update(3, chat_id=-101))
+    assert queues.depth() == 2 and queues.rejected == 1
+
+@pytest.mark.asyncio
+async def test_consumers_keep_chat_order(application):
+    """Test that one chat's updates are processed in the order they arrived."""
+    processed = []
+    application.process_update = AsyncMock(side_effect=lambda update: processed.append(update.update_id))
+    queues = UpdateQueues(application, consumers=4, capacity=40)
+    queues.start()
+    for update_id in range(5):
+        queues.submit(_update(update_id))
+
+    await queues.stop()
+
+    assert processed == [0, 1, 2, 3, 4]
+
+def test_sharded_webhook_hands_updates_to_workers(mocker):
+    """Test that the multi-process front-end registers the webhook and queues updates by chat, 503 when full."""
+    import queue
+    from workers import ShardDispatcher
+
+    bot = AsyncMock()
+    bot.__aenter__.return_value = bot
+    mocker.patch('webhook_server.Bot', return_value=bot)
+    worker_queues = [queue.Queue(maxsize=1), queue.Queue(maxsize=1)]
+    app = webhook_server.create_sharded_app('123:ABC', ShardDispatcher(worker_queues), SECRET,
+                                            webhook_url='https://example.com')
+
+    with TestClient(app) as client:
+        headers = {SECRET_TOKEN_HEADER: SECRET}
+        assert client.post(webhook_server.WEBHOOK_PATH, json=_update(1), headers={SECRET_TOKEN_HEADER: 'nope'}).status_code == 403
+        assert client.post(webhook_server.WEBHOOK_PATH, json=_update(1), headers=headers).status_code == 200
+        assert client.post(webhook_server.WEBHOOK_PATH, json=_update(2), headers=headers).status_code == 503
+
+    assert bot.set_webhook.call_args.kwargs['url'] == 'https://example.com' + webhook_server.WEBHOOK_PATH
+    assert worker_queues[shard_for(-100, 2)].get_nowait()['update_id'] == 1
@@ -0,0 +1,77 @@
+import asyncio
+import queue
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+import workers
+from workers import ShardDispatcher, shard_for, update_chat_id
+
+def test_update_chat_id():
+    """Test finding the owning chat for the update types the bot handles."""
+    assert update_chat_id({'update_id': 1, 'message': {'chat': {'id': -100}}}) == -100
+    assert update_chat_id({'update_id': 2, 'callback_query': {'from': {'id': 7}, 'message': {'chat': {'id': -200}}}}) == -200
+    assert update_chat_id({'update_id': 3, 'callback_query': {'from': {'id': 7}}}) == 7
+    assert update_chat_id({'update_id': 4, 'inline_query': {'from': {'id': 8}}}) == 8
+    assert update_chat_id({'update_id': 5}) == 5
+
+def test_shard_for_is_stable_and_in_range():
+    """Test that every chat, including negative group ids, maps to one valid worker."""
+    for chat_id in (-1001234567890, -5, 0, 42):
+        assert 0 <= shard_for(chat_id, 4) < 4
+        assert shard_for(chat_id, 4) == shard_for(chat_id, 4)
+
+def test_dispatcher_routes_by_chat():
+    """Test that updates from one chat always land in the same worker queue."""
+    queues = [queue.Queue(), queue.Queue(), queue.Queue()]
+    dispatcher = ShardDispatcher(queues)
+
+    for update_id in range(3):
+        dispatcher.dispatch({'update_id': update_id, 'message': {'chat': {'id': -100}}})
+
+    owner = queues[shard_for(-100, 3)]
+    assert owner.qsize() == 3
+    assert sum(q.qsize() for q in queues) == 3
+
+def test_dispatcher_reports_full_queue():
+    """Test that non-blocking dispatch refuses updates when the owning worker is backed up."""
+    dispatcher = ShardDispatcher([queue.Queue(maxsize=1)])
+    update = {'update_id': 1, 'message': {'chat': {'id': 1}}}
+
+    assert dispatcher.dispatch(update, block=False)
+    assert not dispatcher.dispatch(update, block=False)
+
+@pytest.mark.asyncio
+async def test_run_worker_feeds_application_until_sentinel(mocker):
+    """Test that a worker turns queued JSON into updates and shuts down cleanly on None."""
+    application = MagicMock()
+    application.__aenter__ = AsyncMock(return_value=application)
+    application.__aexit__ = AsyncMock(return_value=False)
+    application.post_init = AsyncMock()
+    application.post_shutdown = AsyncMock()
+    application.start = AsyncMock()
+    application.stop = AsyncMock()
+    application.update_queue = asyncio.Queue()
+    update_queue = queue.Queue()
+    update_queue.put({'update_id': 9, 'message': {'message_id': 1, 'date': 0, 'chat': {'id': -100, 'type': 'group'}}})
+    update_queue.put(None)
+
+    await workers.run_worker(application, update_queue)
+
+    update = application.update_queue.get_nowait()
+    assert update.update_id == 9 and update.effective_chat.id == -100
+    application.post_init.assert_awaited_once_with(application)
+    application.stop.assert_awaited_once()
+    application.post_shutdown.assert_awaited_once_with(application)
+
+@pytest.mark.asyncio
+async def test_polling_leaves_a_configured_webhook_alone(mocker):
+    """Test that the polling front-end refuses to start instead of deleting a webhook."""
+    bot = AsyncMock()
+    bot.__aenter__.return_value = bot
+    bot.get_webhook_info.return_value = MagicMock(url='https://example.com/webhook')
+    mocker.patch('workers.Bot', return_value=bot)
+
+    await workers.poll_updates('123:ABC', ShardDispatcher([queue.Queue()]))
+
+    bot.delete_webhook.assert_not_called()
+    bot.get_updates.assert_not_called()
@@ -0,0 +1,126 @@
+import os
+import threading
+
+import pytest
+from unittest.mock import MagicMock
+
+from xp_journal import XpJournal
+from xp_ledger import XpLedger
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = XpJournal(str(tmp_path / 'xp.journal'))
+    journal.open()
+    yield journal
+    journal.close()
+
+def test_replay_returns_appended_events(journal):
+    """Test that appended events survive reopening the journal."""
+    journal.append({'id': 'a', 'delta': 1})
+    journal.append({'id': 'b', 'delta': 2})
+    journal.sync()
+
+    assert XpJournal(journal.path).replay() == [{'id': 'a', 'delta': 1}, {'id': 'b', 'delta': 2}]
+
+def test_replay_skips_torn_line(journal):
+    """Test that a partially written last line from a crash is ignored."""
+    journal.append({'id': 'a', 'delta': 1})
+    with open(journal.path, 'a') as f:
+        f.write('{"id": "b", "del')
+
+    assert journal.replay() == [{'id': 'a', 'delta': 1}]
+
+def test_rewrite_replaces_contents(journal):
+    """Test that rewriting keeps only the given events and appends still work afterwards."""
+    journal.append({'id': 'a', 'delta': 1})
+    journal.rewrite([{'id': 'b', 'delta': 2}])
+    journal.append({'id': 'c', 'delta': 3})
+
+    assert [event['id'] for event in journal.replay()] == ['b', 'c']
+
+def test_rewrite_keeps_events_appended_meanwhile(mocker, journal):
+    """Test that an event appended while a worker thread rewrites the journal is carried into the new file."""
+    fsync = os.fsync
+
+    def append_during_fsync(fd):
+        if journal._tail is not None and not journal._tail:
+            journal.append({'id': 'c', 'delta': 3})
+        fsync(fd)
+    mocker.patch('xp_journal.os.fsync', side_effect=append_during_fsync)
+
+    journal.rewrite([{'id': 'b', 'delta': 2}])
+
+    assert [event['id'] for event in journal.replay()] == ['b', 'c']
+
+def test_sync_and_rewrite_can_run_concurrently(journal):
+    """Test that syncing from one thread while another swaps the file never fails."""
+    def rewrite():
+        for index in range(50):
+            journal.rewrite([{'id': str(index), 'delta': 1}])
+            journal.append({'id': f"{index}+", 'delta': 1})
+
+    def sync():
+        for _ in range(200):
+            journal.append({'id': 's', 'delta': 1})
+            journal.sync()
+
+    threads = [threading.Thread(target=rewrite), threading.Thread(target=sync)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert journal.replay()[0] == {'id': '49', 'delta': 1}
+
+@pytest.mark.asyncio
+async def test_ledger_flush_truncates_journal(mocker, journal):
+    """Test that written events leave the journal while unwritten ones stay."""
+    mocker.patch('database.write_xp_events', return_value=1)
+    ledger = XpLedger(journal=journal)
+    ledger.append(1, 'user1', 1, 'message')
+    second = ledger.append(2, 'user2', 1, 'message')
+
+    await ledger.flush(MagicMock())
+
+    assert [event['id'] for event in journal.replay()] == [second['id']]
+
+@pytest.mark.asyncio
+async def test_ledger_recovers_unwritten_events(mocker, journal):
+    """Test that startup re-buffers journaled events that never reached Firestore."""
+    crashed = XpLedger(journal=journal)
+    written = crashed.append(1, 'user1', 1, 'message')
+    lost = crashed.append(1, 'user1', 4, 'message', chat_id=-100)
+    mocker.patch('database.get_existing_xp_event_ids', return_value={written['id']})
+
+    ledger = XpLedger(journal=journal)
+    assert await ledger.recover(MagicMock()) == 1
+
+    assert ledger.pending_xp(1) == 4
+    assert ledger.pending_chat_xp(-100, 1) == 4
+    assert [event['id'] for event in journal.replay()] == [lost['id']]
+
+@pytest.mark.asyncio
+async def test_ledger_keeps_journal_when_recovery_cannot_check(mocker, journal):
+    """Test that unverifiable journaled events are neither replayed nor dropped, and are retried on flush."""
+    crashed = XpLedger(journal=journal)
+    written = crashed.append(1, 'user1', 1, 'message')
+    lost = crashed.append(1, 'user1', 4, 'message')
+    check = mocker.patch('database.get_existing_xp_event_ids', return_value=None)
+    write = mocker.patch('database.write_xp_events', side_effect=lambda db_client, events: len(events))
+
+    ledger = XpLedger(journal=journal)
+    assert await ledger.recover(MagicMock()) == 0
+    assert ledger.pending_xp(1) == 0
+    new = ledger.append(2, 'user2', 1, 'message')
+
+    await ledger.flush(MagicMock())
+
+    # The check failed again: only the new event is written and the old ones stay journaled
+    assert [event['id'] for event in write.call_args.args[1]] == [new['id']]
+    assert [event['id'] for event in journal.replay()] == [written['id'], lost['id']]
+
+    check.return_value = {written['id']}
+    await ledger.flush(MagicMock())
+
+    assert [event['id'] for event in write.call_args.args[1]] == [lost['id']]
+    assert journal.replay() == []
@@ -0,0 +1,132 @@
+import pytest
+from unittest.mock import MagicMock
+
+import database
+from xp_ledger import XpLedger
+
+@pytest.fixture
+def ledger():
+    ledger = XpLedger(compaction_limit=10, chunk_size=2)
+    database.set_xp_ledger(ledger)
+    yield ledger
+    database.set_xp_ledger(None)
+
+def test_append_tracks_pending_xp(ledger):
+    """Test that appended XP counts as pending for the user and the chat member."""
+    ledger.append(1, 'user1', 1, 'message', chat_id=-100)
+    ledger.append(1, 'user1', 2, 'message')
+
+    assert ledger.pending_xp(1) == 3
+    assert ledger.pending_chat_xp(-100, 1) == 1
+    assert ledger.pending_xp(2) == 0
+
+@pytest.mark.asyncio
+async def test_flush_requeues_unwritten_events(mocker, ledger):
+    """Test that events left over from a partial write are retried first."""
+    write = mocker.patch('database.write_xp_events', return_value=1)
+    first = ledger.append(1, 'user1', 1, 'message')
+    second = ledger.append(2, 'user2', 1, 'message')
+
+    await ledger.flush(MagicMock())
+    third = ledger.append(3, 'user3', 1, 'message')
+    write.return_value = 2
+    await ledger.flush(MagicMock())
+
+    assert write.call_args_list[0].args[1] == [first, second]
+    assert write.call_args_list[1].args[1] == [second, third]
+
+@pytest.mark.asyncio
+async def test_compact_applies_events_in_chunks(mocker, ledger):
+    """Test that compaction flushes, folds listed events chunk by chunk and settles pending XP."""
+    events = [ledger.append(1, 'user1', 1, 'message', chat_id=-100) for _ in range(3)]
+    ids = [event['id'] for event in events]
+    mocker.patch('database.write_xp_events', side_effect=lambda db_client, batch: len(batch))
+    mocker.patch('database.get_unapplied_xp_event_ids', return_value=ids)
+    apply = mocker.patch('database.apply_xp_events', side_effect=lambda db_client, chunk: [
+        event for event in events if event['id'] in chunk
+    ])
+
+    assert await ledger.compact(MagicMock()) == 3
+
+    assert [call.args[1] for call in apply.call_args_list] == [ids[:2], ids[2:]]
+    assert ledger.pending_xp(1) == 0
+    assert ledger.pending_chat_xp(-100, 1) == 0
+
+@pytest.mark.asyncio
+async def test_compact_settles_events_applied_elsewhere(mocker, ledger):
+    """Test that written events missing from a complete listing are no longer pending."""
+    ledger.append(1, 'user1', 5, 'message')
+    mocker.patch('database.write_xp_events', side_effect=lambda db_client, batch: len(batch))
+    mocker.patch('database.get_unapplied_xp_event_ids', return_value=[])
+
+    assert await ledger.compact(MagicMock()) == 0
+    assert ledger.pending_xp(1) == 0
+
+@pytest.mark.asyncio
+async def test_compact_keeps_events_pending_when_listing_fails(mocker, ledger):
+    """Test that a failed listing of unapplied events settles nothing."""
+    ledger.append(1, 'user1', 5, 'message')
+    mocker.patch('database.write_xp_events', side_effect=lambda db_client, batch: len(batch))
+    mocker.patch('database.get_unapplied_xp_event_ids', return_value=None)
+
+    assert await ledger.compact(MagicMock()) == 0
+    assert ledger.pending_xp(1) == 5
+
+@pytest.mark.asyncio
+async def test_compact_keeps_unwritten_events_pending(mocker, ledger):
+    """Test that events that failed to write stay pending after compaction."""
+    ledger.append(1, 'user1', 5, 'message')
+    mocker.patch('database.write_xp_events', return_value=0)
+    mocker.patch('database.get_unapplied_xp_event_ids', return_value=[])
+
+    await ledger.compact(MagicMock())
+
+    assert ledger.pending_xp(1) == 5
+
+def test_append_xp_without_ledger_falls_back():
+    """Test that append_xp declines when no ledger is configured."""
+    assert database.append_xp(1, 'user1', 1, 'message') is False
+
+def test_append_xp_notifies_listeners(ledger):
+    """Test that ledger appends reach XP listeners like in-place writes do."""
+    listener = MagicMock()
+    database.add_xp_listener(listener)
+    try:
+        assert database.append_xp(1, 'user1', 1, 'message', chat_id=-100) is True
+    finally:
+        database.remove_xp_listener(listener)
+
+    listener.assert_called_once_with(1, 'user1', 1)
+    assert ledger.pending_xp(1) == 1
+
+def test_get_user_data_includes_pending_xp(ledger):
+    """Test that a user's balance includes XP that is not compacted yet."""
+    db_client = MagicMock()
+    doc = db_client.collection.return_value.document.return_value.get.return_value
+    doc.exists = True
+    doc.to_dict.return_value = {'username': 'user1', 'xp': 10}
+    ledger.append(1, 'user1', 3, 'message')
+
+    assert database._get_user_data_sync(db_client, 1) == {'username': 'user1', 'xp': 13}
+
+def test_apply_xp_events_transaction_folds_unapplied_events():
+    """Test that compaction increments balances once per user and marks events applied."""
+    db_client = MagicMock()
+    transaction = MagicMock()
+    unapplied = MagicMock(exists=True, id='e1')
+    unapplied.to_dict.return_value = {'user_id': 1, 'username': 'user1', 'delta': 2, 'chat_id': -100, 'applied': False}
+    also_unapplied = MagicMock(exists=True, id='e2')
+    also_unapplied.to_dict.return_value = {'user_id': 1, 'username': None, 'delta': 3, 'chat_id': None, 'applied': False}
+    already_applied = MagicMock(exists=True, id='e3')
+    already_applied.to_dict.return_value = {'user_id': 1, 'username': 'user1', 'delta': 100, 'chat_id': None, 'applied': True}
+    db_client.get_all.return_value = [unapplied, also_unapplied, already_applied]
+
+    applied = database._apply_xp_events_transaction.to_wrap(transaction, db_client, ['e1', 'e2', 'e3'])
+
+    assert [event['id'] for event in applied] == ['e1', 'e2']
+    assert transaction.update.call_count == 2
+    transaction.update.assert_any_call(unapplied.reference, {'applied': True})
+    user_writes = [call for call in transaction.set.call_args_list if call.args[1]['xp'].value == 5]
+    assert len(user_writes) == 1
+    assert user_writes[0].args[1]['username'] == 'user1'
+    assert transaction.set.call_count == 2  # One user balance, one chat counter
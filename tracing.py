@@ -0,0 +1,206 @@
+"""Per-update traces for breaking down slow updates after the fact.
+
+``TracingApplication.process_update`` opens a trace for every update and
+binds ``update_id``, ``chat_id`` and (once routed) ``handler`` into
+structlog's context, so every log line of the update carries them. Database
+operations, Bot API calls and handlers record timed spans into the current
+trace through ``span``.
+
+Spans are recorded for every update, which costs a few clock reads, and a
+finished trace is exported when it was sampled (``TRACE_SAMPLE_RATE``) or
+took longer than ``TRACE_SLOW_SECONDS``, so slow updates are always kept.
+``FileSpanExporter`` writes one JSON line per span to ``TRACE_FILE``;
+without ``TRACE_FILE`` tracing is off and ``span`` does nothing.
+
+The trace lives in a context variable. Blocking calls that should show up
+in it must run through ``asyncio.to_thread``, which copies the context into
+the worker thread; ``loop.run_in_executor`` does not.
+"""
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+import structlog
+from telegram.ext import Application
+
+logger = structlog.get_logger(__name__)
+
+TRACE_SAMPLE_RATE = 0.01  # Fraction of updates exported regardless of duration
+TRACE_SLOW_SECONDS = 1.0  # Updates slower than this are always exported
+
+_current_trace = ContextVar('current_trace', default=None)
+_active_span = ContextVar('active_span', default=None)
+_tracer = None
+
+
+class Span:
+    """A timed operation within a trace."""
+
+    __slots__ = ('name', 'parent_id', 'span_id', 'started', 'duration', 'attributes', 'error')
+
+    def __init__(self, name, parent_id, attributes):
+        self.name = name
+        self.parent_id = parent_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.started = time.time()
+        self.duration = None
+        self.attributes = attributes
+        self.error = None
+
+
+class Trace:
+    """The spans recorded while handling one update."""
+
+    def __init__(self, attributes):
+        self.trace_id = uuid.uuid4().hex
+        self.attributes = attributes
+        self.started = time.perf_counter()
+        self.spans = []  # Appended from the loop and from worker threads; list.append is atomic
+
+
+class FileSpanExporter:
+    """Appends finished traces to a JSON Lines file, one line per span."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8', buffering=1)
+
+    def export(self, trace, duration) -> None:
+        lines = [
+            json.dumps({
+                'trace_id': trace.trace_id,
+                'span_id': span.span_id,
+                'parent_id': span.parent_id,
+                'name': span.name,
+                'start': span.started,
+                'duration': span.duration,
+                'error': span.error,
+                'trace_duration': duration,
+                **trace.attributes,
+                **span.attributes,
+            }, default=str)
+            for span in trace.spans
+        ]
+        with self._lock:
+            self._file.write(''.join(line + '\n' for line in lines))
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class Tracer:
+    """Decides which finished traces are exported."""
+
+    def __init__(self, exporter, sample_rate=TRACE_SAMPLE_RATE, slow_seconds=TRACE_SLOW_SECONDS):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+
+    def finish(self, trace) -> None:
+        duration = time.perf_counter() - trace.started
+        if duration >= self.slow_seconds or random.random() < self.sample_rate:
+            try:
+                self.exporter.export(trace, duration)
+            except Exception as e:
+                logger.error("Failed to export trace", trace_id=trace.trace_id, error=e)
+
+
+def set_tracer(tracer) -> None:
+    """Starts tracing updates with ``tracer``; pass None to stop."""
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer():
+    return _tracer
+
+
+def configure_from_env():
+    """Sets up file tracing when ``TRACE_FILE`` is set. Returns the tracer, or None."""
+    path = os.getenv('TRACE_FILE')
+    if not path:
+        return None
+    tracer = Tracer(
+        FileSpanExporter(path),
+        sample_rate=float(os.getenv('TRACE_SAMPLE_RATE', TRACE_SAMPLE_RATE)),
+        slow_seconds=float(os.getenv('TRACE_SLOW_SECONDS', TRACE_SLOW_SECONDS)),
+    )
+    set_tracer(tracer)
+    logger.info("Update tracing enabled", path=path, sample_rate=tracer.sample_rate, slow_seconds=tracer.slow_seconds)
+    return tracer
+
+
+@contextmanager
+def update_trace(update):
+    """Traces the handling of ``update`` and binds its ids into structlog's context."""
+    if _tracer is None:
+        yield None
+        return
+    chat = getattr(update, 'effective_chat', None)
+    attributes = {'update_id': getattr(update, 'update_id', None), 'chat_id': chat.id if chat else None}
+    trace = Trace(attributes)
+    token = _current_trace.set(trace)
+    span_token = _active_span.set(None)
+    try:
+        with structlog.contextvars.bound_contextvars(**attributes, trace_id=trace.trace_id):
+            with span('update'):
+                yield trace
+    finally:
+        _active_span.reset(span_token)
+        _current_trace.reset(token)
+        _tracer.finish(trace)
+
+
+def span(name, **attributes):
+    """Times the ``with`` block as a span of the current trace; does nothing outside a trace."""
+    trace = _current_trace.get()
+    if trace is None:
+        return nullcontext()
+    return _span(trace, name, attributes)
+
+
+@contextmanager
+def _span(trace, name, attributes):
+    parent = _active_span.get()
+    current = Span(name, parent.span_id if parent else None, attributes)
+    token = _active_span.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        current.duration = time.perf_counter() - started
+        _active_span.reset(token)
+        trace.spans.append(current)
+
+
+@contextmanager
+def handler_span(name):
+    """Spans a handler and adds its name to the trace and to structlog's context."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    trace.attributes.setdefault('handler', name)
+    with structlog.contextvars.bound_contextvars(handler=name):
+        with _span(trace, 'handler', {'handler': name}):
+            yield
+
+
+class TracingApplication(Application):
+    """``Application`` that handles every update inside ``update_trace``."""
+
+    __slots__ = ()
+
+    async def process_update(self, update) -> None:
+        with update_trace(update):
+            await super().process_update(update)
@@ -0,0 +1,95 @@
+"""In-memory copy of the ``users`` collection kept current by a snapshot listener.
+
+When several bot instances share a Firestore project, caches filled from
+reads go stale as soon as another replica writes. ``UserCache`` instead
+subscribes to the collection with ``on_snapshot``: the first snapshot loads
+every user and later ones push each change, so every replica can serve user
+reads and the global leaderboard from memory and still see other replicas'
+writes within seconds.
+
+Firestore delivers snapshots on a background thread; they are handed to the
+event loop, so the cache and its ``RankIndex`` are only touched from there.
+The listener has no error callback, so the loop also checks that the stream
+is still open: once it closes the cache is emptied and unready (reads go back
+to Firestore) and a new listener is started, which reloads every user.
+"""
+import structlog
+
+import database as db
+import firestore_costs
+from leaderboards import RankIndex
+
+logger = structlog.get_logger(__name__)
+
+WATCH_CHECK_INTERVAL = 10  # Seconds between checks that the users snapshot stream is still open
+
+
+class UserCache:
+    """Users by id plus a ranking by XP, updated from Firestore snapshots."""
+
+    def __init__(self):
+        self.ranking = RankIndex()
+        self.ready = False  # True once the initial snapshot has loaded every user
+        self._users = {}  # user_id -> document data
+        self._watch = None
+        self._loop = None
+        self._db_client = None
+        self._check_handle = None
+
+    def start(self, db_client, loop) -> None:
+        """Subscribes to the users collection; snapshots are applied on ``loop``."""
+        self._db_client = db_client
+        self._loop = loop
+        self._watch = db.watch_users(db_client, self._on_snapshot)
+        self._check_handle = loop.call_later(WATCH_CHECK_INTERVAL, self._check_watch)
+        logger.info("Users snapshot listener started")
+
+    def stop(self) -> None:
+        if self._check_handle is not None:
+            self._check_handle.cancel()
+            self._check_handle = None
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def get(self, user_id):
+        """Returns a copy of a user's data, or None if they have no document."""
+        data = self._users.get(user_id)
+        return dict(data) if data is not None else None
+
+    def apply(self, changes) -> None:
+        """Applies ``(change_type, user_id, data)`` tuples, where change_type is ADDED, MODIFIED or REMOVED."""
+        for change_type, user_id, data in changes:
+            if change_type == 'REMOVED':
+                self._users.pop(user_id, None)
+                self.ranking.discard(user_id)
+            else:
+                self._users[user_id] = data
+                self.ranking.set(user_id, data.get('username', 'Unknown'), data.get('xp', 0))
+        if not self.ready:
+            self.ready = True
+            logger.info("User cache loaded", users=len(self._users))
+
+    def _check_watch(self) -> None:
+        """Restarts the listener, with the cache unready until it reloads, if its stream has closed."""
+        if not self._watch.is_active:
+            logger.warning("Users snapshot stream closed; reading users from Firestore until it restarts")
+            self._watch.unsubscribe()
+            self._users = {}
+            self.ranking = RankIndex()
+            self.ready = False
+            try:
+                self._watch = db.watch_users(self._db_client, self._on_snapshot)
+            except Exception as e:
+                logger.error("Could not restart users snapshot listener", error=e)
+        self._check_handle = self._loop.call_later(WATCH_CHECK_INTERVAL, self._check_watch)
+
+    def _on_snapshot(self, docs, changes, read_time) -> None:
+        # Runs on the listener thread: convert the changes here, apply them on the loop
+        with firestore_costs.attributed_to('listener:users'):
+            firestore_costs.record('watch_users', reads=len(changes))
+        converted = [
+            (change.type.name, int(change.document.id), change.document.to_dict() or {})
+            for change in changes
+        ]
+        self._loop.call_soon_threadsafe(self.apply, converted)
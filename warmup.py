@@ -0,0 +1,129 @@
+"""Background work started once the bot is already receiving updates.
+
+Startup only builds the Application. The Firestore client is a
+``database.DeferredClient``, and ``warm_up`` builds it and opens its
+connection in the background, so the first update rarely pays for either.
+Startup steps that need Firestore run here too.
+
+The warmup then fills the caches the first commands after a restart would
+otherwise fill one by one: the leaderboard snapshot and the users seen most
+recently before the restart. ``RecentActivity`` remembers those users and is
+saved to Firestore periodically and at shutdown for the next start. Chat
+admin lists are not preloaded: they are only trusted for
+``handlers.decorators.ADMIN_CACHE_TTL``, which is too short to outlast a warmup.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+import structlog
+
+import database as db
+import leaderboards
+
+logger = structlog.get_logger(__name__)
+
+RECENT_USERS_LIMIT = 500  # Users whose data is preloaded
+RECENT_ACTIVITY_SAVE_INTERVAL = 300  # seconds between saves of the recent activity
+
+
+class RecentActivity:
+    """The most recently active users, least recent evicted first."""
+
+    def __init__(self, user_limit=RECENT_USERS_LIMIT):
+        self.user_limit = user_limit
+        self._users = OrderedDict()
+
+    def touch(self, user_id) -> None:
+        """Records activity by a user."""
+        self._users[user_id] = None
+        self._users.move_to_end(user_id)
+        if len(self._users) > self.user_limit:
+            self._users.popitem(last=False)
+
+    def user_ids(self):
+        """Returns the recent users, most recent first."""
+        return list(reversed(self._users))
+
+    async def save(self, db_client) -> None:
+        await asyncio.to_thread(db.save_recent_activity, db_client, self.user_ids())
+
+
+def get_recent_activity(bot_data) -> RecentActivity:
+    """Returns the application's recent activity tracker, creating it on first use."""
+    activity = bot_data.get('recent_activity')
+    if activity is None:
+        activity = bot_data['recent_activity'] = RecentActivity()
+    return activity
+
+
+async def save_recent_activity_job(context) -> None:
+    """Job queue callback that saves the recent activity for the next startup."""
+    await get_recent_activity(context.bot_data).save(context.bot_data['db'])
+
+
+async def warm_up(application) -> None:
+    """Builds the Firestore client, then runs startup steps that depend on it."""
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    db_client = application.bot_data['db']
+
+    if isinstance(db_client, db.DeferredClient):
+        if await asyncio.to_thread(db_client.get) is None:
+            logger.error("Failed to initialize Firebase. Stopping.")
+            application.stop_running()
+            return
+    try:
+        await asyncio.to_thread(db.ping, db_client)
+    except Exception as e:
+        logger.warning("Firestore warmup read failed", error=e)
+
+    # Replicas sharing a Firestore project keep user reads in memory and in sync
+    if os.getenv('USERS_SNAPSHOT_LISTENER') == '1':
+        from user_cache import UserCache
+
+        user_cache = UserCache()
+        user_cache.start(db_client, loop)
+        db.set_user_cache(user_cache)
+
+    await preload_caches(application)
+    logger.info("Warmup finished", seconds=round(time.perf_counter() - started, 3))
+
+
+async def preload_caches(application) -> dict:
+    """Concurrently fills the leaderboard and user caches. Returns the coverage logged."""
+    started = time.perf_counter()
+    db_client = application.bot_data['db']
+    user_ids = await asyncio.to_thread(db.get_recent_activity, db_client)
+
+    top_users, users = await asyncio.gather(
+        _preload_top_users(application),
+        _preload_users(db_client, user_ids),
+    )
+    coverage = {
+        'top_users': top_users,
+        'users': users,
+        'users_requested': len(user_ids),
+    }
+    logger.info("Caches preloaded", seconds=round(time.perf_counter() - started, 3), **coverage)
+    return coverage
+
+
+async def _preload_top_users(application) -> int:
+    try:
+        page = await leaderboards.get_pager(application.bot_data).get_page(application.bot_data['db'], 0)
+    except Exception as e:
+        logger.warning("Leaderboard preload failed", error=e)
+        return 0
+    return len(page.entries)
+
+
+async def _preload_users(db_client, user_ids) -> int:
+    if not user_ids or db.get_user_cache() is not None:
+        return 0  # The snapshot listener already holds every user
+    try:
+        return await asyncio.to_thread(db.prefetch_users, db_client, user_ids)
+    except Exception as e:
+        logger.warning("User preload failed", error=e)
+        return 0
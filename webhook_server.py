@@ -0,0 +1,187 @@
+"""ASGI webhook front-end.
+
+Telegram retries a webhook delivery that is not answered quickly, so the
+endpoint only checks the secret token, parses the update and queues it; the
+200 goes back before any handler runs. Updates are spread over a fixed set of
+bounded queues by chat (see ``workers.shard_for``), each drained in order by
+one consumer task, so a chat's updates are handled sequentially while chats
+run concurrently. When a chat's queue is full the endpoint answers 503 and
+Telegram redelivers later, which is the backpressure. ``/queue`` reports the
+current depth.
+
+Enable with ``WEBHOOK_SERVER=asgi`` alongside ``WEBHOOK_URL``. With
+``BOT_WORKERS`` > 1 and ``WEBHOOK_URL`` set, ``create_sharded_app`` serves as
+the front-end instead and hands each update to its chat's worker process.
+"""
+import asyncio
+import hmac
+import secrets
+from contextlib import asynccontextmanager
+
+import structlog
+from fastapi import FastAPI, Request, Response
+from telegram import Bot, Update
+
+from workers import shard_for, update_chat_id
+
+logger = structlog.get_logger(__name__)
+
+WEBHOOK_PATH = '/webhook'
+WEBHOOK_QUEUE_SIZE = 1000  # Updates buffered across all consumers before answering 503
+WEBHOOK_CONSUMERS = 16  # Chats are spread over this many ordered consumers
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class UpdateQueues:
+    """Bounded per-consumer queues that feed updates to an Application."""
+
+    def __init__(self, application, consumers=WEBHOOK_CONSUMERS, capacity=WEBHOOK_QUEUE_SIZE):
+        self.application = application
+        self.capacity = capacity
+        self.rejected = 0
+        per_queue = max(1, capacity // consumers)
+        self._queues = [asyncio.Queue(maxsize=per_queue) for _ in range(consumers)]
+        self._tasks = []
+
+    def depth(self) -> int:
+        return sum(update_queue.qsize() for update_queue in self._queues)
+
+    def submit(self, data) -> bool:
+        """Queues a JSON update for its chat's consumer. Returns False when that queue is full."""
+        update_queue = self._queues[shard_for(update_chat_id(data), len(self._queues))]
+        try:
+            update_queue.put_nowait(data)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        return True
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._consume(update_queue)) for update_queue in self._queues]
+
+    async def stop(self) -> None:
+        """Handles everything already queued, then stops the consumers."""
+        await asyncio.gather(*(update_queue.join() for update_queue in self._queues))
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _consume(self, update_queue) -> None:
+        while True:
+            data = await update_queue.get()
+            try:
+                # process_update routes handler errors to the application's error handlers; the
+                # update processor decides when it runs relative to other consumers' updates
+                update = Update.de_json(data, self.application.bot)
+                await self.application.update_processor.process_update(update, self.application.process_update(update))
+            except Exception as e:
+                logger.error("Failed to process webhook update", update_id=data.get('update_id'), error=e)
+            finally:
+                update_queue.task_done()
+
+
+def create_app(application, secret_token, webhook_url=None, consumers=WEBHOOK_CONSUMERS,
+               capacity=WEBHOOK_QUEUE_SIZE) -> FastAPI:
+    """Builds the ASGI app that owns ``application``'s lifecycle.
+
+    With ``webhook_url`` the webhook is registered with Telegram on startup,
+    pointing at ``webhook_url + WEBHOOK_PATH`` with ``secret_token``.
+    """
+    queues = UpdateQueues(application, consumers=consumers, capacity=capacity)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        async with application:
+            if application.post_init:
+                await application.post_init(application)
+            await application.start()
+            queues.start()
+            if webhook_url:
+                await _set_webhook(application.bot, webhook_url, secret_token)
+            logger.info("Webhook server started", consumers=consumers, capacity=capacity)
+            yield
+            await queues.stop()
+            await application.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+    app = FastAPI(lifespan=lifespan)
+    app.state.update_queues = queues
+
+    @app.post(WEBHOOK_PATH)
+    async def telegram_webhook(request: Request) -> Response:
+        data = await _read_update(request, secret_token)
+        if isinstance(data, Response):
+            return data
+        if not queues.submit(data):
+            logger.warning("Webhook queue full, asking Telegram to retry", depth=queues.depth())
+            return Response(status_code=503)
+        return Response(status_code=200)
+
+    @app.get('/queue')
+    async def queue_depth():
+        return {'depth': queues.depth(), 'capacity': queues.capacity, 'rejected': queues.rejected}
+
+    return app
+
+
+async def _read_update(request, secret_token):
+    """Returns the update's JSON, or the response refusing a request without the secret or a JSON body."""
+    if not hmac.compare_digest(request.headers.get(SECRET_TOKEN_HEADER, ''), secret_token):
+        return Response(status_code=403)
+    try:
+        return await request.json()
+    except ValueError:
+        return Response(status_code=400)
+
+
+async def _set_webhook(bot, webhook_url, secret_token) -> None:
+    await bot.set_webhook(url=webhook_url + WEBHOOK_PATH, secret_token=secret_token, allowed_updates=Update.ALL_TYPES)
+
+
+def create_sharded_app(token, dispatcher, secret_token, webhook_url=None) -> FastAPI:
+    """Builds the front-end for ``BOT_WORKERS`` mode, queueing updates with a ``workers.ShardDispatcher``.
+
+    The worker processes run the Applications; this registers the webhook and
+    answers 503 when the worker that owns an update's chat is backed up.
+    """
+    @asynccontextmanager
+    async def lifespan(app):
+        if webhook_url:
+            async with Bot(token) as bot:
+                await _set_webhook(bot, webhook_url, secret_token)
+        logger.info("Sharded webhook server started", workers=len(dispatcher.queues))
+        yield
+
+    app = FastAPI(lifespan=lifespan)
+
+    @app.post(WEBHOOK_PATH)
+    async def telegram_webhook(request: Request) -> Response:
+        data = await _read_update(request, secret_token)
+        if isinstance(data, Response):
+            return data
+        if not dispatcher.dispatch(data, block=False):
+            logger.warning("Worker queue full, asking Telegram to retry", update_id=data.get('update_id'))
+            return Response(status_code=503)
+        return Response(status_code=200)
+
+    return app
+
+
+def run(application, webhook_url, port, secret_token=None) -> None:
+    """Serves the webhook with uvicorn until the process is stopped."""
+    import uvicorn
+
+    # A fresh secret per start is fine: the webhook is re-registered with it on startup
+    secret_token = secret_token or secrets.token_urlsafe(32)
+    app = create_app(application, secret_token, webhook_url=webhook_url)
+    uvicorn.run(app, host='0.0.0.0', port=port, log_config=None)
+
+
+def run_sharded(token, dispatcher, webhook_url, port, secret_token=None) -> None:
+    """Serves the sharded front-end with uvicorn until the process is stopped."""
+    import uvicorn
+
+    secret_token = secret_token or secrets.token_urlsafe(32)
+    app = create_sharded_app(token, dispatcher, secret_token, webhook_url=webhook_url)
+    uvicorn.run(app, host='0.0.0.0', port=port, log_config=None)
@@ -0,0 +1,207 @@
+"""Chat-sharded multi-process mode.
+
+One ``Application`` runs on one core. With ``BOT_WORKERS=N`` the bot instead
+starts N worker processes, each running a full ``Application`` without an
+updater, and a front-end that receives updates and hands each one to the
+worker that owns its chat (``chat_id % N``). The front-end is the ASGI
+webhook server when ``WEBHOOK_URL`` is set (see
+``webhook_server.create_sharded_app``) and long polling otherwise. A chat's ``chat_data``, game
+timers and lobby state therefore live in exactly one process and never need
+cross-process locking; XP and everything else shared goes through Firestore.
+
+Updates cross the process boundary as the JSON dicts Telegram sent, and each
+worker has its own XP ledger journal.
+"""
+import asyncio
+import multiprocessing
+import os
+import queue
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+import structlog
+from telegram import Bot, Update
+from telegram.error import TelegramError
+
+import database
+import tracing
+
+logger = structlog.get_logger(__name__)
+
+WORKER_QUEUE_SIZE = 1000  # Updates buffered per worker before the front-end blocks
+POLL_TIMEOUT = 30  # seconds for long polling getUpdates
+WORKER_SHUTDOWN_TIMEOUT = 30  # seconds to wait for a worker to flush and exit
+
+# Update fields whose value carries the chat, in the order Telegram documents them
+_CHAT_FIELDS = (
+    'message', 'edited_message', 'channel_post', 'edited_channel_post',
+    'business_message', 'edited_business_message', 'message_reaction',
+    'message_reaction_count', 'chat_boost', 'removed_chat_boost',
+    'my_chat_member', 'chat_member', 'chat_join_request',
+)
+# Update fields without a chat, sharded by the user instead
+_USER_FIELDS = ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query', 'poll_answer')
+
+
+def update_chat_id(data) -> int:
+    """Returns the chat an update belongs to, from its JSON form.
+
+    Updates without a chat fall back to the sending user, then to the update id.
+    """
+    for field in _CHAT_FIELDS:
+        item = data.get(field)
+        if item and 'chat' in item:
+            return item['chat']['id']
+    callback_query = data.get('callback_query')
+    if callback_query:
+        message = callback_query.get('message')
+        if message and 'chat' in message:
+            return message['chat']['id']
+        return callback_query['from']['id']
+    for field in _USER_FIELDS:
+        item = data.get(field)
+        if item:
+            user = item.get('from') or item.get('user')
+            if user:
+                return user['id']
+    return data.get('update_id', 0)
+
+
+def shard_for(chat_id, worker_count) -> int:
+    """Maps a chat to a worker index; Python's modulo keeps negative chat ids in range."""
+    return chat_id % worker_count
+
+
+class ShardDispatcher:
+    """Hands JSON updates to the worker queue that owns their chat."""
+
+    def __init__(self, queues):
+        self.queues = queues
+
+    def dispatch(self, data, block=True) -> bool:
+        """Queues an update. With ``block=False`` returns False instead of waiting on a full queue."""
+        worker_queue = self.queues[shard_for(update_chat_id(data), len(self.queues))]
+        try:
+            worker_queue.put(data, block=block)
+        except queue.Full:
+            return False
+        return True
+
+
+async def poll_updates(token, dispatcher) -> None:
+    """Long-polls Telegram and dispatches every update until cancelled."""
+    async with Bot(token) as bot:
+        # getUpdates does not work while a webhook is set, and removing one here could take production offline
+        webhook = await bot.get_webhook_info()
+        if webhook.url:
+            logger.error("A webhook is set for this bot; set WEBHOOK_URL to serve it, or delete it to poll",
+                         webhook_url=webhook.url)
+            return
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=POLL_TIMEOUT, allowed_updates=Update.ALL_TYPES)
+            except TelegramError as e:
+                logger.warning("Polling failed, retrying", error=str(e))
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                # A full worker queue blocks polling, which is the backpressure we want
+                dispatcher.dispatch(update.to_dict())
+                offset = update.update_id + 1
+
+
+def _worker_main(index, update_queue, token, firebase_credentials_data, is_json_string) -> None:
+    """Process entry point: runs one Application fed from ``update_queue``."""
+    # The front-end owns Ctrl-C; workers stop when they read the shutdown sentinel
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import bot_main
+
+    # Each worker serves its own metrics and admin API ports and writes its own trace file
+    for port_variable in ('METRICS_PORT', 'ADMIN_API_PORT'):
+        if os.getenv(port_variable):
+            os.environ[port_variable] = str(int(os.environ[port_variable]) + index)
+    if os.getenv('TRACE_FILE'):
+        os.environ['TRACE_FILE'] = f"{os.environ['TRACE_FILE']}.{index}"
+    tracing.configure_from_env()
+
+    db_client = database.init_firebase(firebase_credentials_data, is_json_string=is_json_string)
+    if not db_client:
+        logger.error("Worker failed to initialize Firebase", worker=index)
+        return
+    base_journal_path = os.getenv('XP_JOURNAL_PATH', os.path.join(bot_main.SCRIPT_DIR, 'xp_ledger.journal'))
+    application = bot_main.build_application(
+        token, db_client, journal_path=f"{base_journal_path}.{index}", updater=False
+    )
+    asyncio.run(run_worker(application, update_queue, index))
+
+
+async def run_worker(application, update_queue, index=0) -> None:
+    """Feeds updates from ``update_queue`` into ``application`` until a None sentinel arrives."""
+    loop = asyncio.get_running_loop()
+    # A dedicated thread waits on the queue so the default executor stays free for Firestore calls
+    reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'worker-{index}-queue')
+    try:
+        async with application:
+            if application.post_init:
+                await application.post_init(application)
+            await application.start()
+            logger.info("Worker started", worker=index)
+            while True:
+                data = await loop.run_in_executor(reader, update_queue.get)
+                if data is None:
+                    break
+                await application.update_queue.put(Update.de_json(data, application.bot))
+            await application.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+    finally:
+        reader.shutdown(wait=False)
+    logger.info("Worker stopped", worker=index)
+
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run_sharded(token, firebase_credentials_data, is_json_string, worker_count, webhook_url=None, port=None,
+                secret_token=None) -> None:
+    """Starts ``worker_count`` worker processes and receives updates for them in this one.
+
+    With ``webhook_url`` updates arrive through the sharded webhook front-end on
+    ``port``; otherwise they are long-polled.
+    """
+    # Firestore's gRPC channels are not fork-safe, so workers start from a fresh interpreter
+    context = multiprocessing.get_context('spawn')
+    queues = [context.Queue(maxsize=WORKER_QUEUE_SIZE) for _ in range(worker_count)]
+    processes = [
+        context.Process(
+            target=_worker_main,
+            args=(index, queues[index], token, firebase_credentials_data, is_json_string),
+            name=f'bot-worker-{index}',
+        )
+        for index in range(worker_count)
+    ]
+    for process in processes:
+        process.start()
+    dispatcher = ShardDispatcher(queues)
+
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+    try:
+        if webhook_url:
+            import webhook_server
+            logger.info("Sharded bot is starting with the ASGI webhook server...", workers=worker_count, port=port)
+            webhook_server.run_sharded(token, dispatcher, webhook_url, port, secret_token=secret_token)
+        else:
+            logger.info("Sharded bot is starting with polling...", workers=worker_count)
+            asyncio.run(poll_updates(token, dispatcher))
+    except KeyboardInterrupt:
+        logger.info("Stopping workers...")
+    finally:
+        for worker_queue in queues:
+            worker_queue.put(None)
+        for process in processes:
+            process.join(timeout=WORKER_SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                logger.warning("Worker did not stop in time", worker=process.name)
+                process.terminate()
@@ -0,0 +1,109 @@
+"""Crash-safe local journal for XP ledger events that are not written yet.
+
+Every event appended to the ``XpLedger`` buffer is first written as one JSON
+line to a local file. Writes go straight to the OS, so they survive the bot
+process crashing; ``sync`` fsyncs them to disk and is batched on a short
+interval so a power loss costs at most that interval. After each ledger flush
+the journal is rewritten to hold only the events that are still buffered, and
+on startup any events left in it are replayed into the ledger.
+
+``sync`` and ``rewrite`` block on the disk and run in worker threads while
+``append`` runs on the event loop; a lock guards the file object, and
+``rewrite`` only holds it to swap the new file in.
+"""
+import json
+import os
+import threading
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+XP_JOURNAL_SYNC_INTERVAL = 1  # seconds between fsyncs of the journal
+
+
+class XpJournal:
+    """Append-only JSON-lines file of buffered XP events."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._dirty = False
+        self._lock = threading.Lock()  # Held while the file object is used or swapped
+        self._tail = None  # Lines appended while a rewrite is writing its copy
+
+    def open(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def append(self, event) -> None:
+        """Records an event before it is acknowledged."""
+        line = json.dumps(event, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self._dirty = True
+            if self._tail is not None:
+                self._tail.append(line)
+
+    def sync(self) -> None:
+        """Forces appended events to disk. Blocking; safe to call from a worker thread."""
+        with self._lock:
+            if not self._dirty or self._file is None:
+                return
+            self._dirty = False
+            # A descriptor of our own, so a rewrite can close the file while this one syncs
+            fd = os.dup(self._file.fileno())
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def replay(self):
+        """Returns the events left in the journal, skipping a torn last line."""
+        if not os.path.exists(self.path):
+            return []
+        events = []
+        with open(self.path, encoding='utf-8') as journal:
+            for line_number, line in enumerate(journal, start=1):
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    logger.warning("Skipping unreadable XP journal entry", path=self.path, line=line_number)
+        return events
+
+    def rewrite(self, events) -> None:
+        """Atomically replaces the journal with ``events`` and whatever is appended meanwhile.
+
+        Blocking; run it in a worker thread.
+        """
+        with self._lock:
+            self._tail = []
+        temp_path = self.path + '.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as temp:
+                for event in events:
+                    temp.write(json.dumps(event, separators=(',', ':')) + '\n')
+                temp.flush()
+                os.fsync(temp.fileno())
+            with self._lock:
+                if self._file is not None:
+                    self._file.close()
+                os.replace(temp_path, self.path)
+                self._file = open(self.path, 'a', encoding='utf-8')
+                self._file.writelines(self._tail)
+                self._file.flush()
+                self._dirty = bool(self._tail)
+        finally:
+            with self._lock:
+                self._tail = None
+
+    def close(self) -> None:
+        self.sync()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
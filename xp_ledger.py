@@ -0,0 +1,192 @@
+"""Append-only XP ledger.
+
+Passive XP is appended as immutable events instead of being written to the
+user's balance in a transaction. ``XpLedger`` buffers events in memory and
+``flush`` writes them to the ``xp_events`` collection in batches. ``compact``
+folds unapplied events into user balances and per-chat counters with
+server-side increments, marking each event applied in the same transaction.
+
+Changes that need a balance check (transfers, steals, entry fees) keep their
+transactions and write an already-applied event alongside, so the ledger holds
+every XP change and a balance can be audited with ``database.get_xp_events``.
+
+Until an event is compacted its delta is tracked as pending, and
+``database.get_user_data`` adds it to the stored balance. With an
+``XpJournal`` attached, buffered events are also kept in a local file and
+recovered on startup, so a crash between append and flush loses nothing.
+"""
+import asyncio
+from collections import defaultdict
+
+import structlog
+
+import database as db
+
+logger = structlog.get_logger(__name__)
+
+XP_LEDGER_FLUSH_INTERVAL = 5  # seconds between batched appends
+XP_LEDGER_COMPACTION_INTERVAL = 30  # seconds between compactions
+XP_LEDGER_COMPACTION_LIMIT = 1500  # events folded per compaction run
+XP_LEDGER_COMPACTION_CHUNK = 150  # events per transaction; each may touch a user and a chat member
+
+
+class XpLedger:
+    """Buffers XP events, writes them in batches and folds them into balances."""
+
+    def __init__(self, compaction_limit=XP_LEDGER_COMPACTION_LIMIT, chunk_size=XP_LEDGER_COMPACTION_CHUNK,
+                 journal=None):
+        self.compaction_limit = compaction_limit
+        self.chunk_size = chunk_size
+        self.journal = journal
+        self._buffer = []  # events not yet written
+        self._unrecovered = []  # journaled events of a previous run that could not be checked against Firestore yet
+        self._unapplied = {}  # event id -> event, for events appended here and not yet compacted
+        self._pending_users = defaultdict(int)  # user_id -> delta not yet in the balance
+        self._pending_members = defaultdict(int)  # (chat_id, user_id) -> delta not yet in the chat counter
+        self._lock = asyncio.Lock()
+
+    def append(self, user_id, username, delta, reason, chat_id=None) -> dict:
+        """Buffers an XP event and returns it."""
+        event = db.new_xp_event(user_id, username, delta, reason, chat_id=chat_id)
+        if self.journal is not None:
+            self.journal.append(event)
+        self._buffer_event(event)
+        return event
+
+    async def recover(self, db_client) -> int:
+        """Re-buffers events left in the journal by a previous run. Returns how many.
+
+        Events that reached Firestore before the crash are dropped, since
+        writing them again could undo their compaction. If that cannot be
+        checked, the events stay in the journal and are checked again before
+        the next flush.
+        """
+        if self.journal is None:
+            return 0
+        async with self._lock:
+            self._unrecovered = self.journal.replay()
+            return await self._recover(db_client)
+
+    async def _recover(self, db_client) -> int:
+        events = self._unrecovered
+        if events:
+            existing = await _run_sync(db.get_existing_xp_event_ids, db_client, [event['id'] for event in events])
+            if existing is None:
+                logger.warning("Could not check journaled XP events; keeping them for the next flush", events=len(events))
+                return 0
+            events = [event for event in events if event['id'] not in existing]
+            # Recovered events go ahead of any appended since startup, keeping the ledger in order
+            buffered, self._buffer = self._buffer, []
+            for event in events:
+                self._buffer_event(event)
+            self._buffer.extend(buffered)
+            self._unrecovered = []
+        await _run_sync(self.journal.rewrite, list(self._buffer))
+        if events:
+            logger.info("Recovered XP events from journal", events=len(events))
+        return len(events)
+
+    def _buffer_event(self, event) -> None:
+        self._buffer.append(event)
+        self._unapplied[event['id']] = event
+        self._pending_users[event['user_id']] += event['delta']
+        if event['chat_id'] is not None:
+            self._pending_members[(event['chat_id'], event['user_id'])] += event['delta']
+
+    def pending_xp(self, user_id) -> int:
+        """XP appended for a user that is not in their stored balance yet."""
+        return self._pending_users.get(user_id, 0)
+
+    def pending_chat_xp(self, chat_id, user_id) -> int:
+        """XP appended for a chat member that is not in their stored chat counter yet."""
+        return self._pending_members.get((chat_id, user_id), 0)
+
+    async def flush(self, db_client) -> None:
+        """Writes buffered events to Firestore."""
+        async with self._lock:
+            await self._flush(db_client)
+
+    async def compact(self, db_client) -> int:
+        """Folds unapplied events into balances. Returns how many events were applied."""
+        async with self._lock:
+            await self._flush(db_client)
+            event_ids = await _run_sync(db.get_unapplied_xp_event_ids, db_client, self.compaction_limit)
+            if event_ids is None:
+                # Nothing is known about what is applied, so every written event stays pending
+                return 0
+            applied = 0
+            for start in range(0, len(event_ids), self.chunk_size):
+                events = await _run_sync(db.apply_xp_events, db_client, event_ids[start:start + self.chunk_size])
+                for event in events:
+                    self._settle(event['id'])
+                applied += len(events)
+
+            if len(event_ids) < self.compaction_limit:
+                # Every unapplied event was listed, so our written events that were
+                # not listed have been folded in by another compaction
+                listed = set(event_ids)
+                buffered = {event['id'] for event in self._buffer}
+                for event_id in [e for e in self._unapplied if e not in listed and e not in buffered]:
+                    self._settle(event_id)
+
+            if applied:
+                logger.info("XP ledger compacted", applied=applied, listed=len(event_ids))
+            return applied
+
+    async def _flush(self, db_client) -> None:
+        if self._unrecovered:
+            await self._recover(db_client)
+        if not self._buffer:
+            return
+        events, self._buffer = self._buffer, []
+        committed = await _run_sync(db.write_xp_events, db_client, events)
+        if committed < len(events):
+            # Keep the unwritten events first so they stay in order with ones appended meanwhile
+            self._buffer = events[committed:] + self._buffer
+            logger.warning("XP ledger flush incomplete", committed=committed, requeued=len(events) - committed)
+        if committed and self.journal is not None:
+            # Written events no longer need the journal; keep only what is still buffered
+            await _run_sync(self.journal.rewrite, self._unrecovered + self._buffer)
+
+    def _settle(self, event_id) -> None:
+        """Stops counting an event as pending once it is in the balances."""
+        event = self._unapplied.pop(event_id, None)
+        if event is None:
+            return
+        _decrement(self._pending_users, event['user_id'], event['delta'])
+        if event['chat_id'] is not None:
+            _decrement(self._pending_members, (event['chat_id'], event['user_id']), event['delta'])
+
+
+def _decrement(pending, key, delta):
+    remaining = pending[key] - delta
+    if remaining:
+        pending[key] = remaining
+    else:
+        del pending[key]
+
+
+async def _run_sync(func, *args):
+    """Runs a blocking database call in a worker thread, keeping the trace and cost origin."""
+    return await asyncio.to_thread(func, *args)
+
+
+async def flush_xp_ledger_job(context) -> None:
+    """Job queue callback that writes buffered ledger events."""
+    ledger = db.get_xp_ledger()
+    if ledger is not None:
+        await ledger.flush(context.bot_data['db'])
+
+
+async def sync_xp_journal_job(context) -> None:
+    """Job queue callback that batches fsyncs of the ledger's journal."""
+    ledger = db.get_xp_ledger()
+    if ledger is not None and ledger.journal is not None:
+        await _run_sync(ledger.journal.sync)
+
+
+async def compact_xp_ledger_job(context) -> None:
+    """Job queue callback that folds ledger events into user balances."""
+    ledger = db.get_xp_ledger()
+    if ledger is not None:
+        await ledger.compact(context.bot_data['db'])